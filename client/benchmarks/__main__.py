@@ -0,0 +1,38 @@
+"""Performance benchmarks of codec, effect renderer, frame planner and engine against emulated devices on loopback
+
+Usage: python -m benchmarks [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import asyncio
+import sys
+
+from benchmarks import bench_codec, bench_engine, bench_planner, bench_render
+from benchmarks.results import compare, dump
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--duration', type=float, default=1.0, help='seconds to run every benchmark')
+    parser.add_argument('--devices', type=int, default=20, help='simulated devices for throughput benchmarks')
+    parser.add_argument('--output', help='write results as JSON to the file instead of stdout')
+    parser.add_argument('--compare', help='JSON results of previous run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.1, help='relative change treated as regression')
+    args = parser.parse_args()
+
+    results = bench_codec.run(args.duration)
+    results += bench_render.run(args.duration)
+    results += bench_planner.run(args.duration)
+    results += asyncio.run(bench_engine.run(args.duration, args.devices))
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(dump(results))
+    elif not args.compare:
+        print(dump(results))
+    if args.compare:
+        return 1 if compare(results, args.compare, args.threshold) else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,46 @@
+import os
+import tempfile
+import time
+from functools import partial
+from typing import Callable
+
+from benchmarks.results import BenchmarkResult
+from enums.commands import CommandID
+from enums.packet_type import PacketType
+from models.packet import QLPPacket
+from utils.capture import Direction, QLPCaptureWriter
+
+
+def _ops_per_second(function: Callable[[], object], duration: float) -> float:
+    count = 0
+    batch = 100
+    started = time.perf_counter()
+    deadline = started + duration
+    while time.perf_counter() < deadline:
+        for _ in range(batch):
+            function()
+        count += batch
+    return count / (time.perf_counter() - started)
+
+
+def run(duration: float) -> list[BenchmarkResult]:
+    device_address = b'\xcd\xab\x00\x00'
+    packets = {
+        'small': QLPPacket(device_address + CommandID.FILL + b'\x01\x02\x03', PacketType.CONTROL, packet_id=1),
+        'frame': QLPPacket(device_address + CommandID.SET_ALL_PIXELS + bytes(900), PacketType.CONTROL, packet_id=1),
+    }
+    results = []
+    for size, packet in packets.items():
+        serialized = packet.serialize()
+        parse = partial(QLPPacket.parse, serialized)
+        crc = partial(getattr, packet, 'crc')
+        results += [
+            BenchmarkResult(f'codec.serialize.{size}', _ops_per_second(packet.serialize, duration), 'ops/s'),
+            BenchmarkResult(f'codec.parse.{size}', _ops_per_second(parse, duration), 'ops/s'),
+            BenchmarkResult(f'codec.crc.{size}', _ops_per_second(crc, duration), 'ops/s'),
+        ]
+        with tempfile.TemporaryDirectory() as directory:
+            with QLPCaptureWriter(os.path.join(directory, 'bench.qlpcap')) as writer:
+                record = partial(writer.record, Direction.TX, serialized, ('192.168.1.10', 52075))
+                results.append(BenchmarkResult(f'capture.record.{size}', _ops_per_second(record, duration), 'ops/s'))
+    return results
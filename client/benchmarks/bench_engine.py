@@ -0,0 +1,68 @@
+import asyncio
+import statistics
+import time
+
+from benchmarks.results import BenchmarkResult
+from emulator import QLSCEmulator
+from engine import QLPEngine
+from models.color import Color
+from models.device import QLSCDevice
+
+
+async def _round_trip(device: QLSCDevice, duration: float) -> list[BenchmarkResult]:
+    latencies = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        await device.fill(Color(1, 2, 3))
+        latencies.append((time.perf_counter() - started) * 1e6)
+    percentiles = statistics.quantiles(latencies, n=100)
+    return [
+        BenchmarkResult(f'engine.rtt.p{percentile}', percentiles[percentile - 1], 'us', higher_is_better=False)
+        for percentile in (50, 90, 99)
+    ]
+
+
+async def _throughput(devices: list[QLSCDevice], duration: float, window: int, frame: bool) -> float:
+    """Completed commands (or frames) per second with every device kept busy by window workers"""
+    completed = 0
+    deadline = time.perf_counter() + duration
+    pixels = bytes(range(256)) * 3 + bytes(132)
+
+    async def worker(device: QLSCDevice):
+        nonlocal completed
+        while time.perf_counter() < deadline:
+            if frame:
+                await device.push_frame(pixels)
+            else:
+                await device.fill(Color(completed % 256, 0, 0))
+            completed += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(device) for device in devices for _ in range(window if not frame else 1)))
+    return completed / (time.perf_counter() - started)
+
+
+async def run(duration: float, devices_count: int) -> list[BenchmarkResult]:
+    engine = QLPEngine()
+    await engine.start()
+    emulator = await QLSCEmulator(devices_count, length=300).start()
+    try:
+        await engine.discover_all_devices(timeout=0.2, addresses=emulator.addresses)
+        chip_ids = {f'{controller.chip_id:08X}' for controller in emulator.controllers}
+        devices = [device for device in engine.devices if device.device_chip_id in chip_ids]
+        results = await _round_trip(devices[0], duration)
+        results.append(BenchmarkResult(
+            'engine.commands_per_second',
+            await _throughput(devices, duration, engine.command_window, frame=False),
+            'cmd/s',
+        ))
+        results.append(BenchmarkResult(
+            'engine.frames_per_second',
+            await _throughput(devices, duration, engine.command_window, frame=True),
+            'frame/s',
+        ))
+        return results
+    finally:
+        await emulator.stop()
+        await engine.stop()
@@ -0,0 +1,69 @@
+import math
+import random
+import time
+
+from benchmarks.results import BenchmarkResult
+from utils.frame_planner import apply_command, plan_frame
+
+PIXELS = 300
+FRAMES = 60
+TOLERANCES = (0, 4)
+
+
+def _smooth(frame: int) -> bytes:
+    """Moving waves, every pixel changes a bit from frame to frame"""
+    return b''.join(
+        bytes([round(180 + 60 * math.sin((i + 4 * frame) / 30)), round(90 + 40 * math.sin(i / 20 + frame / 5)), 40])
+        for i in range(PIXELS)
+    )
+
+
+def _sparse(frame: int, rnd: random.Random) -> bytes:
+    """Dark strip with a few lit pixels, typical for chase effects"""
+    pixels = bytearray(PIXELS * 3)
+    for index in rnd.sample(range(PIXELS), 10):
+        pixels[index * 3:index * 3 + 3] = bytes([frame % 256, 255, 0])
+    return bytes(pixels)
+
+
+def _streamed(frames: list[bytes], tolerance: int) -> list[tuple[bytes, bytes]]:
+    """Pairs of strip state and next frame as update_frame plans them, approximated state is kept"""
+    pairs = []
+    state = bytearray(frames[0])
+    for frame in frames[1:]:
+        pairs.append((bytes(state), frame))
+        for command_id, data in plan_frame(bytes(state), frame, tolerance=tolerance):
+            apply_command(state, command_id, data)
+    return pairs
+
+
+def _plan_time(pairs: list[tuple[bytes, bytes]], duration: float, tolerance: int) -> float:
+    """Average time of planning one frame in microseconds"""
+    count = 0
+    started = time.perf_counter()
+    deadline = started + duration
+    while time.perf_counter() < deadline:
+        for previous, frame in pairs:
+            plan_frame(previous, frame, tolerance=tolerance)
+        count += len(pairs)
+    return (time.perf_counter() - started) / count * 1e6
+
+
+def run(duration: float) -> list[BenchmarkResult]:
+    rnd = random.Random(1)
+    scenes = {
+        'smooth': [_smooth(frame) for frame in range(FRAMES)],
+        'sparse': [_sparse(frame, rnd) for frame in range(FRAMES)],
+        'noise': [rnd.randbytes(PIXELS * 3) for _ in range(FRAMES)],
+    }
+    duration /= len(scenes) * len(TOLERANCES)
+    return [
+        BenchmarkResult(
+            f'planner.{f"tolerance{tolerance}" if tolerance else "exact"}.{name}.{PIXELS}',
+            _plan_time(_streamed(frames, tolerance), duration, tolerance),
+            'us',
+            higher_is_better=False,
+        )
+        for tolerance in TOLERANCES
+        for name, frames in scenes.items()
+    ]
@@ -0,0 +1,48 @@
+import time
+
+import numpy as np
+
+from benchmarks.results import BenchmarkResult
+from models.color import Color
+from models.device import QLSCDevice
+from models.renderer import QLSCRenderer
+from utils.effects import Chase, Effect, Fade, GradientSweep, Noise, Rainbow
+
+STRIPS = 500
+PIXELS = 150
+
+
+def _ticks_per_second(renderer: QLSCRenderer, duration: float) -> float:
+    count = 0
+    started = time.perf_counter()
+    deadline = started + duration
+    while time.perf_counter() < deadline:
+        renderer.frames(count / 60)
+        count += 1
+    return count / (time.perf_counter() - started)
+
+
+def run(duration: float) -> list[BenchmarkResult]:
+    devices = [
+        QLSCDevice(ip='127.0.0.1', device_chip_id=f'{index:08X}', device_uuid='bench', name='Bench', length=PIXELS)
+        for index in range(STRIPS)
+    ]
+    hues = np.linspace(0, 1, STRIPS // 5)
+    effects: dict[str, Effect] = {
+        'rainbow': Rainbow(shift=hues),
+        'chase': Chase(Color(255, 80, 0), speed=np.linspace(10, 60, STRIPS // 5)),
+        'gradient': GradientSweep(Color(0, 0, 255), Color(255, 0, 128)),
+        'noise': Noise(Color(0, 255, 120)),
+        'fade': Fade(Color(0, 0, 0), Color(255, 255, 255)),
+    }
+    results = []
+    mixed = QLSCRenderer(devices, gamma=2.2)
+    for index, (name, effect) in enumerate(effects.items()):
+        single = QLSCRenderer(devices)
+        single.assign(effect, devices[:STRIPS // 5])
+        results.append(BenchmarkResult(
+            f'render.{name}.{STRIPS // 5}x{PIXELS}', _ticks_per_second(single, duration / len(effects)), 'ticks/s',
+        ))
+        mixed.assign(effect, devices[index * STRIPS // 5:(index + 1) * STRIPS // 5])
+    results.append(BenchmarkResult(f'render.mixed.{STRIPS}x{PIXELS}', _ticks_per_second(mixed, duration), 'ticks/s'))
+    return results
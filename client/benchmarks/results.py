@@ -0,0 +1,54 @@
+import json
+import platform
+import subprocess  # nosec
+from dataclasses import asdict, dataclass
+from typing import Optional
+
+
+@dataclass
+class BenchmarkResult:
+    """One measured value of benchmark"""
+    name: str
+    value: float
+    unit: str
+    higher_is_better: bool = True
+
+
+def _current_commit() -> Optional[str]:
+    try:
+        return subprocess.run(  # nosec
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, check=True, text=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def dump(results: list[BenchmarkResult]) -> str:
+    return json.dumps(
+        {
+            'commit': _current_commit(),
+            'python': platform.python_version(),
+            'machine': platform.machine(),
+            'results': [asdict(result) for result in results],
+        },
+        indent=2,
+    )
+
+
+def compare(results: list[BenchmarkResult], baseline_path: str, threshold: float) -> list[str]:
+    """Print difference with baseline file and return names of benchmarks which regressed more than threshold"""
+    with open(baseline_path, encoding='utf-8') as file:
+        baseline = {result['name']: result for result in json.load(file)['results']}
+    regressions = []
+    for result in results:
+        previous = baseline.get(result.name)
+        if previous is None or not previous['value']:
+            print(f'{result.name:<40} {result.value:>14.1f} {result.unit:<8} (new)')
+            continue
+        change = (result.value - previous['value']) / previous['value']
+        worse = -change if result.higher_is_better else change
+        mark = 'REGRESSION' if worse > threshold else ''
+        print(f'{result.name:<40} {result.value:>14.1f} {result.unit:<8} {change:+8.1%} {mark}')
+        if mark:
+            regressions.append(result.name)
+    return regressions
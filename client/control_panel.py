@@ -1,14 +1,183 @@
-from typing import List
+import asyncio
+import hashlib
+import logging
+import os
+from typing import Any, AsyncIterator, Awaitable, Callable, List, Optional
 
 import fastapi.exceptions
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from pydantic import BaseModel, Field, ValidationError
 
 from engine import QLPEngine
+from exceptions.protocol_exceptions import QLPError
+from models.color import Color
 from models.device import QLSCDevice
+from models.registry import QLSCDeviceRegistry
+
+logger = logging.getLogger('ControlPanel')
+
+# Commands which can be applied to many devices at once, args are passed as JSON object
+COMMANDS: dict[str, Callable[[QLSCDevice, dict[str, Any]], Awaitable[None]]] = {
+    'fill': lambda device, args: device.fill(Color(*args['color'])),
+    'set_pixel_color': lambda device, args: device.set_pixel_color(args['index'], Color(*args['color'])),
+    'set_line_color': lambda device, args: device.set_line_color(args['start'], args['end'], Color(*args['color'])),
+    'set_brightness': lambda device, args: device.set_brightness(args['brightness']),
+    'set_mode': lambda device, args: device.set_mode(args['mode']),
+    'set_length': lambda device, args: device.set_length(args['length']),
+    'reboot': lambda device, args: device.reboot(),
+}
+# Errors of bad arguments or of device reported to client instead of failing the request
+COMMAND_ERRORS = (QLPError, KeyError, TypeError, ValueError, IndexError)
+# Commands of one live connection executed at the same time, reading of socket waits for free slot
+LIVE_COMMANDS_WINDOW = 64
+# Seconds between background discovery rounds, search endpoint never waits for discovery
+DISCOVERY_INTERVAL = float(os.environ.get('QLSC_DISCOVERY_INTERVAL', 30))
+# Seconds between checks of devices' data for changes between discovery rounds
+SNAPSHOT_INTERVAL = 1.0
+
+
+class DeviceCommand(BaseModel):
+    """Command applied to every listed device"""
+    devices: List[str] = Field(description='Device uuids')
+    command: str
+    args: dict[str, Any] = Field(default_factory=dict)
+    # Echoed in live connection replies to match them with requests
+    id: Optional[int] = None
+
+
+class CommandResult(BaseModel):
+    """Result of command for one device"""
+    ok: bool
+    error: Optional[str] = None
+
+
+async def run_command(request: DeviceCommand) -> dict[str, CommandResult]:
+    """Apply command to all devices concurrently, errors are reported per device"""
+    handler = COMMANDS.get(request.command)
+    if handler is None:
+        raise ValueError(f'Unknown command {request.command}')
+
+    async def run(device_uuid: str) -> CommandResult:
+        device = engine[device_uuid]
+        if device is None:
+            return CommandResult(ok=False, error='Device was not found')
+        try:
+            await handler(device, request.args)
+        except COMMAND_ERRORS as error:
+            return CommandResult(ok=False, error=f'{type(error).__name__}: {error}')
+        return CommandResult(ok=True)
+
+    results = await asyncio.gather(*(run(device_uuid) for device_uuid in request.devices))
+    return dict(zip(request.devices, results))
+
+
+def split_frame(data: bytes) -> tuple[str, bytes]:
+    """Device uuid and pixels of live connection's binary message, ValueError if uuid is not UTF-8"""
+    if not data:
+        return '', b''
+    return data[1:1 + data[0]].decode(), data[1 + data[0]:]
+
+
+class LatestFrames:
+    """Frames of live connection pushed to devices, busy device gets only the latest one after the previous"""
+
+    def __init__(self) -> None:
+        self.__frames: dict[str, bytes] = {}
+        self.__pushers: dict[str, asyncio.Task] = {}
+
+    def push(self, device: QLSCDevice, frame: bytes) -> None:
+        self.__frames[device.device_uuid] = frame
+        if device.device_uuid not in self.__pushers:
+            self.__pushers[device.device_uuid] = asyncio.create_task(self.__push_frames(device))
+
+    async def __push_frames(self, device: QLSCDevice) -> None:
+        try:
+            while (frame := self.__frames.pop(device.device_uuid, None)) is not None:
+                try:
+                    await device.update_frame(frame)
+                except COMMAND_ERRORS as error:
+                    logger.warning('Frame for device uuid="%s" was not pushed: %s', device.device_uuid, error)
+        finally:
+            del self.__pushers[device.device_uuid]
+
+    def cancel(self) -> None:
+        for task in self.__pushers.values():
+            task.cancel()
+
+
+class DevicesSnapshot:
+    """Serialized list of devices with ETag, changes of it are awaitable
+
+    Devices are serialized again only if registry or state of any device has changed
+    """
+
+    def __init__(self) -> None:
+        self.body = b'[]'
+        self.etag = self.__etag(self.body)
+        self.__changed = asyncio.Event()
+        self.__version: Optional[tuple] = None
+
+    def update(self, registry: QLSCDeviceRegistry) -> None:
+        # Registry's generation follows changes of devices' data, but not of their state and length
+        version = (registry.generation, [(device.state, device.length) for device in registry])
+        if version == self.__version:
+            return
+        self.__version = version
+        devices = sorted(registry, key=lambda device: device.device_chip_id)
+        body = ('[' + ','.join(device.json() for device in devices) + ']').encode()
+        if body == self.body:
+            return
+        self.body, self.etag = body, self.__etag(body)
+        self.__changed.set()
+        self.__changed = asyncio.Event()
+
+    async def changed(self) -> None:
+        await self.__changed.wait()
+
+    @staticmethod
+    def __etag(body: bytes) -> str:
+        return f'"{hashlib.blake2b(body, digest_size=8).hexdigest()}"'
+
 
 app = FastAPI()
-engine = QLPEngine().start()
+engine = QLPEngine(cache_path=os.environ.get('QLSC_DEVICE_CACHE', 'devices.json'))
+snapshot = DevicesSnapshot()
+background_tasks: set[asyncio.Task] = set()
+
+
+async def discover_periodically():
+    while True:
+        try:
+            await engine.discover_all_devices()
+        except QLPError as error:
+            logger.warning('Discovery failed: %s', error)
+        snapshot.update(engine.devices)
+        await asyncio.sleep(DISCOVERY_INTERVAL)
+
+
+async def snapshot_periodically():
+    while True:
+        await asyncio.sleep(SNAPSHOT_INTERVAL)
+        snapshot.update(engine.devices)
+
+
+@app.on_event('startup')
+async def start_engine():
+    await engine.start()
+    # Devices from cache are served before the first discovery is finished
+    snapshot.update(engine.devices)
+    for coroutine in (discover_periodically(), snapshot_periodically()):
+        background_tasks.add(asyncio.create_task(coroutine))
+
+
+@app.on_event('shutdown')
+async def stop_engine():
+    for task in background_tasks:
+        task.cancel()
+    background_tasks.clear()
+    await engine.stop()
 
 
 @app.get('/livecheck')
@@ -16,11 +185,104 @@ async def live_check():
     return {'live': 'ok'}
 
 
+@app.get('/metrics', response_class=PlainTextResponse)
+async def metrics():
+    return PlainTextResponse(engine.metrics.render(), media_type='text/plain; version=0.0.4')
+
+
 @app.get('/api/devices/search', response_model=List[QLSCDevice])
-async def search_for_devices():
-    devices = await engine.discover_all_devices()
-    devices.add(QLSCDevice(ip='1.2.3.4', device_chip_id='ABCDE', device_uuid='12345', name='Test Device'))
-    return devices
+async def search_for_devices(if_none_match: Optional[str] = Header(default=None)):
+    """Devices found by background discovery, 304 if they are not changed since response with given ETag"""
+    headers = {'ETag': snapshot.etag, 'Cache-Control': 'no-cache'}
+    if if_none_match == snapshot.etag:
+        return Response(status_code=304, headers=headers)
+    return Response(snapshot.body, media_type='application/json', headers=headers)
+
+
+@app.get('/api/devices/events')
+async def device_events(request: Request):
+    """Server-sent events with the whole list of devices, sent at once and after every change"""
+    async def events() -> AsyncIterator[bytes]:
+        while not await request.is_disconnected():
+            yield b'event: devices\nid: ' + snapshot.etag.encode() + b'\ndata: ' + snapshot.body + b'\n\n'
+            await snapshot.changed()
+
+    return StreamingResponse(events(), media_type='text/event-stream', headers={'Cache-Control': 'no-cache'})
+
+
+@app.post('/api/devices/batch', response_model=dict[str, CommandResult])
+async def batch_command(request: DeviceCommand):
+    try:
+        return await run_command(request)
+    except ValueError as error:
+        raise fastapi.exceptions.HTTPException(400, str(error)) from error
+
+
+@app.websocket('/api/live')
+async def live_control(websocket: WebSocket):
+    """Stream of frames and commands for any devices
+
+    Binary message is a frame: 1 byte of uuid length, device uuid and RGB bytes of all pixels.
+    Only the latest frame is kept for device which is still busy with the previous one.
+    Text message is DeviceCommand JSON, it is answered with {"id": ..., "results": {uuid: CommandResult}}
+    """
+    await websocket.accept()
+    frames = LatestFrames()
+    commands: set[asyncio.Task] = set()
+    window = asyncio.Semaphore(LIVE_COMMANDS_WINDOW)
+
+    async def command(request: DeviceCommand):
+        try:
+            try:
+                reply: dict[str, Any] = {'id': request.id, 'results': {
+                    uuid: result.dict() for uuid, result in (await run_command(request)).items()
+                }}
+            except ValueError as error:
+                reply = {'id': request.id, 'error': str(error)}
+            await websocket.send_json(reply)
+        except (WebSocketDisconnect, RuntimeError):
+            # Connection was closed while command was executed, nobody waits for the reply
+            logger.debug('Reply to command id=%s was not sent', request.id)
+        finally:
+            window.release()
+
+    def track(task: asyncio.Task):
+        commands.add(task)
+        task.add_done_callback(commands.discard)
+
+    try:
+        while True:
+            # Socket is not read while window is full, so TCP slows the client down
+            await window.acquire()
+            window.release()
+            message = await websocket.receive()
+            if message['type'] == 'websocket.disconnect':
+                break
+            if message.get('bytes') is not None:
+                try:
+                    device_uuid, frame = split_frame(message['bytes'])
+                except ValueError as error:
+                    await websocket.send_json({'error': f'Invalid frame: {error}'})
+                    continue
+                device = engine[device_uuid]
+                if device is None:
+                    await websocket.send_json({'error': f'Device uuid="{device_uuid}" was not found'})
+                    continue
+                frames.push(device, frame)
+                continue
+            try:
+                request = DeviceCommand.parse_raw(message['text'])
+            except ValidationError as error:
+                await websocket.send_json({'error': str(error)})
+                continue
+            await window.acquire()
+            track(asyncio.create_task(command(request)))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        frames.cancel()
+        for task in commands:
+            task.cancel()
 
 
 @app.get('/api/devices/{device_uuid}', response_model=QLSCDevice)
@@ -29,7 +291,6 @@ async def get_device_by_uuid(device_uuid):
     if not device:
         raise fastapi.exceptions.HTTPException(404)
     return device
-    # return QLSCDevice(ip='1.2.3.4', device_chip_id='ABCDE', device_uuid='12345', name='Test Device')
 
 
 app.mount("/", StaticFiles(directory="web/public", html=True))
@@ -0,0 +1,264 @@
+"""Emulator of QLSC controllers fleet for load and latency testing without hardware
+
+Usage: python emulator.py --devices 500 --latency 0.02 --jitter 0.005 --loss 0.01
+"""
+import argparse
+import asyncio
+import logging
+import random
+from dataclasses import dataclass
+from typing import Callable, Optional, cast
+
+import enums.discovery_packet_body as dpb
+from enums.commands import CommandID
+from enums.common_response_code import CommonResponseCode
+from enums.packet_type import PacketType
+from models.packet import QLPPacket
+from utils.frame_planner import apply_command
+
+logger = logging.getLogger('Emulator')
+
+# Expected data length of commands with fixed length, None for any length
+_COMMAND_LENGTHS: dict[CommandID, Optional[tuple[int, ...]]] = {
+    CommandID.LENGTH: (1, 2),
+    CommandID.MAX_CURRENT: (2,),
+    CommandID.SET_MASTER: (1,),
+    CommandID.GET_MASTER: (0,),
+    CommandID.SYNC_PACKET: (0,),
+    CommandID.MULTICAST_GROUP: (0, 1),
+    CommandID.SET_MODE: (2,),
+    CommandID.SET_COLOR: (0, 3),
+    CommandID.SET_SPEED: (4,),
+    CommandID.SET_BRIGHTNESS: (1,),
+    CommandID.SET_SHIFT: (1,),
+    CommandID.SET_SHAPE: (1,),
+    CommandID.SET_PARAM1: (0, 2),
+    CommandID.SET_PARAM2: (0, 2),
+    CommandID.SET_PIXEL: (5,),
+    CommandID.SET_LINE: (7,),
+    CommandID.SET_GRADIENT: (10,),
+    CommandID.FILL: (3,),
+    CommandID.SET_LINE_IMAGE: None,
+    CommandID.SET_ALL_PIXELS: None,
+    CommandID.ENCRYPTION: (1,),
+    CommandID.VERSION: (0,),
+    CommandID.RESET_ID: (0,),
+    CommandID.REBOOT: (0,),
+    CommandID.FULL_RESET: (0,),
+    CommandID.TIME_SERVER: None,
+    CommandID.SET_TIME: (3,),
+    CommandID.SET_TIMER: None,
+    CommandID.GET_TIMER: (0, 1),
+}
+
+
+@dataclass
+class NetworkConditions:
+    """Simulated link and controller behaviour"""
+    # Mean one-way delay of response and its random deviation, seconds
+    latency: float = 0.0
+    jitter: float = 0.0
+    # Probability to lose incoming packet or response
+    loss: float = 0.0
+    # Commands controller is able to process per second, 0 for unlimited
+    rate: float = 0.0
+
+
+class VirtualController(asyncio.DatagramProtocol):  # pylint: disable=too-many-instance-attributes
+    """Emulated QLSC controller answering QLP packets like firmware does"""
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self,
+            chip_id: int,
+            name: str,
+            length: int,
+            conditions: NetworkConditions,
+            rnd: random.Random,
+    ) -> None:
+        self.chip_id = chip_id
+        self.uuid = rnd.getrandbits(32)
+        self.name = name
+        self.length = length
+        self.pixels = bytearray(length * 3)
+        self.settings: dict[CommandID, bytes] = {}
+        self.multicast_group = 0
+        self.conditions = conditions
+        self.received = 0
+        self.transport: Optional[asyncio.DatagramTransport] = None
+        self._random = rnd
+        self._busy_until = 0.0
+
+    @property
+    def address(self) -> tuple[str, int]:
+        assert self.transport is not None
+        return self.transport.get_extra_info('sockname')[:2]
+
+    def connection_made(self, transport: asyncio.BaseTransport) -> None:
+        self.transport = cast(asyncio.DatagramTransport, transport)
+
+    def datagram_received(self, data: bytes, addr: tuple[str, int]) -> None:
+        if self.conditions.loss and self._random.random() < self.conditions.loss:
+            return
+        try:
+            packet = QLPPacket.parse(data)
+        except ValueError:
+            logger.debug('Controller %08X dropped invalid packet', self.chip_id)
+            return
+        self.received += 1
+        if packet.packet_type == PacketType.DISCOVERY:
+            if packet.data == dpb.ANYBODY_HERE:
+                body = f'{dpb.I_AM_HERE.decode()}-{self.chip_id:08X}-{self.uuid:08X}-{self.name}'.encode()
+                self._reply(QLPPacket(body, PacketType.DISCOVERY), addr)
+        elif packet.packet_type == PacketType.CONTROL:
+            if int.from_bytes(packet.device_address, 'little') != self.chip_id:
+                return
+            code, text = self._execute(self._command(packet), bytes(packet.payload))
+            response = QLPPacket(
+                packet.device_address + CommandID.COMMON_RESPONSE + code + text,
+                PacketType.CONTROL,
+                packet_id=packet.packet_id,
+            )
+            self._reply(response, addr)
+        elif packet.packet_type == PacketType.BROADCAST:
+            if packet.group_id in (0x00, 0xFF, self.multicast_group):
+                self._execute(self._command(packet), bytes(packet.payload))
+
+    @staticmethod
+    def _command(packet: QLPPacket) -> int:
+        """Raw command byte, packet.command_id raises ValueError for command unknown to CommandID"""
+        return packet.data[1 if packet.packet_type == PacketType.BROADCAST else 4]
+
+    def _execute(self, command: int, data: bytes) -> tuple[CommonResponseCode, bytes]:
+        if command not in _COMMAND_LENGTHS:
+            return CommonResponseCode.OTHER_ERROR, f'Unsupported command {command:#04x}'.encode()
+        command_id = CommandID(command)
+        lengths = _COMMAND_LENGTHS[command_id]
+        if lengths is not None and len(data) not in lengths:
+            return CommonResponseCode.LENGTH_ERROR, b''
+        if command_id == CommandID.LENGTH:
+            self.length = int.from_bytes(data, 'little')
+            self.pixels = bytearray(self.length * 3)
+        elif command_id == CommandID.MULTICAST_GROUP and data:
+            self.multicast_group = data[0]
+        elif command_id in (CommandID.REBOOT, CommandID.FULL_RESET):
+            self.pixels = bytearray(self.length * 3)
+            if command_id == CommandID.FULL_RESET:
+                self.settings.clear()
+                self.multicast_group = 0
+        elif command_id == CommandID.RESET_ID:
+            self.uuid = self._random.getrandbits(32)
+        elif command_id in (
+                CommandID.FILL, CommandID.SET_PIXEL, CommandID.SET_LINE, CommandID.SET_GRADIENT,
+                CommandID.SET_LINE_IMAGE, CommandID.SET_ALL_PIXELS,
+        ):
+            if not self._fits(command_id, data):
+                return CommonResponseCode.LENGTH_ERROR, b''
+            apply_command(self.pixels, command_id, data)
+        elif data:
+            self.settings[command_id] = data
+        return CommonResponseCode.OK, b''
+
+    def _fits(self, command_id: CommandID, data: bytes) -> bool:
+        """Check that drawing command stays within the strip"""
+        if command_id == CommandID.SET_ALL_PIXELS:
+            return len(data) <= len(self.pixels) and len(data) % 3 == 0
+        if command_id == CommandID.SET_LINE_IMAGE:
+            start = int.from_bytes(data[:2], 'little')
+            return len(data) >= 3 and len(data) == 3 + data[2] * 3 and start + data[2] <= self.length
+        if command_id in (CommandID.SET_LINE, CommandID.SET_GRADIENT):
+            start, end = int.from_bytes(data[:2], 'little'), int.from_bytes(data[2:4], 'little')
+            return start < end <= self.length
+        if command_id == CommandID.SET_PIXEL:
+            return int.from_bytes(data[:2], 'little') < self.length
+        return True
+
+    def _reply(self, packet: QLPPacket, addr: tuple[str, int]) -> None:
+        if self.conditions.loss and self._random.random() < self.conditions.loss:
+            return
+        assert self.transport is not None
+        loop = asyncio.get_running_loop()
+        now = loop.time()
+        if self.conditions.rate:
+            self._busy_until = max(self._busy_until, now) + 1 / self.conditions.rate
+            ready = self._busy_until
+        else:
+            ready = now
+        delay = ready - now + max(0.0, self.conditions.latency + self._random.uniform(-1, 1) * self.conditions.jitter)
+        if delay <= 0:
+            self.transport.sendto(packet.serialize(), addr)
+        else:
+            loop.call_later(delay, self.transport.sendto, packet.serialize(), addr)
+
+
+class QLSCEmulator:
+    """Fleet of virtual controllers, each one listening on its own localhost port"""
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self,
+            devices: int,
+            length: int = 30,
+            conditions: Optional[NetworkConditions] = None,
+            host: str = '127.0.0.1',
+            seed: Optional[int] = None,
+    ) -> None:
+        self.count = devices
+        self.length = length
+        self.conditions = conditions or NetworkConditions()
+        self.host = host
+        self.controllers: list[VirtualController] = []
+        self._random = random.Random(seed)
+
+    @property
+    def addresses(self) -> list[tuple[str, int]]:
+        """Addresses to probe for discovery, controllers don't listen to broadcasts"""
+        return [controller.address for controller in self.controllers]
+
+    async def start(self) -> 'QLSCEmulator':
+        loop = asyncio.get_running_loop()
+        for index in range(self.count):
+            chip_id = 0xE0000000 + index
+
+            def factory(chip_id: int = chip_id, index: int = index) -> VirtualController:
+                return VirtualController(chip_id, f'Emulated {index}', self.length, self.conditions, self._random)
+
+            _, protocol = await loop.create_datagram_endpoint(
+                cast(Callable[[], VirtualController], factory),
+                local_addr=(self.host, 0),
+            )
+            self.controllers.append(protocol)
+        logger.info('%s controllers were started', self.count)
+        return self
+
+    async def stop(self) -> None:
+        for controller in self.controllers:
+            if controller.transport is not None:
+                controller.transport.close()
+        self.controllers.clear()
+
+    async def __aenter__(self) -> 'QLSCEmulator':
+        return await self.start()
+
+    async def __aexit__(self, *_) -> None:
+        await self.stop()
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--devices', type=int, default=10)
+    parser.add_argument('--length', type=int, default=30, help='pixels of every strip')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--latency', type=float, default=0.0, help='mean response delay, seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='max deviation of response delay, seconds')
+    parser.add_argument('--loss', type=float, default=0.0, help='probability to lose a packet')
+    parser.add_argument('--rate', type=float, default=0.0, help='commands per second every controller processes')
+    args = parser.parse_args()
+    conditions = NetworkConditions(args.latency, args.jitter, args.loss, args.rate)
+    async with QLSCEmulator(args.devices, args.length, conditions, args.host) as emulator:
+        for host, port in emulator.addresses:
+            print(f'{host}:{port}')
+        await asyncio.Event().wait()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
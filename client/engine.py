@@ -1,159 +1,634 @@
 import asyncio
-import datetime
+import functools
 import logging
-import socket
-from collections import defaultdict
-from typing import Optional, Set
+import re
+from collections import deque
+from contextlib import aclosing
+from pathlib import Path
+from typing import AsyncGenerator, Callable, Iterable, Mapping, Optional, Set
 
 import enums.discovery_packet_body as dpb
+from enums.commands import CommandID
+from enums.device_state import DeviceState
 from enums.packet_type import PacketType
-from exceptions.protocol_exceptions import QLPError
+from enums.priority import Priority
+from exceptions.protocol_exceptions import QLPError, QLPQueueFullError, QLPTimeoutError
+from models.channel import InFlightCommand, QLPDeviceChannel, QueuedCommand, default_priority
 from models.device import QLSCDevice
-from models.packet import QLPPacket
-from utils.esp_touch import init as esp_touch_init, sendData as esp_touch_send_data
+from models.group import QLSCGroup
+from models.packet import QLP_PORT, QLPPacket
+from models.registry import QLSCDeviceRegistry
+from models.scheduler import QLPScheduler
+from utils.capture import Direction, QLPCaptureWriter
+from utils.esp_touch import ESPTouchSession
+from utils.metrics import Counter, Gauge, Histogram, HistogramFamily, MetricsRegistry
 from utils.singleton import Singleton
 
 logger = logging.getLogger('Engine')
 
+_CHIP_ID = re.compile('[0-9A-F]{8}')
 
-class QLPEngine(metaclass=Singleton):
+
+class QLPDatagramProtocol(asyncio.DatagramProtocol):
+    """Asyncio datagram protocol passing every received datagram to the callback as soon as it arrives"""
+
+    def __init__(self, on_datagram: Callable[[bytes, tuple[str, int]], None]) -> None:
+        self._on_datagram = on_datagram
+        # Resolved when socket is really closed
+        self.closed: asyncio.Future[None] = asyncio.get_running_loop().create_future()
+
+    def connection_lost(self, exc: Optional[Exception]) -> None:
+        if not self.closed.done():
+            self.closed.set_result(None)
+
+    def datagram_received(self, data: bytes, addr: tuple[str, int]) -> None:
+        self._on_datagram(data, addr)
+
+    def error_received(self, exc: Exception) -> None:
+        logger.warning('Socket error: %s', exc)
+
+
+def shard_of(device_chip_id: str, shards: int) -> int:
+    """Index of engine shard which controls the device"""
+    return int(device_chip_id, 16) % shards
+
+
+def _parse_i_am_here(data: bytes | memoryview) -> Optional[tuple[str, str, str]]:
+    """Chip id, uuid and name from answer to discovery request, None if it is malformed
+
+    Chip id is printed by device as 8 upper hex digits, other forms would not match its CONTROL packets
+    """
+    try:
+        device_chip_id = bytes(data[4:12]).decode()
+        device_uuid = bytes(data[13:21]).decode()
+        name = bytes(data[22:]).decode()
+    except UnicodeDecodeError:
+        return None
+    if _CHIP_ID.fullmatch(device_chip_id) is None:
+        return None
+    return device_chip_id, device_uuid, name
+
+
+class QLPEngineMetrics(MetricsRegistry):  # pylint: disable=too-many-instance-attributes
+    """Counters and histograms updated by the engine, rendered for Prometheus by the control panel"""
+
+    def __init__(
+            self,
+            in_flight: Callable[[], float],
+            queued: Callable[[], float],
+            devices: Callable[[], float],
+    ) -> None:
+        super().__init__()
+        self.tx_packets = self.register(Counter('qlp_tx_packets_total', 'Sent datagrams'))
+        self.tx_bytes = self.register(Counter('qlp_tx_bytes_total', 'Sent bytes'))
+        self.rx_packets = self.register(Counter('qlp_rx_packets_total', 'Received datagrams'))
+        self.rx_bytes = self.register(Counter('qlp_rx_bytes_total', 'Received bytes'))
+        self.invalid_packets = self.register(
+            Counter('qlp_rx_invalid_packets_total', 'Dropped datagrams with bad header, length or CRC')
+        )
+        self.retransmissions = self.register(Counter('qlp_retransmissions_total', 'Commands sent again'))
+        self.timeouts = self.register(Counter('qlp_timeouts_total', 'Commands failed without response'))
+        self.coalesced = self.register(
+            Counter('qlp_coalesced_commands_total', 'Unsent commands replaced by newer ones')
+        )
+        self.rejected = self.register(Counter('qlp_rejected_commands_total', 'Commands rejected by full queue'))
+        self.rtt = self.register(HistogramFamily('qlp_rtt_seconds', 'Command round-trip time', 'device'))
+        self.loop_lag = self.register(Histogram('qlp_event_loop_lag_seconds', 'Event loop scheduling delay'))
+        self.in_flight = self.register(Gauge('qlp_in_flight_commands', 'Commands waiting for response', in_flight))
+        self.queued = self.register(Gauge('qlp_queued_commands', 'Commands waiting to be sent', queued))
+        self.devices = self.register(Gauge('qlp_devices', 'Known devices', devices))
+
+
+class QLPEngine(metaclass=Singleton):  # pylint: disable=too-many-instance-attributes
     """Engine for Quantum0's LED Strip Protocol, allows to interact with devices"""
-    __QLP_PORT__ = 52075
-    __RECV_TIMEOUT = 1.5
-
-    # TODO: Add something kinda request_response list
-    #  Цель:
-    #   - функция отправки команды девайсу должна дождаться ответа или упасть с таймаут еррором
-    #   - несколько таймаут ерроров - удаляем девайс из списка
-    #   - если девайсу была отправлена команда - лочить выполнение следующей отправки пока предыдущая не будет завершена
-    #     dict[device_id, lock] ?
-    #   - НЕ лочить параллельную отправку двум или более девайсам
-    #   - добавить в протокол байт - счетчик команды
-
-    def __init__(self):
+    __QLP_PORT__ = QLP_PORT
+    __BROADCAST_ADDRESS = '255.255.255.255'
+    __DISCOVERY_TIMEOUT = 1.5
+    # Discovery request is repeated after so long silence, and finished after the last one
+    __DISCOVERY_QUIET = 0.3
+    __DISCOVERY_PROBES = 3
+    # How many times unacknowledged command is sent again before giving up
+    __RETRANSMISSIONS = 3
+    # Amount of last sent packets remembered to skip their broadcast echo
+    __ECHO_RING_SIZE = 64
+    # Period of event loop lag measurement
+    __LAG_PROBE_INTERVAL = 0.25
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self,
+            command_window: int = 8,
+            reprobe_interval: Optional[float] = None,
+            cache_path: Optional[str | Path] = None,
+            shard: Optional[tuple[int, int]] = None,
+            max_in_flight: int = 1024,
+            queue_limits: Optional[Mapping[Priority, int]] = None,
+            capture_path: Optional[str | Path] = None,
+    ):
         self._listening: bool = False
-        self._stop_listen: bool = False
+        self._transport: Optional[asyncio.DatagramTransport] = None
+        self.__protocol: QLPDatagramProtocol
+        # (index, count) if engine is one of processes sharing QLP port, it controls only devices of its shard
+        self.shard = shard
+        # Sharded engine receives broadcasts on shared QLP port and sends from its own one to get unicast answers
+        self.__shared_listener: Optional[tuple[asyncio.DatagramTransport, QLPDatagramProtocol]] = None
         # self._received_packets_queue: Queue[QLPPacket] = Queue()
-        self._devices: Set[QLSCDevice] = set()
-        self._tx = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
-        self._tx.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-        self.__just_send_packet = None
-        # Sent packets, waiting for confirmation: dev_uuid:timestamp+command_counter
-        self.__packets: dict[str, tuple[datetime.datetime, int]] = {}
-        self.__locks: defaultdict[str, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._devices = QLSCDeviceRegistry()
+        self.__sent_packets: deque[bytes] = deque(maxlen=self.__ECHO_RING_SIZE)
+        # Max amount of commands waiting for response from one device
+        self.command_window = command_window
+        # Sequence numbers, sent packets waiting for confirmation and RTT estimation per device address
+        self.__channels: dict[bytes, QLPDeviceChannel] = {}
+        # Max amount of commands waiting to be sent to one device per priority class
+        self.queue_limits = queue_limits
+        # Order of sending queued commands of all devices, limits amount of commands waiting for response
+        self.__scheduler = QLPScheduler(max_in_flight)
+        # Period of sending discovery requests to offline devices, None to disable
+        self.reprobe_interval = reprobe_interval
+        # Known devices are loaded from this file on start, saved to it on stop and after changes
+        self.cache_path = cache_path
+        # Seconds between checks of registry for changes to be saved to cache, so several changes are saved at once
+        self.cache_save_interval = 5.0
+        # Every sent and received datagram is appended to this capture file while engine is started
+        self.capture_path = capture_path
+        self.__capture: Optional[QLPCaptureWriter] = None
+        # Queues of running discover() calls, every answered device is put to each of them
+        self.__discovery_queues: set[asyncio.Queue[QLSCDevice]] = set()
+        self.__background_tasks: set[asyncio.Task] = set()
+        self.metrics = QLPEngineMetrics(
+            in_flight=lambda: sum(len(channel.in_flight) for channel in self.__channels.values()),
+            queued=lambda: sum(len(channel.queue) for channel in self.__channels.values()),
+            devices=lambda: len(self._devices),
+        )
         logger.debug('Engine was created')
 
     def __getitem__(self, device_uuid: str) -> Optional[QLSCDevice]:
-        for device in self._devices:
-            if device.device_uuid == device_uuid:
-                return device
-        logger.info('Device with uuid="%s" was not found', device_uuid)
-        return None
+        device = self._devices.by_uuid(device_uuid)
+        if device is None:
+            logger.info('Device with uuid="%s" was not found', device_uuid)
+        return device
+
+    @property
+    def devices(self) -> QLSCDeviceRegistry:
+        return self._devices
 
-    def start(self):
+    async def start(self):
         if self._listening:
             raise QLPError('QLP Listener is already started')
         self._listening = True
-        asyncio.create_task(self.__listening_loop())
+        try:
+            if self.shard is None:
+                self._transport, self.__protocol = await self.__open_socket(self.__QLP_PORT__)
+            else:
+                self.__shared_listener = await self.__open_socket(self.__QLP_PORT__, reuse_port=True)
+                self._transport, self.__protocol = await self.__open_socket(0)
+        except OSError:
+            if self.__shared_listener is not None:
+                self.__shared_listener[0].close()
+                self.__shared_listener = None
+            self._listening = False
+            raise
+        if self.capture_path is not None:
+            self.__capture = QLPCaptureWriter(self.capture_path)
+        self.__run_in_background(self.__measure_loop_lag(self.__LAG_PROBE_INTERVAL))
+        if self.reprobe_interval:
+            self.__run_in_background(self.__reprobe_loop(self.reprobe_interval))
+        if self.cache_path is not None:
+            cached = self._devices.load(self.cache_path)
+            for device in cached:
+                if device.engine is None:
+                    device.engine = self
+            if cached:
+                self.__run_in_background(self.__confirm_devices(cached))
+            self.__run_in_background(self.__save_cache_periodically())
         logger.info('Engine was started')
 
-    def stop(self):
-        if not self._listening:
+    async def stop(self):
+        if not self._listening or self._transport is None:
             raise QLPError('QLP Listener is already stopped')
-        if self._stop_listen:
-            raise QLPError('QLP Listener is already stopping')
-        self._stop_listen = True
-        logger.info('Request to stop')
-
-    async def __listening_loop(self):
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as sock:
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            sock.bind(('', self.__QLP_PORT__))
-            sock.settimeout(0.2)
-            while not self._stop_listen:
-                try:
-                    data, addr = sock.recvfrom(1024)
-                    if data == self.__just_send_packet:
-                        continue
-                    packet = QLPPacket.parse(data, source=addr[0])
-                    logger.info('<<<< RX: %s', data.hex(' ').upper())
-                    logger.debug('Receiving packet: %s', packet)
-                    self.__handle_packet(packet)
-                except (ValueError, socket.timeout):
-                    continue
-                finally:
-                    await asyncio.sleep(0.1)
-        self._stop_listen = False
+        background_tasks = list(self.__background_tasks)
+        for task in background_tasks:
+            task.cancel()
+        self.__background_tasks.clear()
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        self.__fail_pending(QLPError('QLP Engine was stopped'))
+        if self.cache_path is not None:
+            self._devices.save(self.cache_path)
+        self._transport.close()
+        await self.__protocol.closed
+        self._transport = None
+        if self.__shared_listener is not None:
+            self.__shared_listener[0].close()
+            await self.__shared_listener[1].closed
+            self.__shared_listener = None
+        if self.__capture is not None:
+            self.__capture.close()
+            self.__capture = None
         self._listening = False
         logger.info('Engine was stopped')
 
+    def __fail_pending(self, error: QLPError) -> None:
+        """Fail queued commands and the ones waiting for response, nothing can be sent or received any more"""
+        for channel in self.__channels.values():
+            while (queued := channel.dequeue()) is not None:
+                for waiter in queued.waiters:
+                    if not waiter.done():
+                        waiter.set_exception(error)
+            for command in channel.in_flight.values():
+                if command.timer is not None:
+                    command.timer.cancel()
+                if not command.response.done():
+                    command.response.set_exception(error)
+
+    def __datagram_received(self, data: bytes, addr: tuple[str, int]) -> None:
+        if data in self.__sent_packets:
+            # Our own broadcast came back
+            self.__sent_packets.remove(data)
+            return
+        if self.__capture is not None:
+            self.__capture.record(Direction.RX, data, addr)
+        self.metrics.rx_packets.inc()
+        self.metrics.rx_bytes.inc(len(data))
+        try:
+            packet = QLPPacket.parse(data, source=addr[0], source_port=addr[1])
+        except (ValueError, IndexError):
+            self.metrics.invalid_packets.inc()
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug('Invalid packet from %s was dropped: %s', addr[0], data.hex(' ').upper())
+            return
+        if logger.isEnabledFor(logging.INFO):
+            logger.info('<<<< RX: %s', data.hex(' ').upper())
+            logger.debug('Receiving packet: %s', packet)
+        self.__handle_packet(packet)
+
     def __handle_packet(self, packet: QLPPacket):
         if packet.data[:3] == dpb.I_AM_HERE:
-            new_dev = QLSCDevice(
-                ip=packet.source,
-                device_chip_id=packet.data[4:12].decode(),
-                device_uuid=packet.data[13:21].decode(),
-                name=packet.data[22:].decode(),
-            )
-            new_dev.set_engine(self)
-            self._devices.add(new_dev)
-        if packet.device_id is not None:
-            if packet.device_id not in self.__packets:
-                raise NotImplementedError('WTF happen???')
-            packet_counter = self.__packets[packet.device_id][1]
-            if packet.packet_counter == packet_counter:
-                self.__locks[packet.device_id].release()
-                logger.debug(
-                    'Response from device_id="%s" for command_counter=%s was received, lock was released',
-                    packet.device_id,
-                    str(packet_counter),
-                )
-                del self.__packets[packet.device_id]
-            else:
-                logger.debug(
-                    'Command counter is incorrect. Wait for %s, received %s. '
-                    'Probably that was response to another client',
-                    packet_counter,
-                    packet.packet_counter,
+            assert packet.source_address is not None
+            answer = _parse_i_am_here(packet.data)
+            if answer is None:
+                self.metrics.invalid_packets.inc()
+                logger.debug('Malformed discovery answer from %s was dropped', packet.source)
+                return
+            device_chip_id, device_uuid, name = answer
+            if self.shard is not None and shard_of(device_chip_id, self.shard[1]) != self.shard[0]:
+                # Device is controlled by another shard, it is only reported to discovery to be handed over
+                found = QLSCDevice(
+                    ip=packet.source_address[0], port=packet.source_address[1],
+                    device_chip_id=device_chip_id, device_uuid=device_uuid, name=name,
                 )
+                for queue in self.__discovery_queues:
+                    queue.put_nowait(found)
+                return
+            device = self._devices.upsert(
+                address=packet.source_address,
+                device_chip_id=device_chip_id,
+                device_uuid=device_uuid,
+                name=name,
+            )
+            if device.engine is None:
+                device.engine = self
+            channel = self.__channels.get(device.device_address)
+            if channel is not None and channel.state != DeviceState.ONLINE:
+                logger.info('Device chip_id="%s" is back online', device.device_chip_id)
+                channel.register_response()
+            device.state = DeviceState.ONLINE
+            for queue in self.__discovery_queues:
+                queue.put_nowait(device)
+        if packet.packet_type == PacketType.CONTROL and packet.command_id == CommandID.COMMON_RESPONSE:
+            self.__handle_response(packet)
+
+    def __handle_response(self, packet: QLPPacket) -> None:
+        channel = self.__channels.get(packet.device_address)
+        command = channel.in_flight.get(packet.packet_id) if channel and packet.packet_id is not None else None
+        if channel is None or command is None:
+            logger.debug(
+                'Unexpected response with command_counter=%s. Probably that was response to another client',
+                packet.packet_id,
+            )
+            return
+        if command.response.done():
+            return
+        command.response.set_result(packet)
+        # Karn's algorithm: response to retransmitted packet can belong to any of attempts
+        rtt = asyncio.get_running_loop().time() - command.sent_at if command.attempts == 1 else None
+        if rtt is not None:
+            self.metrics.rtt.labels(f'{int.from_bytes(packet.device_address, "little"):08X}').observe(rtt)
+        self.__update_state(command.packet, channel.register_response(rtt))
+        logger.debug('Response for command_counter=%s was received', packet.packet_id)
+
+    def __expire(self, channel: QLPDeviceChannel, command: InFlightCommand) -> None:
+        if command.response.done():
+            return
+        state = channel.register_loss()
+        self.__update_state(command.packet, state)
+        if command.retransmissions_left > 0 and state != DeviceState.OFFLINE:
+            command.retransmissions_left -= 1
+            self.metrics.retransmissions.inc()
+            logger.debug('No response for command_counter=%s, retransmitting', command.packet.packet_id)
+            self.__attempt(channel, command)
+            return
+        self.metrics.timeouts.inc()
+        command.response.set_exception(QLPTimeoutError(f'No response for command_counter={command.packet.packet_id}'))
+
+    def __attempt(self, channel: QLPDeviceChannel, command: InFlightCommand) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            self.__send(command.packet, command.serialized)
+        except (QLPError, OSError) as error:
+            # Window slot and scheduler's count are freed by completion of the response
+            command.response.set_exception(error)
+            return
+        command.sent_at = loop.time()
+        command.timer = loop.call_later(
+            channel.retransmission_timeout(command.attempts), self.__expire, channel, command,
+        )
+        command.attempts += 1
+
+    def __update_state(self, packet: QLPPacket, state: DeviceState) -> None:
+        device = self._devices.by_chip_id(f'{int.from_bytes(packet.device_address, "little"):08X}')
+        if device is not None and device.state != state:
+            logger.info('Device chip_id="%s" is %s now', device.device_chip_id, state.value)
+            device.state = state
+
+    async def __open_socket(
+            self, port: int, reuse_port: bool = False,
+    ) -> tuple[asyncio.DatagramTransport, QLPDatagramProtocol]:
+        return await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: QLPDatagramProtocol(self.__datagram_received),
+            local_addr=('0.0.0.0', port),
+            allow_broadcast=True,
+            reuse_port=reuse_port or None,
+        )
+
+    def __run_in_background(self, coroutine) -> None:
+        task = asyncio.create_task(coroutine)
+        self.__background_tasks.add(task)
+        task.add_done_callback(self.__background_tasks.discard)
+
+    async def __confirm_devices(self, devices: list[QLSCDevice]) -> None:
+        """Probe devices loaded from cache, the ones which did not answer are marked offline"""
+        answered = {
+            device async for device in self.discover(
+                expected=len(devices),
+                addresses={(device.ip, device.port) for device in devices},
+            )
+        }
+        for device in devices:
+            if device not in answered:
+                logger.info('Cached device chip_id="%s" did not answer', device.device_chip_id)
+                device.state = self.__channel(device.device_address).mark_offline()
+        logger.info('%s of %s cached devices are confirmed', len(answered & set(devices)), len(devices))
 
-    async def _send_packet(self, packet: QLPPacket) -> None:
-        if packet.device_id is not None:
-            lock = self.__locks[packet.device_id]
-            if lock.locked():
-                if (datetime.datetime.now() - self.__packets[packet.device_id][0]).total_seconds() < self.__RECV_TIMEOUT:
-                    logger.info('Sending of packet paused: waiting for response for previous command')
-                    while lock.locked() and (datetime.datetime.now() - self.__packets[packet.device_id][0]).total_seconds() < self.__RECV_TIMEOUT:
-                        await asyncio.sleep(0.01)
-                if (datetime.datetime.now() - self.__packets[packet.device_id][0]).total_seconds() > self.__RECV_TIMEOUT:
-                    logger.debug('Lock was released because no response from device')
-                    lock.release()
-        else:
+    async def __save_cache_periodically(self) -> None:
+        """Save devices when registry has changed, so they are not lost if process is killed"""
+        saved = self._devices.generation
+        while True:
+            await asyncio.sleep(self.cache_save_interval)
+            if self.cache_path is None or self._devices.generation == saved:
+                continue
+            saved = self._devices.generation
+            try:
+                self._devices.save(self.cache_path)
+            except OSError as error:
+                logger.warning('Device cache was not saved: %s', error)
+
+    async def __reprobe_loop(self, interval: float) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            for device in self._devices:
+                if device.state == DeviceState.OFFLINE:
+                    logger.debug('Probing offline device chip_id="%s"', device.device_chip_id)
+                    await self._send_packet(
+                        QLPPacket(dpb.ANYBODY_HERE, PacketType.DISCOVERY, destination=(device.ip, device.port))
+                    )
+
+    async def __measure_loop_lag(self, interval: float) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + interval
+            await asyncio.sleep(interval)
+            self.metrics.loop_lag.observe(max(loop.time() - expected, 0.0))
+
+    async def _send_packet(self, packet: QLPPacket, priority: Optional[Priority] = None) -> Optional[QLPPacket]:
+        """Send packet. For packet addressed to device waits and returns its COMMON_RESPONSE
+
+        Up to command_window commands may wait for response from one device at the same time, the rest are queued
+        in order. Priority class (by default derived from command) decides which device is served first, devices
+        take turns within a class. Commands of one device are never reordered. QLPQueueFullError is raised
+        if the device has too many queued commands of the class.
+        Queued command is replaced by a newer one overwriting the same state (e.g. FILL or SET_BRIGHTNESS),
+        caller of the replaced one gets response of the newer.
+        Unacknowledged ones are retransmitted with the same sequence number and timeout adapted
+        to device's round-trip time, commands to offline device are not retransmitted.
+        """
+        if self._transport is None:
+            raise QLPError('QLP Engine is not started')
+        if packet.device_id is None:
             logger.debug('Packet has no device_id so no awaiting')
+            self.__send(packet, packet.serialize())
+            return None
+
+        channel = self.__channel(packet.device_address)
+        waiter: asyncio.Future[QLPPacket] = asyncio.get_running_loop().create_future()
+        try:
+            if channel.enqueue(packet, waiter, default_priority(packet.command_id) if priority is None else priority):
+                self.metrics.coalesced.inc()
+        except QLPQueueFullError:
+            self.metrics.rejected.inc()
+            raise
+        self.__scheduler.schedule(channel)
+        self.__pump()
+        return await waiter
+
+    def __channel(self, device_address: bytes) -> QLPDeviceChannel:
+        channel = self.__channels.get(device_address)
+        if channel is None:
+            channel = self.__channels[device_address] = QLPDeviceChannel(self.command_window, self.queue_limits)
+        return channel
+
+    def __pump(self) -> None:
+        while (ready := self.__scheduler.next()) is not None:
+            self.__dispatch(*ready)
+
+    def __dispatch(self, channel: QLPDeviceChannel, queued: QueuedCommand) -> None:
+        packet = queued.packet
+        packet.packet_id = sequence = channel.next_sequence()
+        command = InFlightCommand(
+            packet,
+            packet.serialize(),
+            asyncio.get_running_loop().create_future(),
+            self.__RETRANSMISSIONS,
+            waiters=queued.waiters,
+        )
+        channel.in_flight[sequence] = command
+        command.response.add_done_callback(functools.partial(self.__complete, channel, sequence, command))
+        self.__attempt(channel, command)
 
-        # if packet.device_id in self.__packets or (datetime.datetime.now() - self.__packets[packet.device_id][0]).total_seconds() < self.__RECV_TIMEOUT:
-        #     logger.info('Sending of packet paused: waiting for response for previous command')
-        #     while packet.device_id in self.__packets:
-        #         await asyncio.sleep(0.01)
-
-        serialized_packet = packet.serialize() if isinstance(packet, QLPPacket) else packet
-        logger.info('>>>> TX: %s', serialized_packet.hex(' ').upper())
-        logger.debug('Sending packet: %s', packet)
-        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as sock:
-            sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            sock.sendto(serialized_packet, ('255.255.255.255', self.__QLP_PORT__))
-            self.__just_send_packet = serialized_packet
-            self.__packets[packet.device_id] = (datetime.datetime.now(), packet.packet_counter)
-            await self.__locks[packet.device_id].acquire()
-            # raise NotImplementedError('Тут записывает пакет в список ожидания ответа')
-
-    async def discover_all_devices(self, timeout: float = __RECV_TIMEOUT) -> Set[QLSCDevice]:
+    def __complete(
+            self,
+            channel: QLPDeviceChannel,
+            sequence: int,
+            command: InFlightCommand,
+            response: asyncio.Future[QLPPacket],
+    ) -> None:
+        if command.timer is not None:
+            command.timer.cancel()
+        del channel.in_flight[sequence]
+        # Superseded commands are resolved first, so their callers don't overwrite state of the newer one
+        for waiter in command.waiters:
+            if waiter.done():
+                continue
+            if response.cancelled():
+                waiter.cancel()
+            elif (error := response.exception()) is not None:
+                waiter.set_exception(error)
+            else:
+                waiter.set_result(response.result())
+        self.__scheduler.release(channel)
+        self.__pump()
+
+    def __send(self, packet: QLPPacket, serialized_packet: bytes) -> None:
+        if logger.isEnabledFor(logging.INFO):
+            logger.info('>>>> TX: %s', serialized_packet.hex(' ').upper())
+            logger.debug('Sending packet: %s', packet)
+        self.__transmit(serialized_packet, packet.destination)
+
+    def __transmit(self, data: bytes, destination: Optional[tuple[str, int]]) -> None:
+        """Send datagram through the listening socket: unicast if device address is known, broadcast otherwise"""
+        if self._transport is None:
+            raise QLPError('QLP Engine is not started')
+        if destination is None:
+            self.__sent_packets.append(data)
+            destination = (self.__BROADCAST_ADDRESS, self.__QLP_PORT__)
+        self._transport.sendto(data, destination)
+        if self.__capture is not None:
+            self.__capture.record(Direction.TX, data, destination)
+        self.metrics.tx_packets.inc()
+        self.metrics.tx_bytes.inc(len(data))
+
+    def group(self, group_id: int) -> QLSCGroup:
+        """Multicast group controlled with single BROADCAST packets, groups 0x00 and 0xFF address every device"""
+        return QLSCGroup(self, group_id)
+
+    async def assign_group(self, group_id: int, *devices: QLSCDevice) -> QLSCGroup:
+        """Make devices listen to multicast group, group 0 removes them from any group
+
+        Every device is tried, the first error is raised after that
+        """
+        if group_id == 0xFF:
+            raise QLPError('Broadcast group can not be assigned')
+        group = self.group(group_id)
+        results = await asyncio.gather(
+            *(device.set_multicast_group(group_id) for device in devices),
+            return_exceptions=True,
+        )
+        errors = [result for result in results if isinstance(result, BaseException)]
+        for device, result in zip(devices, results):
+            if not isinstance(result, BaseException):
+                self._devices.set_group(device, group_id)
+        if errors:
+            raise errors[0]
+        return group
+
+    async def discover(  # pylint: disable=too-many-arguments
+            self,
+            expected: Optional[int] = None,
+            timeout: float = __DISCOVERY_TIMEOUT,
+            quiet: float = __DISCOVERY_QUIET,
+            probes: int = __DISCOVERY_PROBES,
+            addresses: Iterable[tuple[str, int]] = (),
+    ) -> AsyncGenerator[QLSCDevice, None]:
+        """Yield every device as soon as it answers discovery request
+
+        Request is broadcast and also sent directly to addresses, e.g. of devices in another subnet.
+        It is repeated up to probes times when nobody answers for quiet seconds to recover lost packets.
+        Search is finished when expected amount of devices answered, after quiet period following the last
+        request, or after timeout
+        """
+        loop = asyncio.get_running_loop()
+        addresses = list(addresses)
+        queue: asyncio.Queue[QLSCDevice] = asyncio.Queue()
+        found: set[str] = set()
+        deadline = loop.time() + timeout
+        last_activity = float('-inf')
+        probes_sent = 0
         logger.debug('Search for devices...')
-        await self._send_packet(QLPPacket(dpb.ANYBODY_HERE, PacketType.DISCOVERY))
-        await asyncio.sleep(timeout)
-        return self._devices
+        self.__discovery_queues.add(queue)
+        try:
+            while (remaining := deadline - loop.time()) > 0:
+                if probes_sent < probes and loop.time() - last_activity >= quiet:
+                    self.__probe(addresses)
+                    probes_sent += 1
+                    last_activity = loop.time()
+                try:
+                    device = await asyncio.wait_for(
+                        queue.get(), max(min(remaining, last_activity + quiet - loop.time()), 0),
+                    )
+                except asyncio.TimeoutError:
+                    if probes_sent >= probes:
+                        return
+                    continue
+                last_activity = loop.time()
+                if device.device_chip_id in found:
+                    continue
+                found.add(device.device_chip_id)
+                yield device
+                if expected is not None and len(found) >= expected:
+                    return
+        finally:
+            self.__discovery_queues.discard(queue)
+
+    def __probe(self, addresses: list[tuple[str, int]]) -> None:
+        request = QLPPacket(dpb.ANYBODY_HERE, PacketType.DISCOVERY)
+        serialized = request.serialize()
+        self.__send(request, serialized)
+        for address in addresses:
+            self.__send(QLPPacket(dpb.ANYBODY_HERE, PacketType.DISCOVERY, destination=address), serialized)
+
+    async def discover_all_devices(
+            self,
+            timeout: float = __DISCOVERY_TIMEOUT,
+            addresses: Iterable[tuple[str, int]] = (),
+            expected: Optional[int] = None,
+    ) -> Set[QLSCDevice]:
+        """Search for devices like discover() does, returns all known devices"""
+        async for _ in self.discover(expected, timeout, addresses=addresses):
+            pass
+        return set(self._devices)
+
+    async def connect_new_devices(  # pylint: disable=too-many-arguments
+            self,
+            ssid: str,
+            password: str,
+            expected: int = 1,
+            timeout: float = 60,
+            bssid: Optional[str] = None,
+            addresses: Iterable[tuple[str, int]] = (),
+    ) -> Set[QLSCDevice]:
+        """Send Wi-Fi credentials with ESP-Touch until expected amount of new devices answered discovery
 
-    @staticmethod
-    def connect_new_devices(ssid: str, password: str):
-        esp_touch_init(ssid, password, 'T', '255.255.255.255', None)
-        esp_touch_send_data()
+        Discovery is also sent to addresses like discover() does. Other traffic goes on meanwhile.
+        Returns new devices, there may be less of them if timeout passed
+        """
+        addresses = list(addresses)
+        known = {device.device_chip_id for device in self._devices}
+        found: set[QLSCDevice] = set()
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        sending = asyncio.create_task(ESPTouchSession(ssid, password, bssid=bssid).run())
+        try:
+            while len(found) < expected and not sending.done() and (remaining := deadline - loop.time()) > 0:
+                async with aclosing(self.discover(
+                        timeout=min(remaining, self.__DISCOVERY_TIMEOUT), addresses=addresses,
+                )) as devices:
+                    async for device in devices:
+                        if device.device_chip_id not in known:
+                            logger.info('New device chip_id="%s" was connected', device.device_chip_id)
+                            found.add(device)
+                        if len(found) >= expected:
+                            break
+        finally:
+            sending.cancel()
+            await asyncio.gather(sending, return_exceptions=True)
+        if sending.done() and not sending.cancelled() and sending.exception() is not None:
+            raise QLPError('ESP-Touch provisioning failed') from sending.exception()
+        return found
@@ -9,5 +9,7 @@ class CommonResponseCode(OneByteSerializableEnum):
     CRC_ERROR = 0x02
     ENCRYPTION_ERROR = 0x03
     LENGTH_ERROR = 0x04
-    # RESERVED: 0x05-0xFE
+    INVALID_HEADER_ERROR = 0x05
+    INVALID_PACKET_TYPE = 0x06
+    # RESERVED: 0x07-0xFE
     OTHER_ERROR = 0xFF  # should contain text
@@ -0,0 +1,10 @@
+from enum import Enum
+
+
+class DeviceState(str, Enum):
+    """Health of device estimated from its responses"""
+    ONLINE = 'online'
+    # Some packets were lost recently
+    DEGRADED = 'degraded'
+    # Device didn't respond for a long time, commands are not retransmitted
+    OFFLINE = 'offline'
@@ -0,0 +1,11 @@
+from utils.byte_serializable import OneByteSerializableEnum
+
+
+# pylint: disable=too-few-public-methods
+class MasterMode(OneByteSerializableEnum):
+    """Role of controller in synchronization of device effects, set with SET_MASTER"""
+    OFF = 0x00
+    # Sends SYNC_PACKET to its multicast group
+    MULTICAST = 0x01
+    # Sends SYNC_PACKET to every device
+    COMMON = 0x02
@@ -0,0 +1,11 @@
+from enum import IntEnum
+
+
+class Priority(IntEnum):
+    """Outbound traffic classes, lower value is sent first"""
+    # Settings and service commands: length, mode, reboot, etc.
+    CONTROL = 0
+    # Commands of live user input: fill, pixels, brightness
+    INTERACTIVE = 1
+    # Frame streaming
+    BULK = 2
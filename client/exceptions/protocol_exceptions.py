@@ -1,19 +1,31 @@
-from typing import Optional
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, Optional
 
 from enums.common_response_code import CommonResponseCode
-from models.device import QLSCDevice
-from models.packet import QLPPacket
+
+if TYPE_CHECKING:
+    from models.device_base import QLSCDeviceBase
+    from models.packet import QLPPacket
 
 
 class QLPError(Exception):
     """Base Quantum0's LED Strip Protocol Exception"""
 
 
+class QLPTimeoutError(QLPError):
+    """QLSCDevice did not respond in time"""
+
+
+class QLPQueueFullError(QLPError):
+    """Too many commands of the priority class are waiting to be sent to QLSCDevice, caller has to slow down"""
+
+
 class QLPResponseWithError(QLPError):
     """Error from QLSCDevice"""
     def __init__(
             self,
-            device: QLSCDevice,
+            device: QLSCDeviceBase,
             sent_packet: Optional[QLPPacket],
             received_error: CommonResponseCode,
             error_text: Optional[str]
@@ -27,5 +39,8 @@ class QLPResponseWithError(QLPError):
         if received_error != CommonResponseCode.OTHER_ERROR and error_text is not None:
             raise QLPError('Description is not available for any error exclude OTHER_ERROR')
 
+    def __str__(self) -> str:
+        return self.error_text or self.received_error.name
+
     def __repr__(self) -> str:
-        return f'<{self.__class__.__name__} {self.error_text or self.received_error.name}>'
+        return f'<{self.__class__.__name__} {self}>'
@@ -1,28 +1,29 @@
 import asyncio
 import logging
 
+from emulator import QLSCEmulator
 from engine import QLPEngine
 from models.color import Color
-from models.device import QLSCDevice
 
 logging.basicConfig(level=logging.DEBUG)
 
 
 async def main():
     eng = QLPEngine()
-    eng.start()
-    # eng.start()
+    await eng.start()
+    # await eng.start()
     await asyncio.sleep(1)
     devs = await eng.discover_all_devices()
     print(devs)
+    emulator = None
     if devs:
         print('Device was found')
         d = list(devs)[0]
     else:
         print('Emulating device')
-        d = QLSCDevice(ip='1.2.3.4', device_chip_id='ABCDE', device_uuid='12345', name='Test Device')
-        # setattr(d, '_engine', eng)
-        d.set_engine(eng)
+        emulator = await QLSCEmulator(1).start()
+        devs = await eng.discover_all_devices(addresses=emulator.addresses)
+        d = list(devs)[0]
     await d.set_length(30)
     # await asyncio.sleep(1)
     await d.fill(Color(3, 1, 4))
@@ -36,8 +37,10 @@ async def main():
         # await asyncio.sleep(0.02)
     await asyncio.sleep(5)
     await d.reboot()
-    eng.stop()
-    # eng.stop()
+    if emulator:
+        await emulator.stop()
+    await eng.stop()
+    # await eng.stop()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,203 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Mapping, Optional
+
+from enums.commands import CommandID
+from enums.device_state import DeviceState
+from enums.priority import Priority
+from exceptions.protocol_exceptions import QLPQueueFullError
+from models.packet import QLPPacket
+
+SEQUENCE_SPACE = 256
+# Max amount of commands waiting for the window of one device per priority class
+DEFAULT_QUEUE_LIMITS = {Priority.CONTROL: 64, Priority.INTERACTIVE: 64, Priority.BULK: 256}
+_INTERACTIVE_COMMANDS = frozenset({
+    CommandID.SET_COLOR, CommandID.SET_BRIGHTNESS,
+    CommandID.SET_PIXEL, CommandID.SET_LINE, CommandID.SET_GRADIENT, CommandID.FILL,
+})
+_BULK_COMMANDS = frozenset({CommandID.SET_LINE_IMAGE, CommandID.SET_ALL_PIXELS})
+# Device state overwritten by commands with the same coalescing key
+_PIXELS = 'pixels'
+_PIXEL = 'pixel'
+_BRIGHTNESS = 'brightness'
+_COLOR = 'color'
+_DOMAINS = {_PIXELS: _PIXELS, _PIXEL: _PIXELS, _BRIGHTNESS: _BRIGHTNESS, _COLOR: _COLOR}
+
+
+def coalescing_key(packet: QLPPacket) -> Optional[tuple]:
+    """Commands with the same key overwrite the same device state, so only the last one of them must be sent
+
+    None for commands which are executed strictly in order
+    """
+    command_id = packet.command_id
+    if command_id in (CommandID.FILL, CommandID.SET_ALL_PIXELS):
+        return (_PIXELS,)
+    if command_id == CommandID.SET_PIXEL:
+        return (_PIXEL, bytes(packet.payload[:2]))
+    if command_id == CommandID.SET_BRIGHTNESS:
+        return (_BRIGHTNESS,)
+    if command_id == CommandID.SET_COLOR and len(packet.payload) == 3:
+        # SET_COLOR without color asks for the current one
+        return (_COLOR,)
+    return None
+
+
+def default_priority(command_id: CommandID) -> Priority:
+    if command_id in _BULK_COMMANDS:
+        return Priority.BULK
+    if command_id in _INTERACTIVE_COMMANDS:
+        return Priority.INTERACTIVE
+    return Priority.CONTROL
+
+
+def _reorderable(queued_key: Optional[tuple], key: tuple) -> bool:
+    """Whether command with key may be moved ahead of the queued one without changing the result"""
+    if queued_key is None:
+        return False
+    if _DOMAINS[queued_key[0]] != _DOMAINS[key[0]]:
+        return True
+    # Different pixels
+    return queued_key[0] == key[0] == _PIXEL and queued_key != key
+
+
+@dataclass
+class QueuedCommand:
+    """Command waiting for free slot in device's window, superseded commands share their waiters with it"""
+    packet: QLPPacket
+    waiters: list[asyncio.Future[QLPPacket]]
+    priority: Priority
+    key: Optional[tuple] = None
+
+
+@dataclass
+class InFlightCommand:  # pylint: disable=too-many-instance-attributes
+    """Command sent to device and not acknowledged yet"""
+    packet: QLPPacket
+    serialized: bytes
+    response: asyncio.Future[QLPPacket]
+    retransmissions_left: int
+    sent_at: float = 0.0
+    # Sending attempts made, response to retransmitted command gives no RTT sample
+    attempts: int = 0
+    timer: Optional[asyncio.TimerHandle] = field(default=None, repr=False)
+    # Callers of the command and of the ones superseded by it
+    waiters: list[asyncio.Future[QLPPacket]] = field(default_factory=list, repr=False)
+
+
+class QLPDeviceChannel:  # pylint: disable=too-many-instance-attributes
+    """Per-device link state: own 8-bit sequence space, sliding window of unacknowledged commands,
+    queue of commands waiting for the window and retransmission timeout estimated from round-trip time
+    like TCP does (RFC 6298)
+
+    Commands are sent in order they were queued whatever their priority classes are, a later command must not
+    overtake an earlier one, e.g. FILL a frame or SET_LENGTH a FILL. The highest class in the queue is
+    the priority of the whole device among the others
+    """
+    INITIAL_RTO = 0.5
+    MIN_RTO = 0.05
+    MAX_RTO = 3.0
+    # Consecutive lost packets to consider device degraded or offline
+    DEGRADED_AFTER = 2
+    OFFLINE_AFTER = 6
+
+    def __init__(self, window: int, queue_limits: Optional[Mapping[Priority, int]] = None) -> None:
+        if not 0 < window <= SEQUENCE_SPACE // 2:
+            raise ValueError(f'Window must be between 1 and {SEQUENCE_SPACE // 2}')
+        self.window = window
+        self.in_flight: dict[int, InFlightCommand] = {}
+        self.queue: deque[QueuedCommand] = deque()
+        # Amount of queued commands per priority class, limited by queue_limits
+        self.queued: dict[Priority, int] = {priority: 0 for priority in Priority}
+        self.queue_limits = {**DEFAULT_QUEUE_LIMITS, **(queue_limits or {})}
+        # Priority classes in which the channel waits for its turn to send
+        self.scheduled: set[Priority] = set()
+        self._next_sequence = 0
+        self.srtt: Optional[float] = None
+        self.rttvar = 0.0
+        self.rto = self.INITIAL_RTO
+        self.consecutive_losses = 0
+        self.state = DeviceState.ONLINE
+
+    def has_room(self) -> bool:
+        return len(self.in_flight) < self.window
+
+    @property
+    def priority(self) -> Optional[Priority]:
+        """The highest class of queued commands, None if nothing is queued"""
+        return next((priority for priority, count in self.queued.items() if count), None)
+
+    def enqueue(self, packet: QLPPacket, waiter: asyncio.Future[QLPPacket], priority: Priority) -> bool:
+        """Queue command, returns True if it replaced still unsent one (last writer wins)
+
+        Queued command with the same coalescing key is dropped if no command between them depends on it,
+        waiter gets the response of the new one, which keeps the higher class of both.
+        Raises QLPQueueFullError if queue of the priority class is full
+        """
+        key = coalescing_key(packet)
+        if key is not None:
+            for queued in reversed(self.queue):
+                if queued.key == key:
+                    self.queue.remove(queued)
+                    self.queued[queued.priority] -= 1
+                    self.__append(QueuedCommand(packet, queued.waiters + [waiter], min(priority, queued.priority), key))
+                    return True
+                if not _reorderable(queued.key, key):
+                    break
+        if self.queued[priority] >= self.queue_limits[priority]:
+            raise QLPQueueFullError(f'{self.queued[priority]} {priority.name} commands are already queued')
+        self.__append(QueuedCommand(packet, [waiter], priority, key))
+        return False
+
+    def __append(self, queued: QueuedCommand) -> None:
+        self.queue.append(queued)
+        self.queued[queued.priority] += 1
+
+    def dequeue(self) -> Optional[QueuedCommand]:
+        """Take the next command somebody is still waiting for"""
+        while self.queue:
+            queued = self.queue.popleft()
+            self.queued[queued.priority] -= 1
+            if not all(waiter.done() for waiter in queued.waiters):
+                return queued
+        return None
+
+    def retransmission_timeout(self, attempt: int) -> float:
+        """Timeout of sending attempt, doubled for every retransmission"""
+        return min(self.rto * 2 ** attempt, self.MAX_RTO)
+
+    def register_response(self, rtt: Optional[float] = None) -> DeviceState:
+        """Account response, rtt is None if it can not be measured (response to retransmitted packet)"""
+        if rtt is not None:
+            if self.srtt is None:
+                self.srtt = rtt
+                self.rttvar = rtt / 2
+            else:
+                self.rttvar = 0.75 * self.rttvar + 0.25 * abs(self.srtt - rtt)
+                self.srtt = 0.875 * self.srtt + 0.125 * rtt
+            self.rto = min(max(self.srtt + 4 * self.rttvar, self.MIN_RTO), self.MAX_RTO)
+        self.consecutive_losses = 0
+        self.state = DeviceState.ONLINE
+        return self.state
+
+    def register_loss(self) -> DeviceState:
+        self.consecutive_losses += 1
+        if self.consecutive_losses >= self.OFFLINE_AFTER:
+            self.state = DeviceState.OFFLINE
+        elif self.consecutive_losses >= self.DEGRADED_AFTER:
+            self.state = DeviceState.DEGRADED
+        return self.state
+
+    def mark_offline(self) -> DeviceState:
+        """Device did not answer probe, its commands are not retransmitted until it answers"""
+        self.consecutive_losses = self.OFFLINE_AFTER
+        self.state = DeviceState.OFFLINE
+        return self.state
+
+    def next_sequence(self) -> int:
+        """Take next sequence number, skipping ones which are still waiting for acknowledge"""
+        while self._next_sequence in self.in_flight:
+            self._next_sequence = (self._next_sequence + 1) % SEQUENCE_SPACE
+        sequence = self._next_sequence
+        self._next_sequence = (self._next_sequence + 1) % SEQUENCE_SPACE
+        return sequence
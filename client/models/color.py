@@ -1,3 +1,4 @@
+import colorsys
 from typing import Self
 
 
@@ -24,8 +25,9 @@ class Color:
 
     @classmethod
     def from_HSV(cls, hue: int, saturation: int, value: int) -> Self:  # pylint: disable=invalid-name
-        # TODO
-        raise NotImplementedError()
+        """Color from HSV components, every one is 0-255"""
+        red, green, blue = colorsys.hsv_to_rgb(hue / 256, saturation / 255, value / 255)
+        return cls(round(red * 255), round(green * 255), round(blue * 255))
 
     def __bytes__(self) -> bytes:
-        return self.R.to_bytes(1, 'big') + self.G.to_bytes(1, 'big') + self.B.to_bytes(1, 'big')
+        return bytes((self.red, self.green, self.blue))
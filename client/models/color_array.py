@@ -0,0 +1,110 @@
+from functools import lru_cache
+from typing import Iterable, Self, overload
+
+import numpy as np
+
+from models.color import Color
+
+
+@lru_cache(maxsize=32)
+def gamma_table(gamma: float) -> np.ndarray:
+    """256-entry lookup table of gamma correction"""
+    return np.round(255 * (np.arange(256) / 255) ** gamma).astype(np.uint8)
+
+
+@lru_cache(maxsize=256)
+def brightness_table(brightness: int) -> np.ndarray:
+    """256-entry lookup table scaling channel by brightness 0-255"""
+    if not 0 <= brightness < 256:
+        raise ValueError('Brightness must be between 0 and 255')
+    return (np.arange(256, dtype=np.uint16) * brightness // 255).astype(np.uint8)
+
+
+def hsv_to_rgb(hue: np.ndarray, saturation: np.ndarray, value: np.ndarray) -> np.ndarray:
+    """Vectorized HSV to RGB conversion, every component is 0-255, returns (N, 3) uint8 array"""
+    hue = np.asarray(hue, dtype=np.float32) * (6 / 256)
+    saturation = np.asarray(saturation, dtype=np.float32) / 255
+    value = np.asarray(value, dtype=np.float32)
+    sector = np.floor(hue)
+    fraction = hue - sector
+    sector = sector.astype(np.int8) % 6
+    lowest = value * (1 - saturation)
+    falling = value * (1 - saturation * fraction)
+    rising = value * (1 - saturation * (1 - fraction))
+    red = np.choose(sector, [value, falling, lowest, lowest, rising, value])
+    green = np.choose(sector, [rising, value, value, falling, lowest, lowest])
+    blue = np.choose(sector, [lowest, lowest, rising, value, value, falling])
+    return np.rint(np.stack([red, green, blue], axis=-1)).astype(np.uint8)
+
+
+class ColorArray:
+    """Colors of strip's pixels stored in one contiguous (N, 3) uint8 array"""
+
+    def __init__(self, pixels: np.ndarray | int) -> None:
+        if isinstance(pixels, int):
+            pixels = np.zeros((pixels, 3), dtype=np.uint8)
+        if pixels.ndim != 2 or pixels.shape[1] != 3:
+            raise ValueError('Pixels array must have (N, 3) shape')
+        self.array: np.ndarray = np.ascontiguousarray(pixels, dtype=np.uint8)
+
+    @classmethod
+    def from_colors(cls, colors: Iterable[Color]) -> Self:
+        return cls.from_bytes(b''.join(bytes(color) for color in colors))
+
+    @classmethod
+    def from_bytes(cls, data: bytes | bytearray | memoryview) -> Self:
+        if len(data) % 3:
+            raise ValueError('Buffer length must be multiple of 3')
+        return cls(np.frombuffer(data, dtype=np.uint8).reshape(-1, 3).copy())
+
+    @classmethod
+    def from_hsv(cls, hue: np.ndarray, saturation: np.ndarray | int = 255, value: np.ndarray | int = 255) -> Self:
+        """Colors from HSV components, every one is 0-255; scalar components are broadcasted to hue"""
+        hue = np.asarray(hue)
+        return cls(hsv_to_rgb(
+            hue,
+            np.broadcast_to(saturation, hue.shape),
+            np.broadcast_to(value, hue.shape),
+        ))
+
+    def __len__(self) -> int:
+        return len(self.array)
+
+    @overload
+    def __getitem__(self, index: int) -> Color: ...
+
+    @overload
+    def __getitem__(self, index: slice) -> 'ColorArray': ...
+
+    def __getitem__(self, index: int | slice) -> 'Color | ColorArray':
+        if isinstance(index, slice):
+            return ColorArray(self.array[index])
+        red, green, blue = self.array[index]
+        return Color(int(red), int(green), int(blue))
+
+    def __setitem__(self, index: int | slice, color: Color) -> None:
+        self.array[index] = (color.red, color.green, color.blue)
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, ColorArray):
+            return NotImplemented
+        return np.array_equal(self.array, other.array)
+
+    def __bytes__(self) -> bytes:
+        return self.array.tobytes()
+
+    @property
+    def view(self) -> memoryview:
+        """Flat RGB view of pixels, in-place changes of array are visible through it"""
+        return self.array.reshape(-1).data
+
+    def apply_table(self, table: np.ndarray) -> Self:
+        """Map every channel through 256-entry lookup table in place"""
+        np.take(table, self.array, out=self.array)
+        return self
+
+    def apply_gamma(self, gamma: float = 2.2) -> Self:
+        return self.apply_table(gamma_table(gamma))
+
+    def apply_brightness(self, brightness: int) -> Self:
+        return self.apply_table(brightness_table(brightness))
@@ -1,33 +1,215 @@
+import asyncio
+import datetime
+import functools
+import logging
+from typing import AsyncIterable, AsyncIterator, Iterable, Optional, Sequence, TypeVar
+
+from pydantic import PrivateAttr
+
 from enums.commands import CommandID
+from enums.master_mode import MasterMode
+from enums.priority import Priority
+from exceptions.protocol_exceptions import QLPQueueFullError, QLPTimeoutError
 from models.color import Color
+from models.color_array import ColorArray
 from models.device_base import QLSCDeviceBase
+from models.packet import CONTROL_PACKET_OVERHEAD, MAX_DATAGRAM_SIZE
+from utils.frame_planner import MAX_LINE_IMAGE_PIXELS, apply_command, plan_approximation, plan_frame
+
+logger = logging.getLogger('Device')
+
+T = TypeVar('T')
+Frame = bytes | bytearray | memoryview | ColorArray | Sequence[Color]
+
+
+def frame_to_bytes(frame: Frame) -> bytes:
+    """Copy frame to raw RGB buffer, 3 bytes per pixel
+
+    The copy is kept by device to plan the next frame, so changing ColorArray in place after sending is safe
+    """
+    if isinstance(frame, ColorArray):
+        data = frame.array.tobytes()
+    elif isinstance(frame, (bytes, bytearray, memoryview)):
+        data = bytes(frame)
+    else:
+        data = b''.join(bytes(color) for color in frame)
+    if len(data) % 3:
+        raise ValueError('Frame buffer length must be multiple of 3')
+    return data
+
+
+async def iterate_async(items: Iterable[T] | AsyncIterable[T]) -> AsyncIterator[T]:
+    """Iterate over both kinds of frame sources the same way"""
+    if isinstance(items, AsyncIterable):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+
+async def iterate_paced(items: Iterable[T] | AsyncIterable[T], rate: float) -> AsyncIterator[T]:
+    """Yield items with fixed rate per second, late source is not caught up with by yielding faster"""
+    loop = asyncio.get_running_loop()
+    period = 1 / rate
+    next_tick = loop.time()
+    async for item in iterate_async(items):
+        delay = next_tick - loop.time()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        next_tick = max(next_tick + period, loop.time())
+        yield item
 
 
 class QLSCDevice(QLSCDeviceBase):
     """Device's business logic inherited from internal logic"""
+    # Last acknowledged strip state, None if unknown
+    _framebuffer: Optional[bytes] = PrivateAttr(default=None)
+
+    def _track_framebuffer(self, command_id: CommandID, data: bytes):
+        if self._framebuffer is None and command_id == CommandID.FILL and self.length:
+            self._framebuffer = bytes(self.length * 3)
+        if self._framebuffer is not None:
+            framebuffer = bytearray(self._framebuffer)
+            apply_command(framebuffer, command_id, data)
+            self._framebuffer = bytes(framebuffer)
+
+    def invalidate_framebuffer(self):
+        """Forget strip state, e.g. after unconfirmed group command, so next frame is sent in whole"""
+        self._framebuffer = None
 
     async def set_length(self, length: int):
         await self.send_command(CommandID.LENGTH, length.to_bytes(1, 'little', signed=False))
-        # self._length = length  # noqa # TODO: Или дождаться ответа а потом обновить?
+        self.length = length
+        # Device turns all pixels off on length change
+        self._framebuffer = bytes(length * 3)
 
     async def set_pixel_color(self, index: int, color: Color):
         # TODO: Test for that
         if not 0 <= index < self.length:
             raise IndexError()
-        await self.send_command(CommandID.SET_PIXEL, index.to_bytes(2, 'little', signed=False) + bytes(color))
+        data = index.to_bytes(2, 'little', signed=False) + bytes(color)
+        await self.send_command(CommandID.SET_PIXEL, data)
+        self._track_framebuffer(CommandID.SET_PIXEL, data)
 
     async def set_line_color(self, start: int, end: int, color: Color):
         if not 0 <= start < end < self.length:
             raise IndexError()
-        await self.send_command(
-            CommandID.SET_LINE,
-            start.to_bytes(2, 'little', signed=False)
-            + end.to_bytes(2, 'little', signed=False)
-            + bytes(color)
-        )
+        data = start.to_bytes(2, 'little', signed=False) + end.to_bytes(2, 'little', signed=False) + bytes(color)
+        await self.send_command(CommandID.SET_LINE, data)
+        self._track_framebuffer(CommandID.SET_LINE, data)
 
     async def fill(self, color: Color):
         await self.send_command(CommandID.FILL, bytes(color))
+        self._track_framebuffer(CommandID.FILL, bytes(color))
+
+    async def set_brightness(self, brightness: int):
+        await self.send_command(CommandID.SET_BRIGHTNESS, brightness.to_bytes(1, 'little', signed=False))
+
+    async def set_mode(self, mode: int):
+        await self.send_command(CommandID.SET_MODE, mode.to_bytes(2, 'little', signed=False))
+        # Device's effect is drawing the strip now
+        self._framebuffer = None
+
+    async def set_multicast_group(self, group_id: int):
+        """Make device listen to group packets, 0 disables multicast"""
+        await self.send_command(CommandID.MULTICAST_GROUP, group_id.to_bytes(1, 'little', signed=False))
+
+    async def set_master(self, mode: MasterMode):
+        """Make device send sync packets for synchronous effects of other devices"""
+        await self.send_command(CommandID.SET_MASTER, bytes(mode))
+
+    async def set_time(self, value: datetime.time):
+        await self.send_command(CommandID.SET_TIME, bytes((value.hour, value.minute, value.second)))
 
     async def reboot(self):
         await self.send_command(CommandID.REBOOT)
+        self._framebuffer = None
+
+    async def push_frame(self, frame: Frame):
+        """Set all pixels of the strip, splitting frame into datagram-sized SET_LINE_IMAGE chunks if needed"""
+        data = frame_to_bytes(frame)
+        pixels = len(data) // 3
+        if self.length and pixels != self.length:
+            raise IndexError()
+        self._framebuffer = None
+        if CONTROL_PACKET_OVERHEAD + len(data) <= MAX_DATAGRAM_SIZE:
+            await self.send_command(CommandID.SET_ALL_PIXELS, data, Priority.BULK)
+            self._framebuffer = data
+            return
+        await asyncio.gather(*(
+            self.send_command(
+                CommandID.SET_LINE_IMAGE,
+                start.to_bytes(2, 'little', signed=False)
+                + min(MAX_LINE_IMAGE_PIXELS, pixels - start).to_bytes(1, 'little', signed=False)
+                + data[start * 3:(start + MAX_LINE_IMAGE_PIXELS) * 3],
+                Priority.BULK,
+            )
+            for start in range(0, pixels, MAX_LINE_IMAGE_PIXELS)
+        ))
+        self._framebuffer = data
+
+    async def update_frame(self, frame: Frame, tolerance: int = 0):
+        """Bring strip to the frame with the cheapest set of commands based on difference with last acknowledged one
+
+        With tolerance every channel may differ from the frame by that much, so smooth frames are approximated
+        with a few gradients. Approximated state is remembered, so the error doesn't grow over frames
+        """
+        data = frame_to_bytes(frame)
+        if self.length and len(data) // 3 != self.length:
+            raise IndexError()
+        # Strip state is unknown until every command is acknowledged
+        previous, self._framebuffer = self._framebuffer, None
+        if tolerance:
+            # Approximation takes milliseconds, it is mostly spent in NumPy which lets event loop go on meanwhile
+            commands, data = await asyncio.get_running_loop().run_in_executor(
+                None, plan_approximation, previous, data, tolerance,
+            )
+        else:
+            commands = plan_frame(previous, data)
+        if commands and commands[0][0] == CommandID.FILL:
+            await self.send_command(*commands.pop(0), Priority.BULK)
+        await asyncio.gather(*(
+            self.send_command(command_id, command_data, Priority.BULK) for command_id, command_data in commands
+        ))
+        self._framebuffer = data
+
+    async def stream(
+            self,
+            frames: Iterable[Frame] | AsyncIterable[Frame],
+            fps: float = 30,
+            diff: bool = True,
+            tolerance: int = 0,
+    ) -> int:
+        """Push frames with fixed rate and return amount of dropped frames
+
+        Frame is dropped if it is due while device is still acknowledging the previous one,
+        so slow device is never fed with stale frames. Lost frames are logged and skipped.
+        With diff only changes from previous frame are sent within tolerance (see update_frame),
+        otherwise every frame is sent in whole.
+        """
+        push = functools.partial(self.update_frame, tolerance=tolerance) if diff else self.push_frame
+        pushing: asyncio.Task | None = None
+        dropped = 0
+
+        async for frame in iterate_paced(frames, fps):
+            if pushing is not None and not pushing.done():
+                dropped += 1
+                continue
+            self.__check_pushed(pushing)
+            pushing = asyncio.create_task(push(frame))
+        if pushing is not None:
+            await asyncio.wait([pushing])
+            self.__check_pushed(pushing)
+        return dropped
+
+    @staticmethod
+    def __check_pushed(pushing: asyncio.Task | None):
+        if pushing is None:
+            return
+        try:
+            pushing.result()
+        except QLPTimeoutError:
+            logger.warning('Frame was lost')
+        except QLPQueueFullError:
+            logger.warning('Frame was dropped, too many commands are waiting to be sent')
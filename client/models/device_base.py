@@ -2,7 +2,7 @@ from __future__ import annotations
 
 import logging
 from struct import pack
-from typing import TYPE_CHECKING
+from typing import TYPE_CHECKING, Optional
 
 from pydantic import Field, BaseModel
 
@@ -12,8 +12,12 @@ if TYPE_CHECKING:
 # pylint: disable=wrong-import-position
 
 from enums.commands import CommandID
+from enums.common_response_code import CommonResponseCode
+from enums.device_state import DeviceState
 from enums.packet_type import PacketType
-from models.packet import QLPPacket
+from enums.priority import Priority
+from exceptions.protocol_exceptions import QLPError, QLPResponseWithError
+from models.packet import QLP_PORT, QLPPacket
 
 logger = logging.getLogger('Device')
 
@@ -21,18 +25,31 @@ logger = logging.getLogger('Device')
 class QLSCDeviceBase(BaseModel):
     """QLSC Device base class, containing internal logic"""
     ip: str  # pylint: disable=invalid-name # TODO: type = ipaddress.IPv4Address
+    port: int = Field(default=QLP_PORT)
     device_chip_id: str
     device_uuid: str
     name: str
     engine: QLPEngine | None = Field(exclude=True, default=None)
     length: int = Field(default=0)
+    state: DeviceState = Field(default=DeviceState.ONLINE)
+    # Multicast group device listens to, 0 if none
+    multicast_group: int = Field(default=0)
+    # Incremented by registry on every change of device's ip, uuid, name or group
+    generation: int = Field(exclude=True, default=0)
 
     def __hash__(self):
         return hash(self.device_chip_id)
 
     def __eq__(self, other):
+        if not isinstance(other, QLSCDeviceBase):
+            return NotImplemented
         return self.device_chip_id == other.device_chip_id \
-            and self.device_uuid == other.device_chip_id
+            and self.device_uuid == other.device_uuid
+
+    @property
+    def device_address(self) -> bytes:
+        """Device id used in CONTROL packets"""
+        return pack('<L', int(self.device_chip_id, 16))
 
     def set_engine(self, engine: QLPEngine):
         if self.engine:
@@ -40,9 +57,31 @@ class QLSCDeviceBase(BaseModel):
         logger.warning('USING METHOD FOR EMULATING DEVICES')
         self.engine = engine
 
-    async def send_command(self, command_id: CommandID, data: bytes = b''):
+    async def send_command(
+            self, command_id: CommandID, data: bytes = b'', priority: Optional[Priority] = None,
+    ) -> QLPPacket:
+        """Send command to device and wait for its COMMON_RESPONSE
+
+        Priority class is derived from command if not given.
+        Raises QLPResponseWithError if device responded with error, QLPTimeoutError if it didn't respond
+        and QLPQueueFullError if too many commands of the class are waiting to be sent
+        """
         assert self.engine is not None
-        dev_id = pack('<L', int(self.device_chip_id, 16))
-        packet = QLPPacket(dev_id + command_id + data, PacketType.CONTROL, device_id=self.device_uuid)
-        await self.engine._send_packet(packet)  # noqa # pylint: disable=protected-access
-        # TODO: self.engine.wait_response???
+        packet = QLPPacket(
+            self.device_address + command_id + data,
+            PacketType.CONTROL,
+            device_id=self.device_uuid,
+            destination=(self.ip, self.port),
+        )
+        response = await self.engine._send_packet(packet, priority)  # noqa # pylint: disable=protected-access
+        assert response is not None
+        try:
+            code = CommonResponseCode(response.payload[0])
+        except (IndexError, ValueError) as exc:
+            raise QLPError(f'Invalid common response: {bytes(response.payload).hex(" ").upper()}') from exc
+        if code != CommonResponseCode.OK:
+            error_text = None
+            if code == CommonResponseCode.OTHER_ERROR:
+                error_text = bytes(response.payload[1:]).decode(errors='replace')
+            raise QLPResponseWithError(self, packet, code, error_text)
+        return response
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+import logging
+from typing import TYPE_CHECKING
+
+from enums.commands import CommandID
+from enums.packet_type import PacketType
+from models.color import Color
+from models.device import Frame, frame_to_bytes
+from models.packet import MAX_DATAGRAM_SIZE, QLPPacket
+from utils.frame_planner import MAX_LINE_IMAGE_PIXELS
+
+if TYPE_CHECKING:
+    from engine import QLPEngine
+    from models.device import QLSCDevice
+
+logger = logging.getLogger('Group')
+
+# Group ids addressing every device, others are multicast groups
+ALL_DEVICES_GROUP = 0x00
+BROADCAST_GROUPS = (0x00, 0xFF)
+# Header, version, type, group id, command id and crc of BROADCAST packet
+BROADCAST_PACKET_OVERHEAD = 8
+
+
+class QLSCGroup:
+    """Multicast group of devices controlled with single BROADCAST packets
+
+    Devices don't respond to group packets, so delivery is not confirmed
+    """
+
+    def __init__(self, engine: QLPEngine, group_id: int) -> None:
+        if not 0 <= group_id < 256:
+            raise ValueError('Group id must be between 0 and 255')
+        self.engine = engine
+        self.group_id = group_id
+
+    def __repr__(self) -> str:
+        return f'<{self.__class__.__name__} {self.group_id}>'
+
+    @property
+    def members(self) -> set[QLSCDevice]:
+        if self.group_id in BROADCAST_GROUPS:
+            return set(self.engine.devices)
+        return self.engine.devices.group_members(self.group_id)
+
+    async def send_command(self, command_id: CommandID, data: bytes = b''):
+        packet = QLPPacket(self.group_id.to_bytes(1, 'big') + command_id + data, PacketType.BROADCAST)
+        await self.engine._send_packet(packet)  # noqa # pylint: disable=protected-access
+        # Strip state of members is not confirmed anymore
+        for device in self.members:
+            device.invalidate_framebuffer()
+
+    async def fill(self, color: Color):
+        await self.send_command(CommandID.FILL, bytes(color))
+
+    async def set_brightness(self, brightness: int):
+        await self.send_command(CommandID.SET_BRIGHTNESS, brightness.to_bytes(1, 'little', signed=False))
+
+    async def set_mode(self, mode: int):
+        await self.send_command(CommandID.SET_MODE, mode.to_bytes(2, 'little', signed=False))
+
+    async def push_frame(self, frame: Frame):
+        """Set all pixels of every member, splitting frame into SET_LINE_IMAGE chunks if it doesn't fit datagram"""
+        data = frame_to_bytes(frame)
+        if BROADCAST_PACKET_OVERHEAD + len(data) <= MAX_DATAGRAM_SIZE:
+            await self.send_command(CommandID.SET_ALL_PIXELS, data)
+            return
+        pixels = len(data) // 3
+        for start in range(0, pixels, MAX_LINE_IMAGE_PIXELS):
+            await self.send_command(
+                CommandID.SET_LINE_IMAGE,
+                start.to_bytes(2, 'little', signed=False)
+                + min(MAX_LINE_IMAGE_PIXELS, pixels - start).to_bytes(1, 'little', signed=False)
+                + data[start * 3:(start + MAX_LINE_IMAGE_PIXELS) * 3]
+            )
@@ -1,12 +1,20 @@
 import logging
 from dataclasses import dataclass, field
-from typing import NewType, Optional, ClassVar
+from functools import lru_cache
+from typing import Iterable, NewType, Optional, Sequence
 
-# from enums.commands import CommandID
+from enums.commands import CommandID
 from enums.packet_type import PacketType
-# from exceptions.protocol_exceptions import QLPError
+from exceptions.protocol_exceptions import QLPError
 
 __PROTO_HEADER__ = b'QLP'
+QLP_PORT = 52075
+# Biggest UDP payload which fits into one Ethernet frame without fragmentation
+MAX_DATAGRAM_SIZE = 1472
+# Header, version, type, counter, device id, command id and crc of CONTROL packet
+CONTROL_PACKET_OVERHEAD = 11
+CRC_INITIAL = 0x75
+_BYTES = [bytes([value]) for value in range(256)]
 ProtoVer = NewType('ProtoVer', int)
 
 logger = logging.getLogger('Packet')
@@ -15,57 +23,157 @@ logger = logging.getLogger('Packet')
 @dataclass
 class QLPPacket:
     """Wrapper for raw bytes packet allowing to write or read serialized data from it and also checking crc"""
-    data: bytes
+    # Parsed packets keep a view of received datagram instead of a copy
+    data: bytes | memoryview
     packet_type: PacketType
     proto_version: ProtoVer = field(default=ProtoVer(1), repr=False)
-    source: Optional[str] = None
-    packet_counter: ClassVar[int] = 0
+    # Address and port of sender of received packet
+    source_address: Optional[tuple[str, int]] = None
+    # Address and port of receiver. Packet is broadcasted if it's not set
+    destination: Optional[tuple[str, int]] = field(default=None, repr=False)
+    # Per-device 8-bit command counter, assigned by engine when CONTROL packet is sent
     packet_id: Optional[int] = field(default=None, repr=False)
 
     device_id: Optional[str] = None
     # broadcast_group: Optional[int] = None
 
-    def __post_init__(self):
-        self.packet_id = self.packet_id or self.__class__.packet_counter
-        self.__class__.packet_counter += 1
-        # TODO: check command here
+    @property
+    def source(self) -> Optional[str]:
+        return self.source_address[0] if self.source_address is not None else None
+
+    @property
+    def source_port(self) -> Optional[int]:
+        return self.source_address[1] if self.source_address is not None else None
+
+    @property
+    def group_id(self) -> int:
+        """Multicast group which BROADCAST packet is addressed to"""
+        if self.packet_type != PacketType.BROADCAST:
+            raise QLPError(f'{self.packet_type.name} packet has no group id')
+        return self.data[0]
+
+    @property
+    def device_address(self) -> bytes:
+        """Raw device id (ESP chip id) which CONTROL packet is addressed to or was sent from"""
+        if self.packet_type != PacketType.CONTROL:
+            raise QLPError(f'{self.packet_type.name} packet has no device id')
+        return bytes(self.data[:4])
+
+    @property
+    def command_id(self) -> CommandID:
+        if self.packet_type == PacketType.BROADCAST:
+            return CommandID(self.data[1])
+        if self.packet_type != PacketType.CONTROL:
+            raise QLPError(f'{self.packet_type.name} packet has no command id')
+        return CommandID(self.data[4])
+
+    @property
+    def payload(self) -> bytes | memoryview:
+        """Command data following device id (or group id) and command id"""
+        if self.packet_type == PacketType.BROADCAST:
+            return self.data[2:]
+        if self.packet_type != PacketType.CONTROL:
+            raise QLPError(f'{self.packet_type.name} packet has no command payload')
+        return self.data[5:]
+
+    @property
+    def _header(self) -> bytes:
+        if self.packet_type == PacketType.CONTROL:
+            if self.packet_id is None:
+                raise QLPError('Control packet has no command counter')
+            # Command counter, device sends it back in response (see protocol.md)
+            return _header(self.proto_version, self.packet_type) + self.packet_id.to_bytes(1, 'big')
+        return _header(self.proto_version, self.packet_type)
 
-    # TODO:
-    # @property
-    # def command_id(self):
-    #     if self.packet_type in (PacketType.CONTROL, PacketType.BROADCAST):
-    #         return CommandID(self.data[...])
-    #     raise QLPError()
+    @property
+    def size(self) -> int:
+        """Length of serialized packet including crc"""
+        return len(self._header) + len(self.data) + 1
 
     @property
     def crc(self) -> int:
-        crc = 0x75
-        for byte in self.serialize(with_crc=False):
-            crc ^= byte
-        return crc
+        return xor_checksum(self.data, xor_checksum(self._header, CRC_INITIAL))
 
     def serialize(self, *, with_crc: bool = True) -> bytes:
-        return (
-            __PROTO_HEADER__
-            + self.proto_version.to_bytes(1, 'big')
-            + self.packet_type.value.to_bytes(1, 'big')
-            # TODO: NOT IMPLEMENTED ON FIRMWARE YET:
-            #  + (self.packet_counter.to_bytes(1, 'big') if self.packet_type == PacketType.CONTROL else b'')
-            #  + b''  # TODO: Receiver???
-            + self.data
-            + (self.crc.to_bytes(1, 'big') if with_crc else b'')
-        )
+        header = self._header
+        if not with_crc:
+            return b''.join((header, self.data))
+        crc = xor_checksum(self.data, xor_checksum(header, CRC_INITIAL))
+        return b''.join((header, self.data, _BYTES[crc]))
+
+    def encode_into(self, buffer: bytearray | memoryview, offset: int = 0) -> int:
+        """Write serialized packet into buffer starting from offset, returns amount of written bytes"""
+        header = self._header
+        end = offset + len(header)
+        buffer[offset:end] = header
+        buffer[end:end + len(self.data)] = self.data
+        end += len(self.data)
+        buffer[end] = xor_checksum(self.data, xor_checksum(header, CRC_INITIAL))
+        return end + 1 - offset
+
+    @staticmethod
+    def encode_many(packets: Sequence['QLPPacket']) -> list[memoryview]:
+        """Serialize packets into one preallocated buffer, returns view of every packet in it"""
+        sizes = [packet.size for packet in packets]
+        buffer = memoryview(bytearray(sum(sizes)))
+        views = []
+        offset = 0
+        for packet, size in zip(packets, sizes):
+            packet.encode_into(buffer, offset)
+            views.append(buffer[offset:offset + size])
+            offset += size
+        return views
 
     @classmethod
-    def parse(cls, data: bytes, source: Optional[str] = None):
-        if data[:3] != __PROTO_HEADER__:
+    def parse(
+            cls,
+            data: bytes | bytearray | memoryview,
+            source: Optional[str] = None,
+            source_port: int = QLP_PORT,
+    ) -> 'QLPPacket':
+        """Parse datagram, packet's data is a view of it, so datagram must not be changed after"""
+        view = memoryview(data)
+        if len(view) < 6 or view[:3] != __PROTO_HEADER__:
             raise ValueError('No header', data)
-        proto_version = ProtoVer(int(data[3]))
-        packet_type = PacketType(int(data[4]))
-        packet_id = int(data[5]) if packet_type == PacketType.CONTROL else None
-        content = data[5:-1] if packet_type != PacketType.CONTROL else data[6:-1]
-        crc = data[-1]
-        packet = QLPPacket(content, packet_type, proto_version, source, packet_id=packet_id)
-        if packet.crc != crc:
+        packet_type = PacketType(view[4])
+        if packet_type == PacketType.CONTROL:
+            # Counter, device id and command id
+            if len(view) < 12:
+                raise ValueError('Too short control packet', data)
+            packet_id: Optional[int] = view[5]
+            content = view[6:-1]
+        else:
+            packet_id = None
+            content = view[5:-1]
+        if xor_checksum(view[:-1], CRC_INITIAL) != view[-1]:
             raise ValueError('Crc mismatch', data)
-        return packet
+        return cls(
+            content,
+            packet_type,
+            ProtoVer(view[3]),
+            source_address=(source, source_port) if source is not None else None,
+            packet_id=packet_id,
+        )
+
+    @classmethod
+    def decode_many(cls, datagrams: Iterable[bytes | bytearray | memoryview], source: Optional[str] = None) \
+            -> list['QLPPacket']:
+        return [cls.parse(datagram, source) for datagram in datagrams]
+
+
+def xor_checksum(data: bytes | bytearray | memoryview, crc: int = 0) -> int:
+    """XOR of all bytes of data and crc, folding data as one big integer instead of looping over bytes"""
+    size = len(data)
+    if size == 0:
+        return crc
+    value = int.from_bytes(data, 'little')
+    while size > 1:
+        half = (size + 1) // 2
+        value = (value >> (half * 8)) ^ (value & ((1 << (half * 8)) - 1))
+        size = half
+    return crc ^ value
+
+
+@lru_cache(maxsize=None)
+def _header(proto_version: int, packet_type: PacketType) -> bytes:
+    return __PROTO_HEADER__ + bytes((proto_version, packet_type.value))
@@ -0,0 +1,225 @@
+import asyncio
+import datetime
+import logging
+import math
+import time
+from collections import deque
+from dataclasses import dataclass
+from typing import AsyncIterable, Iterable, Mapping, Optional
+
+from enums.commands import CommandID
+from enums.master_mode import MasterMode
+from enums.priority import Priority
+from exceptions.protocol_exceptions import QLPQueueFullError, QLPTimeoutError
+from models.device import Frame, QLSCDevice, iterate_paced
+
+logger = logging.getLogger('Playback')
+
+SyncFrame = Mapping[QLSCDevice, Frame]
+
+
+class ClockEstimate:
+    """Offset of device's clock from ours, estimated from request/response timestamps
+
+    Devices don't report their time, so the offset is the time from sending a command to its execution,
+    half of round-trip time for symmetric path. Like NTP clock filter does, the sample with the smallest
+    round trip of the last ones is trusted, the others were delayed by queues
+    """
+    SAMPLES = 8
+
+    def __init__(self) -> None:
+        self.__round_trips: deque[float] = deque(maxlen=self.SAMPLES)
+
+    def add(self, sent: float, received: float) -> None:
+        self.__round_trips.append(received - sent)
+
+    @property
+    def offset(self) -> Optional[float]:
+        return min(self.__round_trips) / 2 if self.__round_trips else None
+
+    @property
+    def jitter(self) -> float:
+        """Mean one-way queueing delay over the trusted sample"""
+        if not self.__round_trips:
+            return 0.0
+        return (sum(self.__round_trips) / len(self.__round_trips) - min(self.__round_trips)) / 2
+
+
+@dataclass
+class SkewStats:
+    """Difference between estimated execution time of frames and their deadline, seconds"""
+    count: int = 0
+    total: float = 0.0
+    # The largest absolute skew
+    worst: float = 0.0
+    last: float = 0.0
+    # Frames skipped because the previous one was not acknowledged yet or queue was full
+    dropped: int = 0
+    # Frames without response
+    lost: int = 0
+
+    def add(self, skew: float) -> None:
+        self.count += 1
+        self.total += skew
+        self.worst = max(self.worst, abs(skew))
+        self.last = skew
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class QLSCSyncPlayback:  # pylint: disable=too-many-instance-attributes
+    """Frames of many devices shown at the same time
+
+    Every frame gets a deadline, part of every device is sent at the deadline minus device's clock offset,
+    so devices with different latencies execute it together. The deadline is kept on our side, as protocol
+    has no place for it in packets. Offsets are measured before playback and then every calibration_interval
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self,
+            devices: Iterable[QLSCDevice],
+            fps: float = 60,
+            diff: bool = True,
+            margin: float = 0.005,
+            calibration_interval: float = 5,
+    ) -> None:
+        self.devices = list(devices)
+        self.fps = fps
+        self.diff = diff
+        self.margin = margin
+        self.calibration_interval = calibration_interval
+        self.clocks = {device.device_chip_id: ClockEstimate() for device in self.devices}
+        self.skew = {device.device_chip_id: SkewStats() for device in self.devices}
+        # Difference between the first and the last device executing the same frame
+        self.spread = SkewStats()
+        self.__presenting: dict[str, asyncio.Task] = {}
+
+    def __offset(self, device: QLSCDevice) -> float:
+        return self.clocks[device.device_chip_id].offset or 0.0
+
+    @property
+    def lead(self) -> float:
+        """Time between frame is due and its deadline, enough for the slowest device"""
+        return max(
+            (clock.offset + clock.jitter for clock in self.clocks.values() if clock.offset is not None), default=0.0,
+        ) + self.margin
+
+    async def calibrate(self, samples: int = 4) -> dict[str, float]:
+        """Measure clock offsets with SYNC_PACKET exchanges, returns offsets by chip id"""
+        loop = asyncio.get_running_loop()
+
+        async def probe(device: QLSCDevice) -> None:
+            for _ in range(samples):
+                sent = loop.time()
+                try:
+                    await device.send_command(CommandID.SYNC_PACKET, priority=Priority.CONTROL)
+                except QLPTimeoutError:
+                    continue
+                self.clocks[device.device_chip_id].add(sent, loop.time())
+
+        await asyncio.gather(*(probe(device) for device in self.devices))
+        return {chip_id: clock.offset for chip_id, clock in self.clocks.items() if clock.offset is not None}
+
+    async def sync_clocks(self) -> None:
+        """Set time of devices, so that every one of them receives it at the start of the same second"""
+        loop = asyncio.get_running_loop()
+        now = time.time()
+        second = math.ceil(now + self.lead)
+        started = loop.time() + second - now
+        value = datetime.datetime.fromtimestamp(second).time()
+
+        async def set_time(device: QLSCDevice) -> None:
+            await asyncio.sleep(max(started - self.__offset(device) - loop.time(), 0))
+            await device.set_time(value)
+
+        await asyncio.gather(*(set_time(device) for device in self.devices))
+
+    async def set_master(self, master: QLSCDevice, mode: MasterMode = MasterMode.COMMON) -> None:
+        """Make one device the source of sync packets for synchronous effects, the others stop sending them"""
+        await asyncio.gather(*(
+            device.set_master(mode if device == master else MasterMode.OFF) for device in self.devices
+        ))
+
+    async def __present(self, device: QLSCDevice, frame: Frame, deadline: float) -> Optional[float]:
+        """Send device's part of frame in time for deadline, returns estimated time of its execution"""
+        loop = asyncio.get_running_loop()
+        stats = self.skew[device.device_chip_id]
+        await asyncio.sleep(max(deadline - self.__offset(device) - loop.time(), 0))
+        sent = loop.time()
+        try:
+            await (device.update_frame(frame) if self.diff else device.push_frame(frame))
+        except QLPTimeoutError:
+            stats.lost += 1
+            logger.warning('Frame of device chip_id="%s" was lost', device.device_chip_id)
+            return None
+        except QLPQueueFullError:
+            stats.dropped += 1
+            return None
+        # Response took the same time as command did. Command can't be executed earlier than offset after sending,
+        # it is the case of unchanged frame which needs no commands
+        offset = self.__offset(device)
+        executed = max(loop.time() - offset, sent + offset)
+        stats.add(executed - deadline)
+        return executed
+
+    async def __present_frame(self, frame: SyncFrame, deadline: float) -> None:
+        parts = []
+        for device, part in frame.items():
+            busy = self.__presenting.get(device.device_chip_id)
+            if busy is not None and not busy.done():
+                self.skew[device.device_chip_id].dropped += 1
+                continue
+            task = self.__presenting[device.device_chip_id] = asyncio.create_task(
+                self.__present(device, part, deadline)
+            )
+            parts.append(task)
+        executed = [result for result in await asyncio.gather(*parts) if result is not None]
+        if len(executed) > 1:
+            self.spread.add(max(executed) - min(executed))
+
+    async def play(self, frames: Iterable[SyncFrame] | AsyncIterable[SyncFrame]) -> None:
+        """Show frames with fixed rate, every frame maps devices to their parts
+
+        Part is dropped if it is due while device is still acknowledging the previous one
+        """
+        loop = asyncio.get_running_loop()
+        if any(clock.offset is None for clock in self.clocks.values()):
+            await self.calibrate()
+        calibrated = loop.time()
+        calibrating: Optional[asyncio.Task] = None
+        presenting: set[asyncio.Task] = set()
+
+        try:
+            async for frame in iterate_paced(frames, self.fps):
+                if self.calibration_interval and loop.time() - calibrated >= self.calibration_interval:
+                    if calibrating is None or calibrating.done():
+                        # One more sample of every device, older ones are forgotten by ClockEstimate
+                        calibrating = asyncio.create_task(self.calibrate(samples=1))
+                        calibrated = loop.time()
+                for task in [task for task in presenting if task.done()]:
+                    presenting.discard(task)
+                    task.result()
+                presenting.add(asyncio.create_task(self.__present_frame(frame, loop.time() + self.lead)))
+            if presenting:
+                await asyncio.gather(*presenting)
+        finally:
+            for task in presenting | set(self.__presenting.values()):
+                task.cancel()
+            self.__presenting.clear()
+            if calibrating is not None:
+                calibrating.cancel()
+                await asyncio.gather(calibrating, return_exceptions=True)
+
+    def report(self) -> dict[str, dict[str, float]]:
+        """Skew statistics of every device and spread of frames, suitable for JSON"""
+        def summary(stats: SkewStats) -> dict[str, float]:
+            return {
+                'frames': stats.count, 'mean': stats.mean, 'worst': stats.worst, 'last': stats.last,
+                'dropped': stats.dropped, 'lost': stats.lost,
+            }
+
+        report = {chip_id: summary(stats) for chip_id, stats in self.skew.items()}
+        report['spread'] = summary(self.spread)
+        return report
@@ -0,0 +1,171 @@
+import json
+import logging
+import os
+from pathlib import Path
+from typing import Iterator, Optional
+
+from models.device import QLSCDevice
+from models.packet import QLP_PORT
+
+logger = logging.getLogger('Registry')
+
+
+class QLSCDeviceRegistry:
+    """Devices known by engine, indexed by uuid, chip id and ip with port
+
+    Chip id is the identity of device. Every change of registry increments its generation,
+    every change of device's data increments generation of the device
+    """
+
+    # Runtime state which is not valid after restart
+    __NOT_PERSISTED = {'state'}
+
+    def __init__(self) -> None:
+        self._by_chip_id: dict[str, QLSCDevice] = {}
+        self._by_uuid: dict[str, QLSCDevice] = {}
+        self._by_ip: dict[tuple[str, int], QLSCDevice] = {}
+        self._by_group: dict[int, set[QLSCDevice]] = {}
+        self.generation = 0
+
+    def __len__(self) -> int:
+        return len(self._by_chip_id)
+
+    def __iter__(self) -> Iterator[QLSCDevice]:
+        return iter(list(self._by_chip_id.values()))
+
+    def __contains__(self, device: object) -> bool:
+        return isinstance(device, QLSCDevice) and self._by_chip_id.get(device.device_chip_id) is device
+
+    def by_chip_id(self, device_chip_id: str) -> Optional[QLSCDevice]:
+        return self._by_chip_id.get(device_chip_id)
+
+    def by_uuid(self, device_uuid: str) -> Optional[QLSCDevice]:
+        return self._by_uuid.get(device_uuid)
+
+    def by_ip(self, ip: str, port: int = QLP_PORT) -> Optional[QLSCDevice]:  # pylint: disable=invalid-name
+        return self._by_ip.get((ip, port))
+
+    def group_members(self, group_id: int) -> set[QLSCDevice]:
+        return set(self._by_group.get(group_id, ()))
+
+    def set_group(self, device: QLSCDevice, group_id: int) -> None:
+        """Remember multicast group of device, 0 removes it from any group"""
+        if device.multicast_group == group_id:
+            return
+        self.__ungroup(device)
+        device.multicast_group = group_id
+        if group_id:
+            self._by_group.setdefault(group_id, set()).add(device)
+        device.generation += 1
+        self.generation += 1
+
+    def add(self, device: QLSCDevice) -> QLSCDevice:
+        """Add device or update the known one with the same chip id, returns device stored in registry"""
+        known = self._by_chip_id.get(device.device_chip_id)
+        if known is None:
+            return self.__insert(device)
+        return self.__update(known, (device.ip, device.port), device.device_uuid, device.name)
+
+    def upsert(self, address: tuple[str, int], device_chip_id: str, device_uuid: str, name: str) -> QLSCDevice:
+        """Add new device or update data of known one, returns device stored in registry"""
+        device = self._by_chip_id.get(device_chip_id)
+        if device is None:
+            return self.__insert(QLSCDevice(
+                ip=address[0],
+                port=address[1],
+                device_chip_id=device_chip_id,
+                device_uuid=device_uuid,
+                name=name,
+            ))
+        return self.__update(device, address, device_uuid, name)
+
+    def __insert(self, device: QLSCDevice) -> QLSCDevice:
+        self._by_chip_id[device.device_chip_id] = device
+        self.__index(self._by_uuid, device.device_uuid, device)
+        self.__index(self._by_ip, (device.ip, device.port), device)
+        if device.multicast_group:
+            self._by_group.setdefault(device.multicast_group, set()).add(device)
+        self.generation += 1
+        logger.info('New device chip_id="%s" at %s', device.device_chip_id, device.ip)
+        return device
+
+    def __update(self, device: QLSCDevice, address: tuple[str, int], device_uuid: str, name: str) -> QLSCDevice:
+        if ((device.ip, device.port), device.device_uuid, device.name) == (address, device_uuid, name):
+            return device
+        if (device.ip, device.port) != address:
+            logger.info(
+                'Device chip_id="%s" changed address %s:%s -> %s:%s',
+                device.device_chip_id, device.ip, device.port, *address,
+            )
+            self.__unindex(self._by_ip, (device.ip, device.port), device)
+            device.ip, device.port = address
+            self.__index(self._by_ip, address, device)
+        if device.device_uuid != device_uuid:
+            self.__unindex(self._by_uuid, device.device_uuid, device)
+            device.device_uuid = device_uuid
+            self.__index(self._by_uuid, device_uuid, device)
+        device.name = name
+        device.generation += 1
+        self.generation += 1
+        return device
+
+    def save(self, path: str | Path) -> None:
+        """Write known devices to JSON file, replacing it atomically"""
+        path = Path(path)
+        devices = [device.dict(exclude=self.__NOT_PERSISTED) for device in self]
+        temporary = path.with_name(path.name + '.tmp')
+        temporary.write_text(json.dumps(devices, indent=2), encoding='utf-8')
+        os.replace(temporary, path)
+        logger.debug('%s devices were saved to %s', len(devices), path)
+
+    def load(self, path: str | Path) -> list[QLSCDevice]:
+        """Add devices saved by save(), returns devices stored in registry. Missing file means no devices
+
+        Already known devices get address, uuid, name and multicast group from the file
+        """
+        try:
+            devices = [QLSCDevice.parse_obj(device) for device in json.loads(Path(path).read_text(encoding='utf-8'))]
+        except FileNotFoundError:
+            return []
+        except (ValueError, TypeError):
+            logger.warning('Device cache %s is corrupted and was ignored', path)
+            return []
+        loaded = [self.__restore(device) for device in devices]
+        logger.debug('%s devices were loaded from %s', len(loaded), path)
+        return loaded
+
+    def __restore(self, saved: QLSCDevice) -> QLSCDevice:
+        device = self.add(saved)
+        if device is not saved:
+            # Group is kept by device itself, so the saved one is what device was left with
+            self.set_group(device, saved.multicast_group)
+        return device
+
+    def remove(self, device: QLSCDevice) -> None:
+        if self._by_chip_id.get(device.device_chip_id) is not device:
+            raise KeyError(device.device_chip_id)
+        del self._by_chip_id[device.device_chip_id]
+        self.__unindex(self._by_uuid, device.device_uuid, device)
+        self.__unindex(self._by_ip, (device.ip, device.port), device)
+        self.__ungroup(device)
+        self.generation += 1
+
+    def __ungroup(self, device: QLSCDevice) -> None:
+        members = self._by_group.get(device.multicast_group)
+        if members is not None:
+            members.discard(device)
+            if not members:
+                del self._by_group[device.multicast_group]
+
+    @staticmethod
+    def __index(index: dict, key: str | tuple[str, int], device: QLSCDevice) -> None:
+        previous = index.get(key)
+        if previous is not None and previous is not device:
+            # Key moved to another device (e.g. ip was reassigned by DHCP)
+            logger.info('Device chip_id="%s" lost %s', previous.device_chip_id, key)
+        index[key] = device
+
+    @staticmethod
+    def __unindex(index: dict, key: str | tuple[str, int], device: QLSCDevice) -> None:
+        if index.get(key) is device:
+            del index[key]
@@ -0,0 +1,66 @@
+from typing import Iterable, Iterator, Optional
+
+import numpy as np
+
+from models.color_array import gamma_table
+from models.device import QLSCDevice
+from utils.effects import Effect
+
+
+class QLSCRenderer:
+    """Host-side effects of many strips rendered into one (strips, pixels, 3) canvas per tick
+
+    Every effect is evaluated once for all strips assigned to it, so a tick costs a few array
+    operations instead of per-pixel Color objects. Rendered frames are raw RGB bytes ready for
+    push_frame, QLSCSyncPlayback or sharded engine's push_frames
+    """
+
+    def __init__(self, devices: Iterable[QLSCDevice], gamma: Optional[float] = None) -> None:
+        self.devices = list(devices)
+        for device in self.devices:
+            if not device.length:
+                raise ValueError(f'Length of device chip_id="{device.device_chip_id}" is unknown')
+        self.__rows = {device.device_chip_id: row for row, device in enumerate(self.devices)}
+        self.lengths = np.array([device.length for device in self.devices], dtype=np.float64).reshape(-1, 1)
+        pixels = max((device.length for device in self.devices), default=0)
+        self.positions = np.arange(pixels, dtype=np.float64).reshape(1, -1)
+        self.canvas = np.zeros((len(self.devices), pixels, 3), dtype=np.uint8)
+        self.gamma = gamma
+        self.__effects: dict[int, tuple[Effect, np.ndarray]] = {}
+
+    def assign(self, effect: Effect, devices: Iterable[QLSCDevice]) -> None:
+        """Render effect on devices from now on, per-strip parameters of effect follow order of devices"""
+        rows = np.array([self.__rows[device.device_chip_id] for device in devices], dtype=np.intp)
+        replaced = []
+        for key, (other, other_rows) in self.__effects.items():
+            overlap = np.isin(other_rows, rows)
+            if overlap.all():
+                replaced.append(key)
+            elif overlap.any():
+                raise ValueError(f'Effect {other!r} can not be partly replaced, assign its devices again')
+        for key in replaced:
+            del self.__effects[key]
+        self.__effects[id(effect)] = (effect, rows)
+
+    def render(self, time: float) -> np.ndarray:
+        """Render all effects at time in seconds into canvas and return it"""
+        for effect, rows in self.__effects.values():
+            colors = effect.render(time, self.positions, self.lengths[rows])
+            if colors.dtype != np.uint8:
+                colors = np.rint(np.clip(colors, 0, 255)).astype(np.uint8)
+            self.canvas[rows] = colors
+        if self.gamma is not None:
+            np.take(gamma_table(self.gamma), self.canvas, out=self.canvas)
+        return self.canvas
+
+    def frames(self, time: float) -> dict[QLSCDevice, bytes]:
+        """Render tick and slice canvas into frame of every device"""
+        canvas = self.render(time)
+        return {device: canvas[row, :device.length].tobytes() for row, device in enumerate(self.devices)}
+
+    def ticks(self, fps: float, start: float = 0.0) -> Iterator[dict[QLSCDevice, bytes]]:
+        """Endless frames for fixed rate consumer, e.g. QLSCSyncPlayback.play, effect time follows frame index"""
+        index = 0
+        while True:
+            yield self.frames(start + index / fps)
+            index += 1
@@ -0,0 +1,54 @@
+from collections import deque
+from typing import Optional
+
+from enums.priority import Priority
+from models.channel import QLPDeviceChannel, QueuedCommand
+
+
+class QLPScheduler:
+    """Order of sending queued commands of all devices
+
+    Device waits in line of the highest priority class it has queued commands of, the higher line always goes
+    first. Device's own commands are still sent in order, so commands queued before a higher class one
+    are sent with its priority. Devices within a class take turns one command at a time, so a device with
+    a long queue can not delay the others. Total amount of commands waiting for response is limited
+    by max_in_flight, per-device amount by the device's window
+    """
+
+    def __init__(self, max_in_flight: int) -> None:
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.__ready: dict[Priority, deque[QLPDeviceChannel]] = {priority: deque() for priority in Priority}
+
+    def schedule(self, channel: QLPDeviceChannel) -> None:
+        """Put channel in line of the highest class it has queued commands of"""
+        priority = channel.priority
+        if priority is not None and priority not in channel.scheduled:
+            channel.scheduled.add(priority)
+            self.__ready[priority].append(channel)
+
+    def next(self) -> Optional[tuple[QLPDeviceChannel, QueuedCommand]]:
+        """Take the next command to send, None if nothing can be sent now"""
+        if self.in_flight >= self.max_in_flight:
+            return None
+        for priority, ready in self.__ready.items():
+            while ready:
+                channel = ready.popleft()
+                channel.scheduled.discard(priority)
+                if channel.priority != priority:
+                    # Commands of the class were sent already, channel moves to line of its current priority
+                    self.schedule(channel)
+                    continue
+                # Channel without room is put in line again by release()
+                queued = channel.dequeue() if channel.has_room() else None
+                if queued is None:
+                    continue
+                self.schedule(channel)
+                self.in_flight += 1
+                return channel, queued
+        return None
+
+    def release(self, channel: QLPDeviceChannel) -> None:
+        """Account finished command of channel"""
+        self.in_flight -= 1
+        self.schedule(channel)
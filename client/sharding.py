@@ -0,0 +1,295 @@
+"""Engine spread over worker processes for fleets which one core can not drive
+
+Every worker runs its own QLPEngine with own event loop and sockets bound with SO_REUSEPORT.
+Devices are partitioned by chip id (see engine.shard_of), the coordinator routes commands
+to the worker which controls the device and gathers discovery results of all workers.
+"""
+import asyncio
+import functools
+import itertools
+import logging
+import multiprocessing
+import os
+import pickle
+from multiprocessing.connection import Connection
+from typing import Any, Callable, Coroutine, Iterable, Mapping, Optional, Set
+
+from engine import QLPEngine, shard_of
+from enums.packet_type import PacketType
+from enums.priority import Priority
+from exceptions.protocol_exceptions import QLPError
+from models.device import Frame, QLSCDevice, frame_to_bytes
+from models.packet import QLPPacket
+from models.registry import QLSCDeviceRegistry
+
+logger = logging.getLogger('Sharding')
+
+
+async def _discover(engine: QLPEngine, timeout: float, addresses: list[tuple[str, int]]) -> list[dict]:
+    # Devices of other shards are reported too, coordinator hands them over to their shards
+    return [device.dict(exclude={'state'}) async for device in engine.discover(timeout=timeout, addresses=addresses)]
+
+
+async def _adopt(engine: QLPEngine, devices: list[dict]) -> None:
+    for fields in devices:
+        device = engine.devices.add(QLSCDevice.parse_obj(fields))
+        if device.engine is None:
+            device.engine = engine
+
+
+async def _send(  # pylint: disable=too-many-arguments
+        engine: QLPEngine,
+        data: bytes,
+        packet_type: PacketType,
+        destination: Optional[tuple[str, int]],
+        device_id: Optional[str],
+        priority: Optional[Priority],
+) -> Optional[tuple[bytes, Optional[int]]]:
+    response = await engine._send_packet(  # pylint: disable=protected-access
+        QLPPacket(data, packet_type, destination=destination, device_id=device_id), priority,
+    )
+    return None if response is None else (bytes(response.data), response.packet_id)
+
+
+async def _push_frames(engine: QLPEngine, frames: dict[str, bytes]) -> dict[str, QLPError]:
+    async def push(device_chip_id: str, frame: bytes) -> None:
+        device = engine.devices.by_chip_id(device_chip_id)
+        if device is None:
+            raise QLPError(f'Device chip_id="{device_chip_id}" is unknown to shard')
+        await device.push_frame(frame)
+
+    results = await asyncio.gather(*(push(chip_id, frame) for chip_id, frame in frames.items()), return_exceptions=True)
+    # Exceptions holding device can not be pickled, so only the message is sent back
+    return {
+        chip_id: result if type(result) is QLPError else QLPError(str(result))  # pylint: disable=unidiomatic-typecheck
+        for chip_id, result in zip(frames, results)
+        if isinstance(result, BaseException)
+    }
+
+
+_HANDLERS: dict[str, Callable[..., Coroutine[Any, Any, Any]]] = {
+    'discover': _discover,
+    'adopt': _adopt,
+    'send': _send,
+    'push_frames': _push_frames,
+}
+
+
+def _reply(connection: Connection, request_id: int, task: asyncio.Task) -> None:
+    """Send result or exception of finished request, coordinator waits for a reply to every request"""
+    error = task.exception()
+    try:
+        connection.send((request_id, error, None if error else task.result()))
+    except (pickle.PicklingError, TypeError, AttributeError) as exc:
+        # Nothing is written if pickling fails, so the reply is sent again with the text only
+        text = f'{type(error).__name__}: {error}' if error else f'Result can not be sent from shard: {exc}'
+        connection.send((request_id, QLPError(text), None))
+
+
+async def _serve_shard(index: int, shards: int, connection: Connection) -> None:
+    engine = QLPEngine(shard=(index, shards))
+    await engine.start()
+    loop = asyncio.get_running_loop()
+    requests: asyncio.Queue[tuple[int, str, tuple]] = asyncio.Queue()
+    tasks: set[asyncio.Task] = set()
+
+    def reply(task: asyncio.Task, request_id: int) -> None:
+        tasks.discard(task)
+        if not task.cancelled():
+            _reply(connection, request_id, task)
+
+    def receive() -> None:
+        try:
+            requests.put_nowait(connection.recv())
+        except (EOFError, OSError):
+            # Coordinator is gone, nobody would read replies
+            loop.remove_reader(connection.fileno())
+            requests.put_nowait((0, 'stop', ()))
+
+    loop.add_reader(connection.fileno(), receive)
+    connection.send((0, None, os.getpid()))
+    try:
+        while True:
+            request_id, method, args = await requests.get()
+            if method == 'stop':
+                break
+            task = asyncio.create_task(_HANDLERS[method](engine, *args))
+            tasks.add(task)
+            task.add_done_callback(functools.partial(reply, request_id=request_id))
+    finally:
+        loop.remove_reader(connection.fileno())
+        for task in tasks:
+            task.cancel()
+        await engine.stop()
+        try:
+            connection.send((0, None, None))
+        except OSError:
+            pass
+
+
+def _run_shard(index: int, shards: int, connection: Connection) -> None:
+    asyncio.run(_serve_shard(index, shards, connection))
+
+
+class QLPShardedEngine:
+    """Coordinator of engine processes, each of them controls its part of devices
+
+    Discovered devices are bound to the coordinator, so they are controlled just like with QLPEngine
+    """
+    __STOP_TIMEOUT = 5
+
+    def __init__(self, shards: Optional[int] = None) -> None:
+        self.shards = shards or os.cpu_count() or 1
+        self._devices = QLSCDeviceRegistry()
+        self.__connections: list[Connection] = []
+        self.__processes: list[multiprocessing.process.BaseProcess] = []
+        # Futures of requests waiting for reply with index of shard which got the request
+        self.__pending: dict[int, tuple[int, asyncio.Future]] = {}
+        self.__request_ids = itertools.count(1)
+
+    @property
+    def devices(self) -> QLSCDeviceRegistry:
+        return self._devices
+
+    async def start(self) -> None:
+        if self.__processes:
+            raise QLPError('QLP Sharded Engine is already started')
+        loop = asyncio.get_running_loop()
+        context = multiprocessing.get_context('spawn')
+        started = []
+        for index in range(self.shards):
+            connection, worker_connection = context.Pipe()
+            process = context.Process(
+                target=_run_shard, args=(index, self.shards, worker_connection), name=f'QLP shard {index}', daemon=True,
+            )
+            process.start()
+            worker_connection.close()
+            self.__connections.append(connection)
+            self.__processes.append(process)
+            started.append(self.__expect(0, index))
+            loop.add_reader(connection.fileno(), self.__receive, connection)
+        await asyncio.gather(*started)
+        logger.info('Sharded engine was started with %s shards', self.shards)
+
+    async def stop(self) -> None:
+        """Stop every shard, the ones which do not stop in time are terminated. Waiting requests are failed"""
+        if not self.__processes:
+            raise QLPError('QLP Sharded Engine is already stopped')
+        loop = asyncio.get_running_loop()
+        stopped = []
+        for index, (connection, process) in enumerate(zip(self.__connections, self.__processes)):
+            if not process.is_alive():
+                continue
+            try:
+                connection.send((0, 'stop', ()))
+            except OSError:
+                continue
+            stopped.append(self.__expect(0, index))
+        try:
+            await asyncio.wait_for(asyncio.gather(*stopped, return_exceptions=True), self.__STOP_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning('Not every shard was stopped in %s seconds', self.__STOP_TIMEOUT)
+        finally:
+            for connection, process in zip(self.__connections, self.__processes):
+                loop.remove_reader(connection.fileno())
+                await loop.run_in_executor(None, process.join, self.__STOP_TIMEOUT)
+                if process.is_alive():
+                    process.terminate()
+                connection.close()
+            self.__fail(QLPError('QLP Sharded Engine was stopped'))
+            self.__connections.clear()
+            self.__processes.clear()
+        logger.info('Sharded engine was stopped')
+
+    def __expect(self, request_id: int, index: int) -> asyncio.Future:
+        # Start and stop of shard are acknowledged with zero request id, so they are keyed by -1 - index
+        future = asyncio.get_running_loop().create_future()
+        self.__pending[request_id or -1 - index] = (index, future)
+        return future
+
+    def __fail(self, error: QLPError, shard: Optional[int] = None) -> None:
+        """Fail requests waiting for reply of the shard, or of every shard"""
+        for key, (index, future) in list(self.__pending.items()):
+            if shard is None or index == shard:
+                del self.__pending[key]
+                if not future.done():
+                    future.set_exception(error)
+
+    def __receive(self, connection: Connection) -> None:
+        shard = self.__connections.index(connection)
+        try:
+            request_id, error, result = connection.recv()
+        except (EOFError, OSError):
+            asyncio.get_running_loop().remove_reader(connection.fileno())
+            self.__fail(QLPError(f'Shard {shard} has exited'), shard)
+            return
+        _, future = self.__pending.pop(request_id or -1 - shard, (shard, None))
+        if future is None or future.done():
+            return
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    async def __call(self, index: int, method: str, *args: Any) -> Any:
+        if not self.__processes:
+            raise QLPError('QLP Sharded Engine is not started')
+        if not self.__processes[index].is_alive():
+            raise QLPError(f'Shard {index} has exited')
+        request_id = next(self.__request_ids)
+        future = self.__expect(request_id, index)
+        try:
+            self.__connections[index].send((request_id, method, args))
+        except OSError as error:
+            self.__pending.pop(request_id, None)
+            raise QLPError(f'Shard {index} has exited') from error
+        return await future
+
+    def shard_of(self, device: QLSCDevice) -> int:
+        return shard_of(device.device_chip_id, self.shards)
+
+    async def _send_packet(self, packet: QLPPacket, priority: Optional[Priority] = None) -> Optional[QLPPacket]:
+        """Send packet through shard controlling its device, packets without device go through the first shard"""
+        index = int.from_bytes(packet.device_address, 'little') % self.shards if packet.device_id is not None else 0
+        response = await self.__call(
+            index, 'send', bytes(packet.data), packet.packet_type, packet.destination, packet.device_id, priority,
+        )
+        if response is None:
+            return None
+        data, packet_id = response
+        return QLPPacket(data, PacketType.CONTROL, packet_id=packet_id)
+
+    async def discover_all_devices(
+            self,
+            timeout: float = 1.5,
+            addresses: Iterable[tuple[str, int]] = (),
+    ) -> Set[QLSCDevice]:
+        """Search for devices, returns all known devices
+
+        Only the first shard sends discovery requests, found devices are handed over to shards which control them
+        """
+        found = await self.__call(0, 'discover', timeout, list(addresses))
+        batches: list[list[dict]] = [[] for _ in range(self.shards)]
+        for fields in found:
+            batches[shard_of(fields['device_chip_id'], self.shards)].append(fields)
+        await asyncio.gather(*(self.__call(index, 'adopt', batch) for index, batch in enumerate(batches) if batch))
+        for fields in found:
+            device = self._devices.add(QLSCDevice.parse_obj(fields))
+            if device.engine is None:
+                device.engine = self  # type: ignore[assignment]
+        return set(self._devices)
+
+    async def push_frames(self, frames: Mapping[QLSCDevice, Frame]) -> None:
+        """Push frames to many devices with one message per shard, it is the cheapest way to stream a fleet
+
+        Every device is tried, the first error is raised after that
+        """
+        batches: list[dict[str, bytes]] = [{} for _ in range(self.shards)]
+        for device, frame in frames.items():
+            batches[self.shard_of(device)][device.device_chip_id] = frame_to_bytes(frame)
+        results = await asyncio.gather(
+            *(self.__call(index, 'push_frames', batch) for index, batch in enumerate(batches) if batch)
+        )
+        errors = [error for result in results for error in result.values()]
+        if errors:
+            raise errors[0]
@@ -0,0 +1,17 @@
+import pytest_asyncio
+
+from engine import QLPEngine
+
+
+@pytest_asyncio.fixture
+async def engine():
+    """Started engine singleton, it is stopped and forgets found devices after test, so tests don't share them"""
+    eng = QLPEngine()
+    # Control panel creates the singleton with device cache if it is imported first
+    eng.cache_path = None
+    await eng.start()
+    yield eng
+    if eng._listening:  # pylint: disable=protected-access
+        await eng.stop()
+    for device in eng.devices:
+        eng.devices.remove(device)
@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+
+from emulator import QLSCEmulator
+from models.color import Color
+from utils.capture import Direction, QLPCaptureReader, QLPCaptureWriter, QLPReplayer, to_original_peers
+
+
+def test_capture_is_appended_and_read_back(tmp_path):
+    path = tmp_path / 'traffic.qlpcap'
+    with QLPCaptureWriter(path) as writer:
+        writer.record(Direction.TX, b'\x01\x02', ('192.168.1.10', 52075))
+    with QLPCaptureWriter(path) as writer:
+        writer.record(Direction.RX, b'\x03', ('localhost', 1))
+    # Interrupted writer leaves incomplete record
+    with open(path, 'ab') as file:
+        file.write(b'\x00' * 5)
+    with QLPCaptureReader(path) as reader:
+        records = list(reader)
+    assert [(record.direction, record.address, record.data) for record in records] == [
+        (Direction.TX, ('192.168.1.10', 52075), b'\x01\x02'),
+        (Direction.RX, ('0.0.0.0', 1), b'\x03'),
+    ]
+    assert records[0].timestamp <= records[1].timestamp
+
+
+def test_not_capture_is_rejected(tmp_path):
+    path = tmp_path / 'log.txt'
+    path.write_bytes(b'>>>> TX: 51 4C 50')
+    with pytest.raises(ValueError):
+        QLPCaptureReader(path)
+
+
+def test_only_local_peers_are_replayed_by_default(tmp_path):
+    path = tmp_path / 'traffic.qlpcap'
+    with QLPCaptureWriter(path) as writer:
+        writer.record(Direction.TX, b'\x01', ('192.168.1.10', 52075))
+        writer.record(Direction.TX, b'\x02', ('127.0.0.1', 52075))
+        writer.record(Direction.RX, b'\x03', ('127.0.0.1', 52075))
+    with QLPCaptureReader(path) as reader:
+        records = list(reader)
+    replayer = QLPReplayer(path, speed=0)
+    assert [replayer.route(record) for record in records] == [None, ('127.0.0.1', 52075), None]
+    assert [to_original_peers(record) for record in records] == [('192.168.1.10', 52075), ('127.0.0.1', 52075), None]
+
+
+@pytest.mark.asyncio
+async def test_engine_traffic_is_captured_and_replayed(engine, tmp_path):
+    path = tmp_path / 'traffic.qlpcap'
+    await engine.stop()
+    engine.capture_path = path
+    await engine.start()
+    try:
+        async with QLSCEmulator(2, length=5) as emulator:
+            await engine.discover_all_devices(timeout=0.1, addresses=emulator.addresses)
+            device = engine.devices.by_chip_id(f'{emulator.controllers[0].chip_id:08X}')
+            assert device is not None
+            for i in range(5):
+                await device.fill(Color(i, i, i))
+            await engine.stop()
+            with QLPCaptureReader(path) as reader:
+                records = list(reader)
+            sent = [record for record in records if record.direction == Direction.TX]
+            received = [record for record in records if record.direction == Direction.RX]
+            assert len(received) >= 7
+            assert sum(record.address == emulator.controllers[0].address for record in sent) >= 6
+
+            emulated = set(emulator.addresses)
+            expected = sum(record.address in emulated for record in sent)
+            received_before = sum(controller.received for controller in emulator.controllers)
+            replayer = QLPReplayer(path, speed=0, route=lambda record: (
+                record.address if record.direction == Direction.TX and record.address in emulated else None
+            ))
+            assert await replayer.replay() == expected
+            await asyncio.sleep(0.05)
+            assert sum(controller.received for controller in emulator.controllers) - received_before == expected
+            assert emulator.controllers[0].pixels == b'\x04\x04\x04' * 5
+            await engine.start()
+    finally:
+        engine.capture_path = None
@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+
+from enums.commands import CommandID
+from enums.device_state import DeviceState
+from enums.packet_type import PacketType
+from enums.priority import Priority
+from exceptions.protocol_exceptions import QLPQueueFullError
+from models.channel import QLPDeviceChannel
+from models.packet import QLPPacket
+
+
+@pytest.mark.asyncio
+async def test_timeout_follows_round_trip_time():
+    channel = QLPDeviceChannel(8)
+    assert channel.retransmission_timeout(0) == QLPDeviceChannel.INITIAL_RTO
+    for _ in range(20):
+        channel.register_response(0.01)
+    assert channel.retransmission_timeout(0) == QLPDeviceChannel.MIN_RTO
+    assert channel.retransmission_timeout(2) == 4 * QLPDeviceChannel.MIN_RTO
+    assert channel.retransmission_timeout(10) == QLPDeviceChannel.MAX_RTO
+
+
+@pytest.mark.asyncio
+async def test_losses_change_state():
+    channel = QLPDeviceChannel(8)
+    states = [channel.register_loss() for _ in range(QLPDeviceChannel.OFFLINE_AFTER)]
+    assert states[0] == DeviceState.ONLINE
+    assert states[QLPDeviceChannel.DEGRADED_AFTER - 1] == DeviceState.DEGRADED
+    assert states[-1] == DeviceState.OFFLINE
+    assert channel.register_response() == DeviceState.ONLINE
+    assert channel.rto == QLPDeviceChannel.INITIAL_RTO
+
+
+def command(command_id: CommandID, payload: bytes = b'') -> QLPPacket:
+    return QLPPacket(b'\x01\x00\x00\x00' + command_id + payload, PacketType.CONTROL)
+
+
+def enqueue(channel: QLPDeviceChannel, packet: QLPPacket, waiter: asyncio.Future) -> bool:
+    return channel.enqueue(packet, waiter, Priority.INTERACTIVE)
+
+
+@pytest.mark.asyncio
+async def test_queued_command_is_superseded():
+    channel = QLPDeviceChannel(1)
+    loop = asyncio.get_running_loop()
+    first, second, brightness = loop.create_future(), loop.create_future(), loop.create_future()
+    assert not enqueue(channel, command(CommandID.FILL, b'\x01\x01\x01'), first)
+    assert not enqueue(channel, command(CommandID.SET_BRIGHTNESS, b'\x10'), brightness)
+    assert enqueue(channel, command(CommandID.FILL, b'\x02\x02\x02'), second)
+    queue = channel.queue
+    assert [queued.packet.command_id for queued in queue] == [CommandID.SET_BRIGHTNESS, CommandID.FILL]
+    assert queue[-1].waiters == [first, second]
+    assert bytes(queue[-1].packet.payload) == b'\x02\x02\x02'
+
+
+@pytest.mark.asyncio
+async def test_queued_color_is_superseded():
+    channel = QLPDeviceChannel(1)
+    loop = asyncio.get_running_loop()
+    first, query, second = loop.create_future(), loop.create_future(), loop.create_future()
+    assert not enqueue(channel, command(CommandID.SET_COLOR, b'\x01\x01\x01'), first)
+    assert not enqueue(channel, command(CommandID.FILL, b'\x05\x05\x05'), loop.create_future())
+    assert enqueue(channel, command(CommandID.SET_COLOR, b'\x02\x02\x02'), second)
+    assert [queued.packet.command_id for queued in channel.queue] == [CommandID.FILL, CommandID.SET_COLOR]
+    assert channel.queue[-1].waiters == [first, second]
+    # Query of color is answered with the color set before it
+    assert not enqueue(channel, command(CommandID.SET_COLOR), query)
+    assert not enqueue(channel, command(CommandID.SET_COLOR, b'\x03\x03\x03'), loop.create_future())
+    assert len(channel.queue) == 4
+
+
+@pytest.mark.asyncio
+async def test_ordered_commands_are_not_reordered():
+    channel = QLPDeviceChannel(1)
+    loop = asyncio.get_running_loop()
+    enqueue(channel, command(CommandID.SET_PIXEL, b'\x01\x00\x01\x01\x01'), loop.create_future())
+    enqueue(channel, command(CommandID.SET_PIXEL, b'\x02\x00\x01\x01\x01'), loop.create_future())
+    assert enqueue(channel, command(CommandID.SET_PIXEL, b'\x01\x00\x02\x02\x02'), loop.create_future())
+    enqueue(channel, command(CommandID.FILL, b'\x00\x00\x00'), loop.create_future())
+    assert not enqueue(channel, command(CommandID.SET_PIXEL, b'\x02\x00\x03\x03\x03'), loop.create_future())
+    enqueue(channel, command(CommandID.REBOOT), loop.create_future())
+    assert not enqueue(channel, command(CommandID.FILL, b'\x00\x00\x00'), loop.create_future())
+    assert len(channel.queue) == 6
+
+
+@pytest.mark.asyncio
+async def test_full_queue_rejects_command():
+    channel = QLPDeviceChannel(1, {Priority.BULK: 1})
+    loop = asyncio.get_running_loop()
+    channel.enqueue(command(CommandID.SET_ALL_PIXELS, b'\x00' * 3), loop.create_future(), Priority.BULK)
+    # Replacing doesn't make queue longer
+    channel.enqueue(command(CommandID.SET_ALL_PIXELS, b'\x01' * 3), loop.create_future(), Priority.BULK)
+    with pytest.raises(QLPQueueFullError):
+        channel.enqueue(command(CommandID.SET_LINE_IMAGE, b'\x00' * 6), loop.create_future(), Priority.BULK)
+
+
+@pytest.mark.asyncio
+async def test_commands_keep_order_across_classes():
+    channel = QLPDeviceChannel(1)
+    loop = asyncio.get_running_loop()
+    channel.enqueue(command(CommandID.SET_ALL_PIXELS, b'\x00' * 3), loop.create_future(), Priority.BULK)
+    assert channel.priority == Priority.BULK
+    channel.enqueue(command(CommandID.LENGTH, b'\x10\x00'), loop.create_future(), Priority.CONTROL)
+    # FILL would supersede the frame, but it can't be moved ahead of LENGTH
+    assert not channel.enqueue(command(CommandID.FILL, b'\x01' * 3), loop.create_future(), Priority.INTERACTIVE)
+    assert channel.priority == Priority.CONTROL
+    order = []
+    while (queued := channel.dequeue()) is not None:
+        order.append(queued.packet.command_id)
+    assert order == [CommandID.SET_ALL_PIXELS, CommandID.LENGTH, CommandID.FILL]
+    assert channel.priority is None
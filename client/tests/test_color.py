@@ -0,0 +1,33 @@
+import numpy as np
+import pytest
+
+from models.color import Color
+from models.color_array import ColorArray
+from models.device import frame_to_bytes
+
+
+@pytest.mark.parametrize('hue, saturation, value', [(0, 255, 255), (10, 100, 200), (128, 255, 128), (250, 30, 90)])
+def test_vectorized_hsv_matches_color(hue, saturation, value):
+    color = Color.from_HSV(hue, saturation, value)
+    assert bytes(ColorArray.from_hsv(np.array([hue]), saturation, value)) == bytes(color)
+
+
+def test_lookup_tables():
+    colors = ColorArray.from_bytes(bytes([0, 128, 255]))
+    assert bytes(colors.apply_brightness(128)) == bytes([0, 64, 128])
+    assert bytes(ColorArray.from_bytes(bytes([0, 128, 255])).apply_gamma(2.2)) == bytes([0, 56, 255])
+
+
+def test_view_is_frame():
+    colors = ColorArray(3)
+    colors[1] = Color(1, 2, 3)
+    assert frame_to_bytes(colors) == bytes(3) + b'\x01\x02\x03' + bytes(3)
+    assert colors[1].green == 2
+
+
+def test_sent_frame_is_not_changed_with_array():
+    colors = ColorArray(2)
+    frame = frame_to_bytes(colors)
+    colors.apply_brightness(0)[0] = Color(9, 9, 9)
+    assert frame == bytes(6)
+    assert colors.view[:3] == b'\x09\x09\x09'
@@ -0,0 +1,144 @@
+import asyncio
+from typing import Optional
+
+import pytest
+from fastapi import Request
+
+from control_panel import (
+    CommandResult, DeviceCommand, DevicesSnapshot, LatestFrames, device_events, run_command, search_for_devices,
+    snapshot, split_frame,
+)
+from enums.commands import CommandID
+from enums.device_state import DeviceState
+from enums.common_response_code import CommonResponseCode
+from enums.priority import Priority
+from exceptions.protocol_exceptions import QLPError, QLPResponseWithError
+from models.device import Frame, QLSCDevice, frame_to_bytes
+
+
+class PanelDevice(QLSCDevice):
+    """Device which records frames instead of sending them, pushing of failing frames and LENGTH fails"""
+    frames: list[bytes] = []
+    failing: list[bytes] = []
+    delay: float = 0
+
+    async def send_command(self, command_id: CommandID, data: bytes = b'', priority: Optional[Priority] = None):
+        if command_id == CommandID.LENGTH:
+            raise QLPResponseWithError(self, None, CommonResponseCode.LENGTH_ERROR, None)
+
+    async def update_frame(self, frame: Frame, tolerance: int = 0):
+        data = frame_to_bytes(frame)
+        self.frames.append(data)
+        await asyncio.sleep(self.delay)
+        if data in self.failing:
+            raise QLPError('Frame was lost')
+
+
+def add_device(engine, device_uuid: str, **fields) -> PanelDevice:
+    chip_id = f'0000C{len(engine.devices):03X}'
+    return engine.devices.add(
+        PanelDevice(ip='127.0.0.1', device_chip_id=chip_id, device_uuid=device_uuid, name='Test', **fields),
+    )
+
+
+def test_split_frame():
+    assert split_frame(b'\x03abc\x01\x02\x03') == ('abc', b'\x01\x02\x03')
+    assert split_frame(b'\x03abc') == ('abc', b'')
+    assert split_frame(b'') == ('', b'')
+    with pytest.raises(ValueError):
+        split_frame(b'\x02\xff\xfe\x01\x02\x03')
+
+
+@pytest.mark.asyncio
+async def test_unknown_command_is_rejected(engine):
+    add_device(engine, 'panel')
+    with pytest.raises(ValueError, match='Unknown command'):
+        await run_command(DeviceCommand(devices=['panel'], command='explode'))
+
+
+@pytest.mark.asyncio
+async def test_command_errors_are_reported_per_device(engine):
+    add_device(engine, 'panel')
+    results = await run_command(DeviceCommand(devices=['panel', 'missing'], command='fill', args={'color': [1, 2, 3]}))
+    assert results['panel'].ok
+    assert results['missing'] == CommandResult(ok=False, error='Device was not found')
+    results = await run_command(DeviceCommand(devices=['panel'], command='fill'))
+    assert results['panel'].error == "KeyError: 'color'"
+    results = await run_command(DeviceCommand(devices=['panel'], command='set_length', args={'length': 30}))
+    assert results['panel'].error == 'QLPResponseWithError: LENGTH_ERROR'
+
+
+@pytest.mark.asyncio
+async def test_busy_device_gets_only_latest_frame(engine):
+    device = add_device(engine, 'panel', delay=0.05)
+    frames = LatestFrames()
+    for frame in (b'\x01\x01\x01', b'\x02\x02\x02', b'\x03\x03\x03'):
+        frames.push(device, frame)
+        await asyncio.sleep(0)
+    await asyncio.sleep(0.2)
+    assert device.frames == [b'\x01\x01\x01', b'\x03\x03\x03']
+    frames.cancel()
+
+
+@pytest.mark.asyncio
+async def test_frames_are_pushed_after_error(engine):
+    device = add_device(engine, 'panel', delay=0.02, failing=[b'\x01\x01\x01'])
+    frames = LatestFrames()
+    frames.push(device, b'\x01\x01\x01')
+    await asyncio.sleep(0)
+    frames.push(device, b'\x02\x02\x02')
+    await asyncio.sleep(0.1)
+    frames.push(device, b'\x03\x03\x03')
+    await asyncio.sleep(0.1)
+    assert device.frames == [b'\x01\x01\x01', b'\x02\x02\x02', b'\x03\x03\x03']
+    frames.cancel()
+
+
+@pytest.mark.asyncio
+async def test_snapshot_follows_device_changes(engine):
+    devices = DevicesSnapshot()
+    device = add_device(engine, 'panel')
+    devices.update(engine.devices)
+    etag = devices.etag
+    devices.update(engine.devices)
+    assert devices.etag == etag
+    device.state = DeviceState.OFFLINE
+    devices.update(engine.devices)
+    assert devices.etag != etag and b'"offline"' in devices.body
+
+
+@pytest.mark.asyncio
+async def test_unchanged_devices_are_not_sent_again(engine):
+    add_device(engine, 'panel')
+    snapshot.update(engine.devices)
+    response = await search_for_devices(if_none_match=None)
+    assert response.status_code == 200 and b'"panel"' in response.body
+    etag = response.headers['ETag']
+    response = await search_for_devices(if_none_match=etag)
+    assert response.status_code == 304 and not response.body
+    add_device(engine, 'another')
+    snapshot.update(engine.devices)
+    response = await search_for_devices(if_none_match=etag)
+    assert response.status_code == 200 and b'"another"' in response.body
+
+
+async def never_disconnects() -> dict:
+    await asyncio.Event().wait()
+    return {'type': 'http.disconnect'}
+
+
+@pytest.mark.asyncio
+async def test_device_changes_are_streamed(engine):
+    add_device(engine, 'panel')
+    snapshot.update(engine.devices)
+    response = await device_events(Request({'type': 'http'}, never_disconnects))
+    events = response.body_iterator
+    first = await anext(events)
+    assert first.startswith(b'event: devices\nid: ' + snapshot.etag.encode()) and b'"panel"' in first
+    following = asyncio.create_task(anext(events))
+    await asyncio.sleep(0.01)
+    assert not following.done()
+    add_device(engine, 'another')
+    snapshot.update(engine.devices)
+    assert b'"another"' in await asyncio.wait_for(following, 1)
+    await events.aclose()
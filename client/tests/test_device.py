@@ -0,0 +1,71 @@
+import asyncio
+from typing import Optional
+
+import pytest
+
+from enums.commands import CommandID
+from enums.priority import Priority
+from models.color import Color
+from models.device import QLSCDevice
+from utils.frame_planner import MAX_LINE_IMAGE_PIXELS
+
+
+class RecordingDevice(QLSCDevice):
+    """Device which records commands instead of sending them, every command takes delay seconds"""
+    sent: list[tuple[CommandID, bytes]] = []
+    delay: float = 0
+
+    async def send_command(self, command_id: CommandID, data: bytes = b'', priority: Optional[Priority] = None):
+        self.sent.append((command_id, data))
+        await asyncio.sleep(self.delay)
+
+
+def make_device(length: int, delay: float = 0) -> RecordingDevice:
+    return RecordingDevice(
+        ip='127.0.0.1', device_chip_id='0000ABCD', device_uuid='1', name='Test', length=length, delay=delay,
+    )
+
+
+@pytest.mark.asyncio
+async def test_small_frame_is_sent_at_once():
+    device = make_device(30)
+    await device.push_frame([Color(1, 2, 3)] * 30)
+    assert device.sent == [(CommandID.SET_ALL_PIXELS, b'\x01\x02\x03' * 30)]
+
+
+@pytest.mark.asyncio
+async def test_big_frame_is_chunked():
+    device = make_device(600)
+    await device.push_frame(bytes(range(200)) * 9)
+    assert [command for command, _ in device.sent] == [CommandID.SET_LINE_IMAGE] * 3
+    assert b''.join(data[3:] for _, data in device.sent) == bytes(range(200)) * 9
+    assert device.sent[1][1][:3] == MAX_LINE_IMAGE_PIXELS.to_bytes(2, 'little') + bytes([MAX_LINE_IMAGE_PIXELS])
+
+
+@pytest.mark.asyncio
+async def test_stream_drops_stale_frames():
+    device = make_device(1, delay=0.05)
+    dropped = await device.stream([bytes([i, i, i]) for i in range(10)], fps=100)
+    assert dropped > 0
+    assert len(device.sent) + dropped == 10
+
+
+@pytest.mark.asyncio
+async def test_update_frame_sends_only_difference():
+    device = make_device(50)
+    await device.update_frame(bytes(150))
+    await device.update_frame(bytes(15) + b'\x01\x01\x01' + bytes(132))
+    assert device.sent == [(CommandID.FILL, bytes(3)), (CommandID.SET_PIXEL, b'\x05\x00\x01\x01\x01')]
+
+
+@pytest.mark.asyncio
+async def test_update_frame_remembers_approximated_strip():
+    device = make_device(100)
+    frame = b''.join(bytes([i, i // 2, 0]) for i in range(0, 200, 2))
+    await device.update_frame(frame, tolerance=2)
+    sent = len(device.sent)
+    assert sent < 5
+    await device.update_frame(frame, tolerance=2)
+    assert len(device.sent) == sent
+    await device.update_frame(frame)
+    assert len(device.sent) > sent
@@ -0,0 +1,119 @@
+import asyncio
+import socket
+
+import pytest
+
+from emulator import NetworkConditions, QLSCEmulator
+from enums.commands import CommandID
+from enums.common_response_code import CommonResponseCode
+from enums.device_state import DeviceState
+from enums.packet_type import PacketType
+from exceptions.protocol_exceptions import QLPTimeoutError
+from models.color import Color
+from models.packet import QLPPacket
+
+
+@pytest.mark.asyncio
+async def test_emulated_fleet_is_discovered_and_controlled(engine):
+    async with QLSCEmulator(20, length=10) as emulator:
+        devices = await engine.discover_all_devices(timeout=0.1, addresses=emulator.addresses)
+        emulated = {f'{controller.chip_id:08X}': controller for controller in emulator.controllers}
+        devices = [device for device in devices if device.device_chip_id in emulated]
+        assert len(devices) == 20
+        await devices[0].set_length(10)
+        await devices[0].fill(Color(1, 2, 3))
+        assert emulated[devices[0].device_chip_id].pixels == b'\x01\x02\x03' * 10
+
+
+@pytest.mark.asyncio
+async def test_lost_packets_are_retransmitted(engine):
+    async with QLSCEmulator(1, conditions=NetworkConditions(loss=0.1), seed=3) as emulator:
+        await engine.discover_all_devices(timeout=0.1, addresses=emulator.addresses * 5)
+        device = engine.devices.by_chip_id(f'{emulator.controllers[0].chip_id:08X}')
+        assert device is not None
+        for i in range(10):
+            await device.fill(Color(i, i, i))
+        assert emulator.controllers[0].pixels[:3] == b'\x09\x09\x09'
+
+
+@pytest.mark.asyncio
+async def test_discovery_finishes_when_expected_devices_answer(engine):
+    async with QLSCEmulator(3) as emulator:
+        started = asyncio.get_running_loop().time()
+        found = [device async for device in engine.discover(expected=3, timeout=5, addresses=emulator.addresses)]
+        assert asyncio.get_running_loop().time() - started < 1
+        assert {device.device_chip_id for device in found} == {
+            f'{controller.chip_id:08X}' for controller in emulator.controllers
+        }
+
+
+@pytest.mark.asyncio
+async def test_cached_devices_are_controlled_after_restart(engine, tmp_path):
+    engine.cache_path = tmp_path / 'devices.json'
+    try:
+        async with QLSCEmulator(2, length=5) as emulator:
+            await engine.discover_all_devices(timeout=0.1, addresses=emulator.addresses)
+            await engine.stop()
+            for device in list(engine.devices):
+                engine.devices.remove(device)
+            await engine.start()
+            device = engine.devices.by_chip_id(f'{emulator.controllers[0].chip_id:08X}')
+            assert device is not None
+            await device.fill(Color(4, 5, 6))
+            assert emulator.controllers[0].pixels[:3] == b'\x04\x05\x06'
+    finally:
+        engine.cache_path = None
+
+
+@pytest.mark.asyncio
+async def test_device_cache_is_saved_after_changes(engine, tmp_path):
+    await engine.stop()
+    engine.cache_path = tmp_path / 'devices.json'
+    engine.cache_save_interval = 0.05
+    try:
+        await engine.start()
+        async with QLSCEmulator(1) as emulator:
+            await engine.discover_all_devices(timeout=0.1, addresses=emulator.addresses)
+            await asyncio.sleep(0.2)
+            assert f'{emulator.controllers[0].chip_id:08X}' in engine.cache_path.read_text(encoding='utf-8')
+    finally:
+        engine.cache_path = None
+        engine.cache_save_interval = 5.0
+
+
+@pytest.mark.asyncio
+async def test_unconfirmed_cached_device_is_offline(engine, tmp_path):
+    engine.cache_path = tmp_path / 'devices.json'
+    try:
+        async with QLSCEmulator(1) as emulator:
+            await engine.discover_all_devices(timeout=0.1, addresses=emulator.addresses)
+            chip_id = f'{emulator.controllers[0].chip_id:08X}'
+            await engine.stop()
+            for device in list(engine.devices):
+                engine.devices.remove(device)
+        await engine.start()
+        device = engine.devices.by_chip_id(chip_id)
+        assert device is not None
+        await asyncio.sleep(1.7)
+        assert device.state == DeviceState.OFFLINE
+        retransmissions = engine.metrics.retransmissions.value
+        with pytest.raises(QLPTimeoutError):
+            await asyncio.wait_for(device.fill(Color(1, 1, 1)), 1.5)
+        assert engine.metrics.retransmissions.value == retransmissions
+    finally:
+        engine.cache_path = None
+
+
+@pytest.mark.asyncio
+async def test_unknown_command_is_answered_with_error():
+    async with QLSCEmulator(1) as emulator:
+        controller = emulator.controllers[0]
+        packet = QLPPacket(controller.chip_id.to_bytes(4, 'little') + b'\xFE', PacketType.CONTROL, packet_id=7)
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as sock:
+            sock.setblocking(False)
+            sock.bind(('127.0.0.1', 0))
+            sock.sendto(packet.serialize(), controller.address)
+            response = QLPPacket.parse(await asyncio.wait_for(asyncio.get_running_loop().sock_recv(sock, 1500), 1))
+        assert response.packet_id == 7
+        assert response.command_id == CommandID.COMMON_RESPONSE
+        assert response.payload[0] == CommonResponseCode.OTHER_ERROR
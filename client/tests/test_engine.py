@@ -1,9 +1,17 @@
-# pylint: disable=redefined-outer-name
+import asyncio
+import socket
 
 import pytest
 
 from engine import QLPEngine
-from exceptions.protocol_exceptions import QLPError
+from enums.commands import CommandID
+from enums.common_response_code import CommonResponseCode
+from enums.device_state import DeviceState
+from enums.packet_type import PacketType
+from exceptions.protocol_exceptions import QLPError, QLPResponseWithError
+from models.color import Color
+from models.device import QLSCDevice
+from models.packet import QLP_PORT, QLPPacket
 
 
 # @pytest.fixture(scope='session', autouse=True)
@@ -11,9 +19,14 @@ from exceptions.protocol_exceptions import QLPError
 #     return asyncio.get_event_loop()
 
 
-@pytest.fixture
-async def engine():
-    return QLPEngine()
+def respond(chip_id: int, sequence: int, code: CommonResponseCode = CommonResponseCode.OK):
+    response = QLPPacket(
+        chip_id.to_bytes(4, 'little') + CommandID.COMMON_RESPONSE + code,
+        PacketType.CONTROL,
+        packet_id=sequence,
+    )
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as sock:
+        sock.sendto(response.serialize(), ('127.0.0.1', 52075))
 
 
 @pytest.mark.asyncio
@@ -24,14 +37,147 @@ async def test_singleton(engine):
 
 @pytest.mark.asyncio
 async def test_deny_double_start(engine):
-    await engine.start()
     with pytest.raises(QLPError):
         await engine.start()
 
 
 @pytest.mark.asyncio
 async def test_deny_double_stop(engine):
-    await engine.start()
     await engine.stop()
     with pytest.raises(QLPError):
         await engine.stop()
+
+
+@pytest.mark.asyncio
+async def test_datagram_is_dispatched_on_arrival(engine):
+    packet = QLPPacket(b'IAH-0000ABCD-12345678-Test Device', PacketType.DISCOVERY)
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as sock:
+        sock.sendto(packet.serialize(), ('127.0.0.1', 52075))
+    for _ in range(100):
+        if engine['12345678'] is not None:
+            break
+        await asyncio.sleep(0.01)
+    assert engine['12345678'].device_chip_id == '0000ABCD'
+
+
+@pytest.mark.asyncio
+async def test_pipelined_commands_are_acknowledged_out_of_order(engine):
+    device = QLSCDevice(ip='127.0.0.1', device_chip_id='00000A01', device_uuid='pipeline', name='Test Device')
+    device.set_engine(engine)
+    first = asyncio.create_task(device.fill(Color(1, 2, 3)))
+    second = asyncio.create_task(device.reboot())
+    await asyncio.sleep(0.01)
+    respond(0x0A01, 1)
+    respond(0x0A01, 0)
+    await asyncio.wait_for(asyncio.gather(first, second), 0.4)
+
+
+@pytest.mark.asyncio
+async def test_error_response_raises(engine):
+    device = QLSCDevice(ip='127.0.0.1', device_chip_id='00000A02', device_uuid='error', name='Test Device')
+    device.set_engine(engine)
+    command = asyncio.create_task(device.set_length(30))
+    await asyncio.sleep(0.01)
+    respond(0x0A02, 0, CommonResponseCode.LENGTH_ERROR)
+    with pytest.raises(QLPResponseWithError):
+        await asyncio.wait_for(command, 0.4)
+
+
+@pytest.mark.asyncio
+async def test_group_members_are_tracked(engine):
+    devices = [
+        engine.devices.upsert(('127.0.0.1', QLP_PORT), f'00000B0{i}', f'group-{i}', 'Test Device')
+        for i in range(2)
+    ]
+    for device in devices:
+        device.set_engine(engine)
+    assigning = asyncio.create_task(engine.assign_group(7, *devices))
+    await asyncio.sleep(0.01)
+    respond(0x0B00, 0)
+    respond(0x0B01, 0)
+    group = await asyncio.wait_for(assigning, 0.4)
+    assert group.members == set(devices)
+    await group.fill(Color(1, 1, 1))
+
+
+@pytest.mark.asyncio
+async def test_silent_device_is_degraded_and_recovers(engine):
+    device = engine.devices.upsert(('127.0.0.1', QLP_PORT), '00000A03', 'silent', 'Test Device')
+    device.set_engine(engine)
+    command = asyncio.create_task(device.reboot())
+    await asyncio.sleep(1.6)
+    assert device.state == DeviceState.DEGRADED
+    respond(0x0A03, 0)
+    await asyncio.wait_for(command, 0.4)
+    assert device.state == DeviceState.ONLINE
+
+
+@pytest.mark.asyncio
+async def test_invalid_datagram_is_counted(engine):
+    invalid = engine.metrics.invalid_packets.value
+    received = engine.metrics.rx_packets.value
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as sock:
+        sock.sendto(b'QLP\x01\x02garbage', ('127.0.0.1', 52075))
+    for _ in range(100):
+        if engine.metrics.invalid_packets.value > invalid:
+            break
+        await asyncio.sleep(0.01)
+    assert engine.metrics.invalid_packets.value == invalid + 1
+    assert engine.metrics.rx_packets.value == received + 1
+    assert 'qlp_rx_invalid_packets_total' in engine.metrics.render()
+
+
+@pytest.mark.asyncio
+async def test_malformed_discovery_answer_is_dropped(engine):
+    invalid = engine.metrics.invalid_packets.value
+    answers = (b'IAH-', b'IAH-0000ABZZ-badchip0-Test Device', b'IAH-0000ABCE-badname0-\xff')
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP) as sock:
+        for answer in answers:
+            sock.sendto(QLPPacket(answer, PacketType.DISCOVERY).serialize(), ('127.0.0.1', 52075))
+    for _ in range(100):
+        if engine.metrics.invalid_packets.value >= invalid + len(answers):
+            break
+        await asyncio.sleep(0.01)
+    assert engine.metrics.invalid_packets.value == invalid + len(answers)
+    assert len(engine.devices) == 0
+
+
+@pytest.mark.asyncio
+async def test_unsent_commands_are_coalesced(engine):
+    device = QLSCDevice(ip='127.0.0.1', device_chip_id='00000A04', device_uuid='coalesce', name='Test Device')
+    device.set_engine(engine)
+    coalesced = engine.metrics.coalesced.value
+    fills = [asyncio.create_task(device.fill(Color(i, i, i))) for i in range(engine.command_window + 3)]
+    await asyncio.sleep(0.01)
+    assert engine.metrics.coalesced.value == coalesced + 2
+    for sequence in range(engine.command_window + 1):
+        respond(0x0A04, sequence)
+    await asyncio.wait_for(asyncio.gather(*fills), 0.4)
+
+
+@pytest.mark.asyncio
+async def test_stop_fails_pending_commands(engine):
+    device = QLSCDevice(ip='127.0.0.1', device_chip_id='00000A05', device_uuid='stopped', name='Test Device')
+    device.set_engine(engine)
+    # The last one is still queued
+    commands = [asyncio.create_task(device.reboot()) for _ in range(engine.command_window + 1)]
+    await asyncio.sleep(0.01)
+    await engine.stop()
+    for command in commands:
+        with pytest.raises(QLPError):
+            await asyncio.wait_for(command, 0.4)
+
+
+@pytest.mark.asyncio
+async def test_command_is_rejected_while_engine_is_stopped(engine):
+    device = QLSCDevice(ip='127.0.0.1', device_chip_id='00000A06', device_uuid='not-started', name='Test Device')
+    device.set_engine(engine)
+    await engine.stop()
+    for _ in range(engine.command_window + 1):
+        with pytest.raises(QLPError):
+            await asyncio.wait_for(device.reboot(), 0.4)
+    await engine.start()
+    command = asyncio.create_task(device.reboot())
+    await asyncio.sleep(0.01)
+    respond(0x0A06, 0)
+    await asyncio.wait_for(command, 0.4)
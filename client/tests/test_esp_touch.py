@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from emulator import QLSCEmulator
+from utils import esp_touch
+from utils.esp_touch import GUIDE_CODE, PACKET_INTERVAL, ESPTouchSession, crc8, encode_data_byte
+
+
+def test_crc8():
+    assert crc8(b'Home') == 143
+    assert crc8(bytes.fromhex('aabbccddeeff')) == 18
+
+
+def test_data_byte_encoding():
+    assert encode_data_byte(0xA5, 7) == (194, 303, 77)
+
+
+def test_data_code():
+    session = ESPTouchSession('Home', 'secret', '192.168.1.5', 'aabbccddeeff')
+    assert len(session.data_code) == 75
+    assert session.data_code[:12] == (217, 296, 187, 280, 297, 110, 176, 298, 231, 185, 299, 282)
+    assert session.data_code[-6:] == (230, 319, 166, 263, 320, 279)
+
+
+class RecordingTransport:
+    """Transport which remembers datagrams instead of sending them to the network"""
+
+    def __init__(self) -> None:
+        self.sent: list[tuple[float, int, tuple[str, int]]] = []
+        self.closed = False
+
+    def sendto(self, data, addr=None) -> None:
+        self.sent.append((asyncio.get_running_loop().time(), len(data), addr))
+
+    def close(self) -> None:
+        self.closed = True
+
+    def is_closing(self) -> bool:
+        return self.closed
+
+
+def record_datagrams(monkeypatch) -> list[RecordingTransport]:
+    """ESP-Touch endpoints created after this call record datagrams"""
+    transports: list[RecordingTransport] = []
+
+    async def create_datagram_endpoint(protocol_factory, **_):
+        transports.append(RecordingTransport())
+        return transports[-1], protocol_factory()
+
+    monkeypatch.setattr(asyncio.get_running_loop(), 'create_datagram_endpoint', create_datagram_endpoint)
+    return transports
+
+
+@pytest.mark.asyncio
+async def test_codes_are_paced(monkeypatch):
+    monkeypatch.setattr(esp_touch, 'GUIDE_DURATION', 0.001)
+    monkeypatch.setattr(esp_touch, 'DATA_DURATION', 0.001)
+    transports = record_datagrams(monkeypatch)
+    session = ESPTouchSession('', '', '192.168.1.5', broadcast=False)
+    started = asyncio.get_running_loop().time()
+    await session.run(rounds=1)
+    sent = transports[0].sent
+    # Whole code is sent even if duration has passed
+    assert [length for _, length, _ in sent] == list(GUIDE_CODE) + list(session.data_code)
+    assert sent[-1][0] - started >= (len(sent) - 1) * PACKET_INTERVAL
+    assert {address for _, _, address in sent[:4]} == {('234.1.1.1', 7001)}
+    # Destination of data code changes every 3 datagrams, one byte of data
+    assert [address[0] for _, _, address in sent[4:11]] == ['234.2.2.2'] * 3 + ['234.3.3.3'] * 3 + ['234.4.4.4']
+    assert transports[0].is_closing()
+
+
+@pytest.mark.asyncio
+async def test_cancelled_session_stops_sending(monkeypatch):
+    transports = record_datagrams(monkeypatch)
+    sending = asyncio.create_task(ESPTouchSession('Home', 'secret').run())
+    await asyncio.sleep(0.1)
+    sending.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await sending
+    assert transports[0].is_closing()
+    # Sending does not block the event loop, datagrams go one by one between other tasks
+    assert 0.1 / PACKET_INTERVAL / 2 <= len(transports[0].sent) <= 0.1 / PACKET_INTERVAL + 1
+    assert {address for _, _, address in transports[0].sent} == {('255.255.255.255', 7001)}
+
+
+@pytest.mark.asyncio
+async def test_connecting_finishes_on_first_new_device(engine, monkeypatch):
+    async with QLSCEmulator(3) as emulator:
+        known = emulator.controllers[0]
+        await engine.discover_all_devices(timeout=0.1, addresses=[known.address])
+        transports = record_datagrams(monkeypatch)
+        started = asyncio.get_running_loop().time()
+        found = await engine.connect_new_devices('Home', 'secret', timeout=5, addresses=emulator.addresses)
+        assert asyncio.get_running_loop().time() - started < 1
+        assert len(found) == 1
+        assert found.pop().device_chip_id in {f'{controller.chip_id:08X}' for controller in emulator.controllers[1:]}
+        assert transports[0].is_closing() and transports[0].sent
@@ -0,0 +1,89 @@
+import math
+import random
+
+import pytest
+
+from enums.commands import CommandID
+from utils.frame_planner import apply_command, plan_approximation, plan_frame
+
+
+def apply_plan(previous: bytes, frame: bytes) -> bytes:
+    result = bytearray(previous)
+    for command_id, data in plan_frame(previous, frame):
+        apply_command(result, command_id, data)
+    return bytes(result)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_plan_reproduces_frame(seed):
+    rnd = random.Random(seed)
+    previous = bytes(rnd.choice([0, 10, 255]) for _ in range(300 * 3))
+    frame = bytearray(previous)
+    for _ in range(rnd.randint(0, 50)):
+        start = rnd.randrange(300)
+        frame[start * 3:start * 3 + rnd.randint(1, 30) * 3] = bytes(rnd.randrange(256) for _ in range(90))
+    frame = frame[:900]
+    assert apply_plan(previous, bytes(frame)) == bytes(frame)
+
+
+def test_unchanged_frame_needs_nothing():
+    frame = bytes(range(90))
+    assert not plan_frame(frame, frame)
+
+
+def test_single_pixel_change():
+    previous = bytes(300)
+    frame = bytes(30) + b'\x01\x02\x03' + bytes(267)
+    assert plan_frame(previous, frame) == [(CommandID.SET_PIXEL, b'\x0a\x00\x01\x02\x03')]
+
+
+def test_uniform_frame_is_filled():
+    assert plan_frame(None, b'\x05\x06\x07' * 100) == [(CommandID.FILL, b'\x05\x06\x07')]
+
+
+def test_linear_gradient_is_one_command():
+    frame = b''.join(bytes([i, 2 * i, 255 - i]) for i in range(100))
+    assert [command for command, _ in plan_frame(bytes(300), frame)] == [CommandID.SET_GRADIENT]
+    assert apply_plan(bytes(300), frame) == frame
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_approximation_stays_within_tolerance(seed):
+    rnd = random.Random(seed)
+    tolerance = rnd.randint(1, 10)
+    color = [rnd.randrange(256) for _ in range(3)]
+    frame = bytearray()
+    for _ in range(300):
+        if rnd.random() < 0.05:
+            color = [rnd.randrange(256) for _ in range(3)]
+        color = [min(255, max(0, channel + rnd.randint(-3, 3))) for channel in color]
+        frame += bytes(color)
+    previous = bytes(rnd.randrange(256) for _ in range(900))
+    result = bytearray(previous)
+    for command_id, data in plan_frame(previous, bytes(frame), tolerance=tolerance):
+        apply_command(result, command_id, data)
+    assert max(abs(a - b) for a, b in zip(result, frame)) <= tolerance
+
+
+def test_smooth_frame_is_approximated_with_gradients():
+    frame = b''.join(
+        bytes([round(180 + 30 * math.sin(i / 60)), round(90 + 20 * math.sin(i / 45)), 40]) for i in range(300)
+    )
+    commands = plan_frame(None, frame, tolerance=4)
+    assert CommandID.SET_GRADIENT in {command for command, _ in commands}
+    assert not {CommandID.SET_LINE_IMAGE, CommandID.SET_ALL_PIXELS} & {command for command, _ in commands}
+    assert sum(len(data) for _, data in commands) < 100
+    # Pixels within tolerance are not sent again
+    assert not plan_frame(bytes(a + 3 if a < 250 else a for a in frame), frame, tolerance=4)
+
+
+def test_approximation_returns_resulting_strip():
+    frame = b''.join(bytes([100 + i // 3, 50, 200 - i // 4]) for i in range(200))
+    previous = bytes(range(200)) * 3
+    commands, result = plan_approximation(previous, frame, tolerance=3)
+    expected = bytearray(previous)
+    for command_id, data in commands:
+        apply_command(expected, command_id, data)
+    assert result == bytes(expected)
+    assert max(abs(a - b) for a, b in zip(result, frame)) <= 3
+    assert plan_approximation(result, frame, tolerance=3) == ([], result)
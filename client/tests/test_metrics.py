@@ -0,0 +1,35 @@
+from utils.metrics import Counter, Gauge, Histogram, HistogramFamily, MetricsRegistry
+
+
+def test_render_prometheus_text():
+    registry = MetricsRegistry()
+    packets = registry.register(Counter('packets_total', 'Packets'))
+    registry.register(Gauge('depth', 'Depth', lambda: 3))
+    rtt = registry.register(HistogramFamily('rtt_seconds', 'RTT', 'device', buckets=(0.01, 0.1)))
+    packets.inc()
+    packets.inc(2)
+    rtt.labels('0000ABCD').observe(0.05)
+    rtt.labels('0000ABCD').observe(1.0)
+    assert registry.render().splitlines() == [
+        '# HELP packets_total Packets',
+        '# TYPE packets_total counter',
+        'packets_total 3',
+        '# HELP depth Depth',
+        '# TYPE depth gauge',
+        'depth 3',
+        '# HELP rtt_seconds RTT',
+        '# TYPE rtt_seconds histogram',
+        'rtt_seconds_bucket{device="0000ABCD",le="0.01"} 0',
+        'rtt_seconds_bucket{device="0000ABCD",le="0.1"} 1',
+        'rtt_seconds_bucket{device="0000ABCD",le="+Inf"} 2',
+        'rtt_seconds_sum{device="0000ABCD"} 1.05',
+        'rtt_seconds_count{device="0000ABCD"} 2',
+    ]
+
+
+def test_histogram_bucket_bounds_are_inclusive():
+    histogram = Histogram('lag', 'Lag', buckets=(1.0, 2.0))
+    histogram.observe(1.0)
+    histogram.observe(2.5)
+    assert histogram.counts == [1, 0, 1]
+    assert histogram.count == 2
@@ -0,0 +1,50 @@
+import pytest
+
+from enums.commands import CommandID
+from enums.packet_type import PacketType
+from exceptions.protocol_exceptions import QLPError
+from models.packet import QLPPacket, xor_checksum
+
+
+def test_control_packet_round_trip():
+    packet = QLPPacket(b'\xcd\xab\x00\x00' + CommandID.FILL + b'\x01\x02\x03', PacketType.CONTROL, packet_id=42)
+    parsed = QLPPacket.parse(packet.serialize(), source='127.0.0.1', source_port=52076)
+    assert parsed.packet_id == 42
+    assert parsed.device_address == b'\xcd\xab\x00\x00'
+    assert parsed.command_id == CommandID.FILL
+    assert parsed.payload == b'\x01\x02\x03'
+    assert parsed.source_address == ('127.0.0.1', 52076)
+    assert parsed.source == '127.0.0.1'
+
+
+def test_parse_rejects_bad_crc():
+    data = bytearray(QLPPacket(b'ABH', PacketType.DISCOVERY).serialize())
+    data[-1] ^= 0xFF
+    with pytest.raises(ValueError):
+        QLPPacket.parse(bytes(data))
+
+
+def test_discovery_packet_has_no_command():
+    with pytest.raises(QLPError):
+        _ = QLPPacket(b'ABH', PacketType.DISCOVERY).command_id
+
+
+@pytest.mark.parametrize('size', [0, 1, 2, 3, 7, 64, 901])
+def test_xor_checksum_matches_bytewise_xor(size):
+    data = bytes((i * 37 + 11) % 256 for i in range(size))
+    expected = 0x75
+    for byte in data:
+        expected ^= byte
+    assert xor_checksum(data, 0x75) == expected
+
+
+def test_batch_encode_decode():
+    packets = [
+        QLPPacket(b'\xcd\xab\x00\x00' + CommandID.FILL + bytes([i, i, i]), PacketType.CONTROL, packet_id=i)
+        for i in range(10)
+    ] + [QLPPacket(b'ABH', PacketType.DISCOVERY)]
+    encoded = QLPPacket.encode_many(packets)
+    assert [bytes(view) for view in encoded] == [packet.serialize() for packet in packets]
+    decoded = QLPPacket.decode_many(encoded)
+    assert [packet.data for packet in decoded] == [packet.data for packet in packets]
+    assert [packet.packet_id for packet in decoded] == [packet.packet_id for packet in packets]
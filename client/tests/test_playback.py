@@ -0,0 +1,40 @@
+import pytest
+
+from emulator import NetworkConditions, QLSCEmulator
+from models.playback import ClockEstimate, QLSCSyncPlayback
+
+
+def test_clock_offset_is_half_of_the_fastest_round_trip():
+    clock = ClockEstimate()
+    assert clock.offset is None
+    for sent, received in ((0.0, 0.04), (1.0, 1.02), (2.0, 2.03)):
+        clock.add(sent, received)
+    assert clock.offset == pytest.approx(0.01)
+    assert clock.jitter == pytest.approx(0.005)
+
+
+@pytest.mark.asyncio
+async def test_frames_are_played_in_sync_on_devices_with_different_latency(engine):
+    async with QLSCEmulator(3, length=4) as emulator:
+        emulator.controllers[0].conditions = NetworkConditions(latency=0.03)
+        await engine.discover_all_devices(timeout=0.1, addresses=emulator.addresses)
+        devices = [engine.devices.by_chip_id(f'{controller.chip_id:08X}') for controller in emulator.controllers]
+        for device in devices:
+            await device.set_length(4)
+        playback = QLSCSyncPlayback(devices, fps=20)
+        offsets = await playback.calibrate()
+        assert offsets[devices[0].device_chip_id] == pytest.approx(0.015, abs=0.005)
+        assert offsets[devices[1].device_chip_id] < 0.005
+        assert playback.lead > offsets[devices[0].device_chip_id]
+
+        frames = [{device: bytes([i]) * 12 for device in devices} for i in range(10)]
+        await playback.play(frames)
+        for controller in emulator.controllers:
+            assert controller.pixels == bytes([9]) * 12
+        report = playback.report()
+        for device in devices:
+            stats = report[device.device_chip_id]
+            assert stats['frames'] == 10
+            assert stats['lost'] == 0
+        assert report['spread']['frames'] > 0
+        assert report['spread']['worst'] < 1 / 60
@@ -0,0 +1,66 @@
+from models.device import QLSCDevice
+from models.packet import QLP_PORT
+from models.registry import QLSCDeviceRegistry
+
+
+def test_rediscovered_device_is_deduplicated():
+    registry = QLSCDeviceRegistry()
+    first = registry.upsert(('10.0.0.2', QLP_PORT), '0000ABCD', '12345678', 'Strip')
+    second = registry.upsert(('10.0.0.2', QLP_PORT), '0000ABCD', '12345678', 'Strip')
+    assert first is second
+    assert len(registry) == 1
+    assert registry.generation == 1
+
+
+def test_ip_change_is_tracked():
+    registry = QLSCDeviceRegistry()
+    device = registry.upsert(('10.0.0.2', QLP_PORT), '0000ABCD', '12345678', 'Strip')
+    registry.upsert(('10.0.0.3', QLP_PORT), '0000ABCD', '12345678', 'Strip')
+    assert registry.by_ip('10.0.0.2') is None
+    assert registry.by_ip('10.0.0.3') is device
+    assert device.ip == '10.0.0.3'
+    assert device.generation == 1
+    assert registry.generation == 2
+
+
+def test_lookup_by_every_index():
+    registry = QLSCDeviceRegistry()
+    device = registry.add(QLSCDevice(ip='10.0.0.2', device_chip_id='0000ABCD', device_uuid='12345678', name='Strip'))
+    assert registry.by_uuid('12345678') is device
+    assert registry.by_chip_id('0000ABCD') is device
+    assert device in registry
+    registry.remove(device)
+    assert registry.by_uuid('12345678') is None
+    assert not registry
+
+
+def test_saved_devices_are_loaded(tmp_path):
+    registry = QLSCDeviceRegistry()
+    device = registry.upsert(('10.0.0.2', 52076), '0000ABCD', '12345678', 'Strip')
+    device.length = 60
+    registry.set_group(device, 3)
+    registry.save(tmp_path / 'devices.json')
+    restored = QLSCDeviceRegistry()
+    [loaded] = restored.load(tmp_path / 'devices.json')
+    assert loaded == device
+    assert (loaded.ip, loaded.port, loaded.length) == ('10.0.0.2', 52076, 60)
+    assert restored.group_members(3) == {loaded}
+
+
+def test_missing_or_corrupted_cache_is_ignored(tmp_path):
+    registry = QLSCDeviceRegistry()
+    assert not registry.load(tmp_path / 'devices.json')
+    (tmp_path / 'devices.json').write_text('[{"ip": 1}]')
+    assert not registry.load(tmp_path / 'devices.json')
+
+
+def test_loaded_group_is_applied_to_known_device(tmp_path):
+    registry = QLSCDeviceRegistry()
+    device = registry.upsert(('10.0.0.2', QLP_PORT), '0000ABCD', '12345678', 'Strip')
+    registry.set_group(device, 3)
+    registry.save(tmp_path / 'devices.json')
+    registry.set_group(device, 5)
+    assert registry.load(tmp_path / 'devices.json') == [device]
+    assert device.multicast_group == 3
+    assert registry.group_members(3) == {device}
+    assert not registry.group_members(5)
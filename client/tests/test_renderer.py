@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from models.color import Color
+from models.color_array import ColorArray
+from models.device import QLSCDevice
+from models.renderer import QLSCRenderer
+from utils.effects import Chase, Fade, GradientSweep, Noise, Rainbow
+
+
+def _devices(*lengths):
+    return [
+        QLSCDevice(ip='127.0.0.1', device_chip_id=f'0000B{index:03X}', device_uuid='render', name='Test', length=length)
+        for index, length in enumerate(lengths)
+    ]
+
+
+def test_rainbow_matches_hsv_wheel():
+    devices = _devices(8, 4)
+    renderer = QLSCRenderer(devices)
+    renderer.assign(Rainbow(speed=0.5), devices)
+    frames = renderer.frames(0.0)
+    assert frames[devices[0]] == bytes(ColorArray.from_hsv(np.arange(8) * 32))
+    assert frames[devices[1]] == bytes(ColorArray.from_hsv(np.arange(4) * 64))
+    # Half a cycle later the wheel is turned by half
+    assert renderer.frames(1.0)[devices[1]][:3] == bytes(ColorArray.from_hsv(np.array([128])))
+
+
+def test_per_strip_parameters_and_reassignment():
+    devices = _devices(4, 4, 4)
+    renderer = QLSCRenderer(devices)
+    renderer.assign(Fade(Color(0, 0, 0), np.array([[255, 0, 0], [0, 255, 0]]), period=2.0), devices[:2])
+    renderer.assign(Chase(Color(0, 0, 255), speed=1.0, width=1.0, tail=1.0), devices[2:])
+    frames = renderer.frames(1.0)
+    assert frames[devices[0]] == b'\xff\x00\x00' * 4
+    assert frames[devices[1]] == b'\x00\xff\x00' * 4
+    assert frames[devices[2]] == b'\x00\x00\x80' + b'\x00\x00\xff' + bytes(6)
+
+    renderer.assign(GradientSweep(Color(0, 0, 0), Color(200, 200, 200), speed=0.0), devices)
+    frames = renderer.frames(0.0)
+    assert len(set(frames.values())) == 1
+    assert frames[devices[0]] == bytes([0] * 3 + [100] * 3 + [200] * 3 + [100] * 3)
+    with pytest.raises(ValueError):
+        renderer.assign(Rainbow(), devices[2:])
+
+
+def test_noise_is_smooth_and_differs_between_strips():
+    devices = _devices(60, 60)
+    renderer = QLSCRenderer(devices)
+    renderer.assign(Noise(Color(255, 255, 255), scale=0.05), devices)
+    canvas = renderer.render(0.5).astype(int)
+    assert np.abs(np.diff(canvas[0, :, 0])).max() < 40
+    assert not np.array_equal(canvas[0], canvas[1])
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from enums.commands import CommandID
+from enums.packet_type import PacketType
+from enums.priority import Priority
+from models.channel import QLPDeviceChannel
+from models.packet import QLPPacket
+from models.scheduler import QLPScheduler
+
+
+def enqueue(channel: QLPDeviceChannel, command_id: CommandID, priority: Priority, payload: bytes = b''):
+    packet = QLPPacket(b'\x01\x00\x00\x00' + command_id + payload, PacketType.CONTROL)
+    channel.enqueue(packet, asyncio.get_running_loop().create_future(), priority)
+
+
+def drain(scheduler: QLPScheduler, channels: list[QLPDeviceChannel]) -> list[tuple[int, CommandID]]:
+    order = []
+    while (ready := scheduler.next()) is not None:
+        channel, queued = ready
+        order.append((channels.index(channel), queued.packet.command_id))
+    return order
+
+
+@pytest.mark.asyncio
+async def test_devices_take_turns():
+    scheduler = QLPScheduler(max_in_flight=100)
+    chatty, quiet = QLPDeviceChannel(8), QLPDeviceChannel(8)
+    for i in range(4):
+        enqueue(chatty, CommandID.SET_LINE, Priority.BULK, bytes([i]))
+    enqueue(quiet, CommandID.SET_LINE, Priority.BULK)
+    scheduler.schedule(chatty)
+    scheduler.schedule(quiet)
+    assert [index for index, _ in drain(scheduler, [chatty, quiet])] == [0, 1, 0, 0, 0]
+
+
+@pytest.mark.asyncio
+async def test_higher_priority_goes_first_within_limits():
+    scheduler = QLPScheduler(max_in_flight=2)
+    bulk, control = QLPDeviceChannel(8), QLPDeviceChannel(8)
+    enqueue(bulk, CommandID.SET_ALL_PIXELS, Priority.BULK)
+    enqueue(bulk, CommandID.SET_LINE_IMAGE, Priority.BULK)
+    enqueue(control, CommandID.REBOOT, Priority.CONTROL)
+    scheduler.schedule(bulk)
+    scheduler.schedule(control)
+    channels = [bulk, control]
+    assert drain(scheduler, channels) == [(1, CommandID.REBOOT), (0, CommandID.SET_ALL_PIXELS)]
+    scheduler.release(control)
+    assert drain(scheduler, channels) == [(0, CommandID.SET_LINE_IMAGE)]
+
+
+@pytest.mark.asyncio
+async def test_device_order_is_kept_and_its_highest_class_counts():
+    scheduler = QLPScheduler(max_in_flight=100)
+    other, device = QLPDeviceChannel(8), QLPDeviceChannel(8)
+    enqueue(other, CommandID.SET_ALL_PIXELS, Priority.BULK)
+    enqueue(device, CommandID.SET_ALL_PIXELS, Priority.BULK)
+    enqueue(device, CommandID.SET_LINE, Priority.INTERACTIVE)
+    enqueue(device, CommandID.REBOOT, Priority.CONTROL)
+    enqueue(device, CommandID.SET_LINE_IMAGE, Priority.BULK)
+    scheduler.schedule(other)
+    scheduler.schedule(device)
+    assert drain(scheduler, [other, device]) == [
+        (1, CommandID.SET_ALL_PIXELS),
+        (1, CommandID.SET_LINE),
+        (1, CommandID.REBOOT),
+        (0, CommandID.SET_ALL_PIXELS),
+        (1, CommandID.SET_LINE_IMAGE),
+    ]
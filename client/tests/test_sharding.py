@@ -0,0 +1,80 @@
+# pylint: disable=redefined-outer-name
+
+import asyncio
+import multiprocessing
+import threading
+
+import pytest
+import pytest_asyncio
+
+from emulator import QLSCEmulator
+from engine import shard_of
+from exceptions.protocol_exceptions import QLPError
+from models.color import Color
+from models.device import QLSCDevice
+from sharding import QLPShardedEngine, _reply
+
+
+@pytest_asyncio.fixture
+async def sharded_engine():
+    engine = QLPShardedEngine(shards=2)
+    await engine.start()
+    yield engine
+    await engine.stop()
+
+
+@pytest.mark.asyncio
+async def test_devices_are_split_between_shards(sharded_engine):
+    async with QLSCEmulator(4, length=3) as emulator:
+        devices = await sharded_engine.discover_all_devices(timeout=0.3, addresses=emulator.addresses)
+        assert {device.device_chip_id for device in devices} == {
+            f'{controller.chip_id:08X}' for controller in emulator.controllers
+        }
+        assert {sharded_engine.shard_of(device) for device in devices} == {0, 1}
+        controllers = {f'{controller.chip_id:08X}': controller for controller in emulator.controllers}
+        device = next(iter(devices))
+        await device.fill(Color(7, 8, 9))
+        assert controllers[device.device_chip_id].pixels == b'\x07\x08\x09' * 3
+        await sharded_engine.push_frames(dict.fromkeys(devices, b'\x01' * 9))
+        assert all(controller.pixels == b'\x01' * 9 for controller in emulator.controllers)
+
+
+def test_shard_of_device():
+    assert [shard_of(f'E000000{i}', 2) for i in range(4)] == [0, 1, 0, 1]
+
+
+@pytest.mark.asyncio
+async def test_unpicklable_reply_is_sent_as_error():
+    connection, worker_connection = multiprocessing.Pipe()
+    with connection, worker_connection:
+        for result in (lambda: None, threading.Lock()):
+            task = asyncio.create_task(asyncio.sleep(0, result))
+            await task
+            _reply(worker_connection, 7, task)
+            request_id, error, value = connection.recv()
+            assert (request_id, type(error), value) == (7, QLPError, None)
+
+        async def fail():
+            raise QLPError(threading.Lock())
+
+        task = asyncio.create_task(fail())
+        await asyncio.gather(task, return_exceptions=True)
+        _reply(worker_connection, 8, task)
+        request_id, error, _ = connection.recv()
+        assert request_id == 8 and 'QLPError' in str(error)
+
+
+@pytest.mark.asyncio
+async def test_exited_shard_fails_requests_and_engine_stops():
+    engine = QLPShardedEngine(shards=2)
+    await engine.start()
+    try:
+        shard = next(process for process in multiprocessing.active_children() if process.name == 'QLP shard 1')
+        shard.kill()
+        await asyncio.get_running_loop().run_in_executor(None, shard.join)
+        with pytest.raises(QLPError, match='Shard 1 has exited'):
+            device = QLSCDevice(ip='127.0.0.1', device_chip_id='E0000001', device_uuid='00000001', name='')
+            await engine.push_frames({device: b''})
+    finally:
+        await asyncio.wait_for(engine.stop(), 3)
+    assert not any(process.name.startswith('QLP shard') for process in multiprocessing.active_children())
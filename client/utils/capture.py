@@ -0,0 +1,204 @@
+"""Binary capture of QLP datagrams and its replay
+
+Capture file is a header followed by records appended one after another:
+monotonic timestamp in nanoseconds, direction, IPv4 address and port of peer, length and datagram itself.
+Records are written through a buffered file, so capturing costs a struct pack and a memory copy per datagram.
+
+Usage: python capture.py dump traffic.qlpcap
+       python capture.py replay traffic.qlpcap --target 127.0.0.1:52075 --speed 0
+       python capture.py replay traffic.qlpcap --original-peers
+
+Without --target only datagrams to loopback peers (e.g. emulator) are replayed, so a capture of real fleet
+is not sent to its devices by mistake. --original-peers sends TX datagrams to every original peer
+"""
+import argparse
+import asyncio
+import ipaddress
+import mmap
+import socket
+import struct
+import time
+from enum import IntEnum
+from pathlib import Path
+from typing import Callable, Iterator, NamedTuple, Optional
+
+MAGIC = b'QLPCAP\x01\x00'
+# Timestamp, direction, address, port, length
+_RECORD = struct.Struct('<qB4sHH')
+_BUFFER_SIZE = 1 << 16
+_UNKNOWN_ADDRESS = bytes(4)
+
+
+class Direction(IntEnum):
+    """Whether datagram was sent or received by the engine"""
+    TX = 0
+    RX = 1
+
+
+class CapturedDatagram(NamedTuple):
+    """Record of capture, timestamp is monotonic in nanoseconds and address is the peer's one"""
+    timestamp: int
+    direction: Direction
+    address: tuple[str, int]
+    data: bytes
+
+
+class QLPCaptureWriter:
+    """Append-only capture file, existing capture is continued"""
+
+    def __init__(self, path: str | Path) -> None:
+        self.path = Path(path)
+        self._file = open(self.path, 'ab', buffering=_BUFFER_SIZE)  # pylint: disable=consider-using-with
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+        self.__addresses: dict[str, bytes] = {}
+
+    def record(self, direction: Direction, data: bytes, address: tuple[str, int]) -> None:
+        packed = self.__addresses.get(address[0])
+        if packed is None:
+            try:
+                packed = socket.inet_aton(address[0])
+            except OSError:
+                packed = _UNKNOWN_ADDRESS
+            self.__addresses[address[0]] = packed
+        self._file.write(_RECORD.pack(time.monotonic_ns(), direction, packed, address[1], len(data)))
+        self._file.write(data)
+
+    def flush(self) -> None:
+        self._file.flush()
+
+    def close(self) -> None:
+        self._file.close()
+
+    def __enter__(self) -> 'QLPCaptureWriter':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+class QLPCaptureReader:
+    """Memory-mapped capture file, records are parsed in place and only datagrams are copied out"""
+
+    def __init__(self, path: str | Path) -> None:
+        with open(path, 'rb') as file:
+            self._map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._map[:len(MAGIC)] != MAGIC:
+            self._map.close()
+            raise ValueError(f'{path} is not a QLP capture')
+
+    def __iter__(self) -> Iterator[CapturedDatagram]:
+        capture = self._map
+        offset = len(MAGIC)
+        # Incomplete record at the end is left by interrupted writer
+        while offset + _RECORD.size <= len(capture):
+            timestamp, direction, address, port, length = _RECORD.unpack_from(capture, offset)
+            offset += _RECORD.size
+            if offset + length > len(capture):
+                break
+            yield CapturedDatagram(
+                timestamp, Direction(direction), (socket.inet_ntoa(address), port), capture[offset:offset + length],
+            )
+            offset += length
+
+    def close(self) -> None:
+        self._map.close()
+
+    def __enter__(self) -> 'QLPCaptureReader':
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.close()
+
+
+Route = Callable[[CapturedDatagram], Optional[tuple[str, int]]]
+
+
+def to_original_peers(datagram: CapturedDatagram) -> Optional[tuple[str, int]]:
+    """Route TX datagrams to the peers they were sent to, real devices included"""
+    return datagram.address if datagram.direction == Direction.TX else None
+
+
+def to_loopback_peers(datagram: CapturedDatagram) -> Optional[tuple[str, int]]:
+    """Route TX datagrams only to peers on this host, e.g. emulator ports"""
+    address = to_original_peers(datagram)
+    return address if address is not None and ipaddress.ip_address(address[0]).is_loopback else None
+
+
+class QLPReplayer:  # pylint: disable=too-few-public-methods
+    """Sends captured datagrams again, with original timing scaled by speed or as fast as possible with speed 0
+
+    Route maps datagram to its new destination, None skips it. By default TX datagrams go to their original
+    peers only if those are on this host, e.g. emulator ports, so real devices are not commanded by replay;
+    RX datagrams are skipped. Sending RX datagrams to engine's port replays devices' side of traffic against
+    the engine
+    """
+    # Datagrams sent between yields to event loop in fast replay, so receivers on the same loop keep up
+    BATCH = 256
+
+    def __init__(self, path: str | Path, speed: float = 1.0, route: Optional[Route] = None) -> None:
+        self.path = path
+        self.speed = speed
+        self.route = route or to_loopback_peers
+
+    async def replay(self) -> int:
+        """Send datagrams, returns amount of sent ones"""
+        loop = asyncio.get_running_loop()
+        transport, _ = await loop.create_datagram_endpoint(
+            asyncio.DatagramProtocol, local_addr=('0.0.0.0', 0), allow_broadcast=True,
+        )
+        sent = 0
+        started = loop.time()
+        first: Optional[int] = None
+        try:
+            with QLPCaptureReader(self.path) as reader:
+                for datagram in reader:
+                    destination = self.route(datagram)
+                    if destination is None:
+                        continue
+                    if first is None:
+                        first = datagram.timestamp
+                    if self.speed:
+                        delay = started + (datagram.timestamp - first) / 1e9 / self.speed - loop.time()
+                        if delay > 0:
+                            await asyncio.sleep(delay)
+                    elif sent % self.BATCH == self.BATCH - 1:
+                        await asyncio.sleep(0)
+                    transport.sendto(datagram.data, destination)
+                    sent += 1
+        finally:
+            transport.close()
+        return sent
+
+
+def _address(value: str) -> tuple[str, int]:
+    host, port = value.rsplit(':', 1)
+    return host, int(port)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('command', choices=('dump', 'replay'))
+    parser.add_argument('path')
+    parser.add_argument('--target', type=_address, help='send every TX datagram to host:port instead of its peer')
+    parser.add_argument(
+        '--original-peers', action='store_true', help='send TX datagrams to their peers even if those are not local',
+    )
+    parser.add_argument('--speed', type=float, default=1.0, help='timing scale, 0 to send as fast as possible')
+    args = parser.parse_args()
+    if args.command == 'dump':
+        with QLPCaptureReader(args.path) as reader:
+            for timestamp, direction, (host, port), data in reader:
+                print(f'{timestamp / 1e9:.6f} {direction.name} {host}:{port} {data.hex(" ").upper()}')
+        return
+
+    def to_target(datagram: CapturedDatagram) -> Optional[tuple[str, int]]:
+        return args.target if datagram.direction == Direction.TX else None
+
+    route = to_target if args.target else to_original_peers if args.original_peers else to_loopback_peers
+    sent = asyncio.run(QLPReplayer(args.path, args.speed, route).replay())
+    print(f'{sent} datagrams were sent')
+
+
+if __name__ == '__main__':
+    main()
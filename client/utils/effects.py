@@ -0,0 +1,153 @@
+"""Parametrized effects evaluated for many strips at once
+
+Effect is rendered for a batch of strips as a single (strips, pixels, 3) array. Every parameter is either
+a scalar shared by the batch or an array with a value per strip, so differently tuned strips are still
+one kernel call.
+"""
+import abc
+import math
+
+import numpy as np
+
+from models.color import Color
+from models.color_array import hsv_to_rgb
+
+ColorParameter = Color | np.ndarray
+Parameter = float | np.ndarray
+
+
+def _column(value: Parameter, strips: int) -> np.ndarray:
+    """Parameter as (strips, 1) array broadcastable over pixels"""
+    return np.broadcast_to(np.asarray(value, dtype=np.float64).reshape(-1, 1), (strips, 1))
+
+
+def _colors(value: ColorParameter, strips: int) -> np.ndarray:
+    """Color parameter as (strips, 1, 3) array broadcastable over pixels"""
+    if isinstance(value, Color):
+        value = np.array((value.red, value.green, value.blue))
+    return np.broadcast_to(np.asarray(value, dtype=np.float64).reshape(-1, 1, 3), (strips, 1, 3))
+
+
+# pylint: disable=too-few-public-methods
+class Effect(abc.ABC):
+    """Effect rendered by host for a batch of strips"""
+
+    @abc.abstractmethod
+    def render(self, time: float, positions: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        """Colors at time in seconds, (strips, pixels, 3) array with channels 0-255
+
+        positions is (1, pixels) array of pixel indices, lengths is (strips, 1) array of strip lengths
+        """
+
+
+class Rainbow(Effect):
+    """Hue wheel moving along strip, speed in cycles per second, scale in cycles per strip
+
+    Hue has 256 steps like Color.from_HSV, so colors are looked up instead of converted
+    """
+    _WHEEL = hsv_to_rgb(np.arange(256), np.full(256, 255), np.full(256, 255))
+
+    def __init__(self, speed: Parameter = 0.25, scale: Parameter = 1.0, shift: Parameter = 0.0) -> None:
+        self.speed = speed
+        self.scale = scale
+        self.shift = shift
+
+    def render(self, time: float, positions: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        strips = len(lengths)
+        cycles = positions * _column(self.scale, strips) / lengths + time * _column(self.speed, strips)
+        hue = ((cycles + _column(self.shift, strips)) % 1 * 256).astype(np.uint8)
+        return self._WHEEL[hue]
+
+
+class Chase(Effect):
+    """Segment of width pixels running along strip with fading tail, speed in pixels per second"""
+
+    def __init__(
+            self, color: ColorParameter, speed: Parameter = 30.0, width: Parameter = 3.0, tail: Parameter = 10.0,
+    ) -> None:
+        self.color = color
+        self.speed = speed
+        self.width = width
+        self.tail = tail
+
+    def render(self, time: float, positions: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        strips = len(lengths)
+        head = time * _column(self.speed, strips) % lengths
+        # Distance behind the head, wrapping around strip end
+        behind = (head - positions) % lengths
+        width = _column(self.width, strips)
+        # Tail pixels get darker in equal steps
+        tail = _column(self.tail, strips) + 1
+        intensity = np.where(behind < width, 1.0, np.clip(1 - (behind - width + 1) / tail, 0, 1))
+        return intensity[..., np.newaxis] * _colors(self.color, strips)
+
+
+class GradientSweep(Effect):
+    """Gradient between two colors sliding along strip and back, speed in cycles per second"""
+
+    def __init__(self, start: ColorParameter, end: ColorParameter, speed: Parameter = 0.5) -> None:
+        self.start = start
+        self.end = end
+        self.speed = speed
+
+    def render(self, time: float, positions: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        strips = len(lengths)
+        phase = (positions / lengths + time * _column(self.speed, strips)) % 1
+        # Triangle wave, so gradient has no seam at strip end
+        mix = (1 - np.abs(2 * phase - 1))[..., np.newaxis]
+        start = _colors(self.start, strips)
+        return start + (_colors(self.end, strips) - start) * mix
+
+
+class Noise(Effect):
+    """Smooth value noise modulating brightness of color, every strip gets its own pattern
+
+    speed is lattice cells per second, scale is lattice cells per pixel
+    """
+
+    def __init__(
+            self, color: ColorParameter, speed: Parameter = 2.0, scale: Parameter = 0.1, seed: int = 0,
+    ) -> None:
+        self.color = color
+        self.speed = speed
+        self.scale = scale
+        self.seed = seed
+
+    @staticmethod
+    def _hash(cells: np.ndarray) -> np.ndarray:
+        """Pseudo-random value 0-1 of every integer lattice cell"""
+        value = cells.astype(np.uint32) * np.uint32(0x9E3779B1)
+        value ^= value >> np.uint32(15)
+        value *= np.uint32(0x85EBCA77)
+        value ^= value >> np.uint32(13)
+        return value.astype(np.float32) / np.float32(2 ** 32)
+
+    def render(self, time: float, positions: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        strips = len(lengths)
+        # Strips are placed far from each other on the lattice
+        offsets = (np.arange(strips, dtype=np.float64) * 4096 + self.seed * 65536).reshape(-1, 1)
+        coordinate = positions * _column(self.scale, strips) + time * _column(self.speed, strips) + offsets
+        cell = np.floor(coordinate)
+        fraction = coordinate - cell
+        smooth = fraction * fraction * (3 - 2 * fraction)
+        cell = cell.astype(np.int64)
+        left, right = self._hash(cell), self._hash(cell + 1)
+        intensity = left + (right - left) * smooth
+        return intensity[..., np.newaxis] * _colors(self.color, strips)
+
+
+class Fade(Effect):
+    """Whole strip fading between two colors and back, period in seconds"""
+
+    def __init__(self, start: ColorParameter, end: ColorParameter, period: Parameter = 2.0) -> None:
+        self.start = start
+        self.end = end
+        self.period = period
+
+    def render(self, time: float, positions: np.ndarray, lengths: np.ndarray) -> np.ndarray:
+        strips = len(lengths)
+        mix = (0.5 - 0.5 * np.cos(2 * math.pi * time / _column(self.period, strips)))[..., np.newaxis]
+        start = _colors(self.start, strips)
+        return np.broadcast_to(
+            start + (_colors(self.end, strips) - start) * mix, (strips, positions.shape[1], 3),
+        )
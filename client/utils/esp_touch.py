@@ -1,275 +1,163 @@
-# Source: https://github.com/KurdyMalloy/EsptouchPython
-# pylint: disable=all
-
-import socket
-import time
-
-__author__="Jean-Michel Julien"
-__version__="0.1.0"
-
-ipBytes = None
-ssidBytes = None
-bssidBytes = None
-passwordBytes = None
-data = None
-dataToSend = []
-
-addressCount = 0
-useBroadcast = False
-sendBuffer = bytearray(600)
-
-
-def getClientSocket():
-    global useBroadcast
-    sock = socket.socket(socket.AF_INET, # Internet
-                 socket.SOCK_DGRAM) # UDP
-    if useBroadcast:
-        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-    return sock
-
-
-def sendPacket(_socket, _destination, _size):
-    if isinstance(_socket, socket.socket) is not True:
-        raise ValueError("sendPacket error invalid socket object")
-
-    global sendBuffer
-#    print("{}  Sending {} bytes to {}".format(time.monotonic(), len(sendBuffer[0:_size]), _destination))
-    _socket.sendto(sendBuffer[0:_size], _destination)
-
-
-def getNextTargetAddress():
-    global useBroadcast
-    global addressCount
-
-    if useBroadcast:
-        return ("255.255.255.255", 7001)
-    else:
-        addressCount += 1
-        multicastAddress = "234.{}.{}.{}".format(addressCount, addressCount, addressCount)
-        addressCount %= 100
-        return (multicastAddress, 7001)
-
-
-def AddToCRC(b, crc):
-    if (b < 0):
-        b += 256
-    for i in range(8):
-        odd = ((b^crc) & 1) == 1
-        crc >>= 1
-        b >>= 1
-        if (odd):
-            crc ^= 0x8C # this means crc ^= 140
+# ESP-Touch (SmartConfig) provisioning, based on https://github.com/KurdyMalloy/EsptouchPython
+#
+# Wi-Fi credentials are not sent as content but as lengths of UDP datagrams, which the device
+# sniffs from the air while it is not connected to any network yet.
+import argparse
+import asyncio
+import logging
+from typing import Optional
+
+logger = logging.getLogger('ESPTouch')
+
+ESP_TOUCH_PORT = 7001
+GUIDE_CODE = (515, 514, 513, 512)
+# Guide code is sent for 2 seconds, then data code for 4 seconds, every datagram after 8 ms
+GUIDE_DURATION = 2.0
+DATA_DURATION = 4.0
+PACKET_INTERVAL = 0.008
+# Datagrams are slices of it, content does not matter
+_PAYLOAD = memoryview(bytes(max(GUIDE_CODE) + 1))
+
+
+def _crc8_table() -> tuple[int, ...]:
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x8C if crc & 1 else crc >> 1
+        table.append(crc)
+    return tuple(table)
+
+
+_CRC8_TABLE = _crc8_table()
+
+
+def crc8(data: bytes, crc: int = 0) -> int:
+    """CRC-8/MAXIM used by ESP-Touch"""
+    for byte in data:
+        crc = _CRC8_TABLE[crc ^ byte]
     return crc
 
 
-# one data format:(data code should have 2 to 65 data)
-# 
-#              control byte       high 4 bits    low 4 bits
-# 1st 9bits:       0x0             crc(high)      data(high)
-# 2nd 9bits:       0x1                sequence header
-# 3rd 9bits:       0x0             crc(low)       data(low)
-# 
-def encodeDataByte(dataByte, sequenceHeader):
-    if sequenceHeader > 127 :
-        raise ValueError('sequenceHeader must be between 0 and 127')
-    # calculate the crc
-    crc = 0
-    crc = AddToCRC(dataByte, crc)
-    crc = AddToCRC(sequenceHeader, crc)
-
-    # split in nibbles
-    crc_high, crc_low = crc >> 4, crc & 0x0F
-    data_high, data_low = bytes([dataByte])[0] >> 4, bytes([dataByte])[0] & 0x0F
-
-    # reassemble high with high , low with low and add 40
-    first = ((crc_high << 4) | data_high) + 40
-    # second ninth bit must be set (256 + 40)
-    second = 296 + sequenceHeader
-    third = ((crc_low << 4) | data_low) + 40
-
-    return (first, second, third)
-
-
-def getGuideCode():
-    return (515, 514, 513, 512)
-
-
-def getDatumCode():
-    global ssidBytes
-    global bssidBytes
-    global passwordBytes
-    global data
-
-    totalDataLength = 5 + len(data)
-    passwordLength = len(passwordBytes)
-    ssidCrc = 0
-    for b in ssidBytes:
-        ssidCrc = AddToCRC(b, ssidCrc)
-    bssidCrc = 0
-    for b in bssidBytes:
-        bssidCrc = AddToCRC(b, bssidCrc)
-
-    totalXor = 0
-    totalXor ^= totalDataLength
-    totalXor ^= passwordLength
-    totalXor ^= ssidCrc
-    totalXor ^= bssidCrc
-
-    for b in data:
-        totalXor ^= b
-
-    return (totalDataLength, passwordLength, ssidCrc, bssidCrc, totalXor)
-
-
-def getDataCode():
-    return (data)
-
-
-def prepareDataToSend():
-    global dataToSend
-    global bssidBytes
-
-    # human readable data in the console in pack of three bytes
-#    i = 0
-#    for b in getDatumCode():
-#        print(encodeDataByte(b, i))
-#        i += 1
-#    
-#    iBssid = len(getDatumCode()) + len(getDataCode())
-#    bssidLength = len(bssidBytes)
-#    indexBssid = 0
-#    indexData = 0
-#    for b in getDataCode():
-#        # add a byte of the bssid every 4 bytes
-#        if (indexData % 4) == 0 and indexBssid < bssidLength:
-#            print(encodeDataByte(bssidBytes[indexBssid], iBssid))
-#            iBssid += 1
-#            indexBssid += 1
-#        print(encodeDataByte(b, i))
-#        i += 1
-#        indexData += 1
-#    while indexBssid < bssidLength:
-#        print(encodeDataByte(bssidBytes[indexBssid], iBssid))
-#        iBssid += 1
-#        indexBssid += 1
-
-    # The data
-    i = 0
-    for d in getDatumCode():
-        for b in encodeDataByte(d, i):
-            dataToSend += [b]
-        i += 1
-
-    iBssid = len(getDatumCode()) + len(getDataCode())
-    bssidLength = len(bssidBytes)
-    indexBssid = 0
-    indexData = 0
-    for d in getDataCode():
-        # add a byte of the bssid every 4 bytes
-        if (indexData % 4) == 0 and indexBssid < bssidLength:
-            for b in encodeDataByte(bssidBytes[indexBssid], iBssid):
-                dataToSend += [b]
-            iBssid += 1
-            indexBssid += 1
-        for b in encodeDataByte(d, i):
-            dataToSend += [b]
-        i += 1
-        indexData += 1
-    while indexBssid < bssidLength:
-        for b in encodeDataByte(bssidBytes[indexBssid], iBssid):
-            dataToSend += [b]
-        iBssid += 1
-        indexBssid += 1
-
-
-def sendGuideCode():
-    index = 0
-    destination = getNextTargetAddress()
-    # run for 2 sec send packet every 8 msec
-    nexttime = now = time.monotonic()
-    endtime = now + 2
-    while now < endtime or index != 0:
-        now = time.monotonic()
-        if now > nexttime:
-            sendPacket(getClientSocket(), destination, getGuideCode()[index]) 
-            nexttime = now + 0.008
-            index += 1
-            if index > 3:
-                destination = getNextTargetAddress()
-            index %= 4
-
-
-def sendDataCode():
-    global dataToSend
-    index = 0
-    destination = getNextTargetAddress()
-    # run for 4 sec send packet every 8 msec
-    nexttime = now = time.monotonic()
-    endtime = now + 4
-    while now < endtime or index != 0:
-        now = time.monotonic()
-        if now > nexttime:
-            sendPacket(getClientSocket(), destination, dataToSend[index]) 
-            nexttime = now + 0.008
-            index += 1
-            if (index % 3) == 0:
-                destination = getNextTargetAddress()
-            index %= len(dataToSend)
-
-
-def sendData():
-#    print("DATUM: ", getDatumCode())
-#    print("GUIDE: ", getGuideCode())
-    prepareDataToSend()
-    print("Sending data...")
-    sendGuideCode()
-    sendDataCode()
-    print("Done!")
-
-
-def init(_ssid, _password, _broadcast, _ip, _bssid):
-    global ssidBytes
-    global ipBytes
-    global bssidBytes
-    global passwordBytes
-    global useBroadcast
-    global data
-
-    if _bssid:
-        bssidBytes = bytes.fromhex(_bssid)
-    else:
-        bssidBytes = bytes()
-
-    ssidBytes = bytes(_ssid.encode())
-    passwordBytes = bytes(_password.encode())
-    ipBytes = bytes(map(int, _ip.split('.')))
-
-    useBroadcast = _broadcast[0] == 'T' or _broadcast[0] == 't'
-
-    if len(ipBytes) != 4:
-        raise ValueError("IP address invalid")
-
-    # Data is ip (4 bytes) + password 
-    data = ipBytes + passwordBytes
-
-    # + ssid if hidden but this is not enforced on Android..... so we always include it as well
-    data += ssidBytes
-
-#    print("DATA length", len(data))
-#    print("DATA-->", ":".join("{:02x}".format(c) for c in data))
-#    print("bssid-->", ":".join("{:02x}".format(c) for c in bssidBytes))
-#    print("ssid-->", ":".join("{:02x}".format(c) for c in ssidBytes))
-#    print("Broadcast--> {}".format(useBroadcast))
-
-
-if __name__ == "__main__":
-    import sys
-    if len(sys.argv) > 5:
-        init(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4], sys.argv[5])
-        sendData()
-    elif len(sys.argv) > 4:
-        init(sys.argv[1], sys.argv[2], sys.argv[3], sys.argv[4], None)
-        sendData()
-    else:
-        print("Usage : ESPTouch.py [ssid] [password] [broadcast T/F] [returnIP] [bssid]")
-        pass
+def encode_data_byte(byte: int, sequence: int) -> tuple[int, int, int]:
+    """Three datagram lengths carrying one byte: crc and data high nibbles, sequence number, low nibbles
+
+    crc(high) data(high) + 40
+    sequence + 256 + 40
+    crc(low) data(low) + 40
+    """
+    if not 0 <= sequence < 128:
+        raise ValueError('Sequence must be between 0 and 127')
+    crc = crc8(bytes((byte, sequence)))
+    return (
+        (crc & 0xF0 | byte >> 4) + 40,
+        296 + sequence,
+        ((crc & 0x0F) << 4 | byte & 0x0F) + 40,
+    )
+
+
+class ESPTouchSession:
+    """Provisioning of one Wi-Fi network's credentials to every device which listens for them
+
+    Codes are encoded once, sending is paced by event loop, so normal traffic is not blocked.
+    Sessions for several networks can run at the same time
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+            self,
+            ssid: str,
+            password: str,
+            ip: str = '255.255.255.255',  # pylint: disable=invalid-name
+            bssid: Optional[str] = None,
+            broadcast: bool = True,
+    ) -> None:
+        ip_bytes = bytes(map(int, ip.split('.')))
+        if len(ip_bytes) != 4:
+            raise ValueError('IP address invalid')
+        self.broadcast = broadcast
+        self.data_code = self.encode(ssid.encode(), password.encode(), ip_bytes, bytes.fromhex(bssid or ''))
+        self.__multicast_counter = 0
+
+    @staticmethod
+    def encode(
+            ssid: bytes, password: bytes, ip: bytes, bssid: bytes,  # pylint: disable=invalid-name
+    ) -> tuple[int, ...]:
+        """Datagram lengths of data code: datum (lengths and checksums) followed by data with interleaved bssid"""
+        # Ssid is always included, as if network were hidden
+        data = ip + password + ssid
+        datum = [5 + len(data), len(password), crc8(ssid), crc8(bssid)]
+        total_xor = 0
+        for byte in datum + list(data):
+            total_xor ^= byte
+        datum.append(total_xor)
+
+        code: list[int] = []
+        for sequence, byte in enumerate(datum):
+            code.extend(encode_data_byte(byte, sequence))
+        bssid_sequence = len(datum) + len(data)
+        bssid_index = 0
+        for index, byte in enumerate(data):
+            # Byte of bssid every 4 bytes of data
+            if index % 4 == 0 and bssid_index < len(bssid):
+                code.extend(encode_data_byte(bssid[bssid_index], bssid_sequence + bssid_index))
+                bssid_index += 1
+            code.extend(encode_data_byte(byte, len(datum) + index))
+        for bssid_index in range(bssid_index, len(bssid)):
+            code.extend(encode_data_byte(bssid[bssid_index], bssid_sequence + bssid_index))
+        return tuple(code)
+
+    def __destination(self) -> tuple[str, int]:
+        if self.broadcast:
+            return '255.255.255.255', ESP_TOUCH_PORT
+        self.__multicast_counter = self.__multicast_counter % 100 + 1
+        return f'234.{self.__multicast_counter}.{self.__multicast_counter}.{self.__multicast_counter}', ESP_TOUCH_PORT
+
+    async def __send_code(
+            self, transport: asyncio.DatagramTransport, code: tuple[int, ...], group: int, duration: float,
+    ) -> None:
+        """Repeat code for duration, whole code is always sent. Destination changes every group datagrams"""
+        loop = asyncio.get_running_loop()
+        end = loop.time() + duration
+        next_send = loop.time()
+        while loop.time() < end:
+            destination = self.__destination()
+            for index, length in enumerate(code):
+                if index and index % group == 0:
+                    destination = self.__destination()
+                transport.sendto(_PAYLOAD[:length], destination)
+                next_send += PACKET_INTERVAL
+                await asyncio.sleep(max(next_send - loop.time(), 0))
+
+    async def run(self, rounds: Optional[int] = None) -> None:
+        """Send guide and data codes in turn, rounds times or until cancelled"""
+        transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            asyncio.DatagramProtocol, local_addr=('0.0.0.0', 0), allow_broadcast=self.broadcast,
+        )
+        logger.info('Sending Wi-Fi credentials...')
+        try:
+            sent = 0
+            while rounds is None or sent < rounds:
+                await self.__send_code(transport, GUIDE_CODE, len(GUIDE_CODE), GUIDE_DURATION)
+                await self.__send_code(transport, self.data_code, 3, DATA_DURATION)
+                sent += 1
+        finally:
+            transport.close()
+            logger.info('Sending Wi-Fi credentials was finished')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Send Wi-Fi credentials to devices waiting for ESP-Touch')
+    parser.add_argument('ssid')
+    parser.add_argument('password')
+    parser.add_argument('--bssid', help='Access point MAC address as hex string')
+    parser.add_argument('--ip', default='255.255.255.255', help='Address device reports to after connecting')
+    parser.add_argument('--multicast', action='store_true', help='Send to multicast addresses instead of broadcast')
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    session = ESPTouchSession(args.ssid, args.password, args.ip, args.bssid, broadcast=not args.multicast)
+    asyncio.run(session.run(args.rounds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,265 @@
+"""Planner choosing the cheapest set of commands which turns strip's frame into another one
+
+Commands coordinates are little-endian 2-byte pixel indexes, line and gradient end is exclusive.
+Gradient interpolates every channel linearly from start color at first pixel to end color at last pixel.
+With tolerance pixels may differ from the frame by that much per channel, so smooth frames are approximated
+with a few gradients.
+"""
+from collections import Counter, deque
+from typing import Optional
+
+import numpy as np
+
+from enums.commands import CommandID
+from models.packet import CONTROL_PACKET_OVERHEAD, MAX_DATAGRAM_SIZE
+
+# Airtime cost of one more packet compared to one more byte: UDP/IP and QLP headers plus Wi-Fi frame overhead
+PACKET_COST = 64
+# SET_LINE_IMAGE length is one byte
+MAX_LINE_IMAGE_PIXELS = min(255, (MAX_DATAGRAM_SIZE - CONTROL_PACKET_OVERHEAD - 3) // 3)
+# Longest approximating gradient, it bounds memory of the search to (pixels, MAX_GRADIENT_PIXELS, 3) arrays
+MAX_GRADIENT_PIXELS = 256
+
+Command = tuple[CommandID, bytes]
+
+
+def _index(index: int) -> bytes:
+    return index.to_bytes(2, 'little', signed=False)
+
+
+def apply_command(frame: bytearray, command_id: CommandID, data: bytes) -> None:
+    """Apply drawing command to raw RGB frame the same way as device does"""
+    if command_id == CommandID.FILL:
+        frame[:] = data[:3] * (len(frame) // 3)
+    elif command_id == CommandID.SET_ALL_PIXELS:
+        frame[:len(data)] = data
+    elif command_id == CommandID.SET_PIXEL:
+        index = int.from_bytes(data[:2], 'little')
+        frame[index * 3:index * 3 + 3] = data[2:5]
+    elif command_id == CommandID.SET_LINE:
+        start, end = int.from_bytes(data[:2], 'little'), int.from_bytes(data[2:4], 'little')
+        frame[start * 3:end * 3] = data[4:7] * (end - start)
+    elif command_id == CommandID.SET_LINE_IMAGE:
+        start, length = int.from_bytes(data[:2], 'little'), data[2]
+        frame[start * 3:(start + length) * 3] = data[3:3 + length * 3]
+    elif command_id == CommandID.SET_GRADIENT:
+        start, end = int.from_bytes(data[:2], 'little'), int.from_bytes(data[2:4], 'little')
+        span = max(end - start - 1, 1)
+        for index in range(start, end):
+            for channel in range(3):
+                begin = data[4 + channel]
+                frame[index * 3 + channel] = begin + round((data[7 + channel] - begin) * (index - start) / span)
+
+
+class _ApproximatingGradients:
+    """Gradients starting at pixels with their exact color and staying within tolerance of the frame
+
+    Line from start pixel is feasible while its slope fits between bounds set by every next pixel.
+    Bounds only get narrower, so feasible gradients from a pixel end anywhere up to its reach.
+    Reach is searched only for pixels which are going to be set, all of them are extended block by block
+    until none of them can be. Blocks grow from FIRST_BLOCK to BLOCK, so gradients of noisy frames
+    are ended early. One is subtracted from tolerance for rounding of end color and of device's interpolation
+    """
+    # Distances checked at once for all gradients being extended
+    FIRST_BLOCK = 4
+    BLOCK = 32
+
+    def __init__(self, frame: bytes, tolerance: int) -> None:
+        self.colors = np.frombuffer(frame, dtype=np.uint8).reshape(-1, 3).astype(np.float32)
+        margin = tolerance - 1
+        self.lower = np.maximum(self.colors - margin, 0)
+        self.upper = np.minimum(self.colors + margin, 255)
+        # Exclusive end of the longest feasible gradient from every pixel, 0 until it is searched for
+        self.__reach = np.zeros(len(self.colors), dtype=np.int64)
+        self.reach: list[int] = self.__reach.tolist()
+
+    def search(self, starts: list[bool]) -> None:  # pylint: disable=too-many-locals
+        """Find reach of gradients from pixels marked in starts, the ones found before are kept"""
+        active = np.flatnonzero(np.array(starts) & (self.__reach == 0))
+        if not active.size:
+            return
+        count = len(self.colors)
+        reach = active + 1
+        # Slope bounds of gradients which are still extended, rows follow extending. Channels go first,
+        # so bounds are accumulated along contiguous distances
+        extending = np.arange(len(active))
+        start = self.colors.T[:, active, np.newaxis]
+        low = np.full((3, len(active), 1), -np.inf, dtype=np.float32)
+        high = np.full((3, len(active), 1), np.inf, dtype=np.float32)
+        lower, upper = self.lower.T, self.upper.T
+        width = min(count, MAX_GRADIENT_PIXELS)
+        first, size = 1, self.FIRST_BLOCK
+        while first < width:
+            distances = np.arange(first, min(first + size, width))
+            following = active[extending].reshape(-1, 1) + distances
+            targets = np.minimum(following, count - 1)
+            scale = distances.astype(np.float32)
+            block_low = np.maximum.accumulate(np.maximum((lower[:, targets] - start) / scale, low), axis=2)
+            block_high = np.minimum.accumulate(np.minimum((upper[:, targets] - start) / scale, high), axis=2)
+            feasible = (block_low <= block_high).all(axis=0) & (following < count)
+            extended = np.where(feasible.all(axis=1), len(distances), feasible.argmin(axis=1))
+            reach[extending] += extended
+            rest = extended == len(distances)
+            if not rest.any():
+                break
+            extending, start = extending[rest], start[:, rest]
+            low, high = block_low[:, rest, -1:], block_high[:, rest, -1:]
+            first += size
+            size = min(2 * size, self.BLOCK)
+        self.__reach[active] = reach
+        self.reach = self.__reach.tolist()
+
+    def cheapest_end(self, start: int, cost: list[int]) -> Optional[tuple[int, int]]:
+        """Cost of the rest of strip and end of gradient from start which leaves the cheapest rest"""
+        if self.reach[start] <= start + 2:
+            return None
+        ends = cost[start + 2:self.reach[start] + 1]
+        best = min(ends)
+        return best, start + 2 + ends.index(best)
+
+    def end_color(self, start: int, end: int) -> bytes:
+        distance = np.arange(1, end - start, dtype=np.float32).reshape(-1, 1)
+        low = ((self.lower[start + 1:end] - self.colors[start]) / distance).max(axis=0)
+        high = ((self.upper[start + 1:end] - self.colors[start]) / distance).min(axis=0)
+        return bytes(np.rint(self.colors[start] + (low + high) / 2 * (end - start - 1)).astype(np.uint8))
+
+
+# Command covering pixels from the one it is chosen for up to end, approximated gradient is not exact
+_Choice = tuple[CommandID, int, bool]
+
+
+def _runs(colors: np.ndarray) -> tuple[list[int], list[int]]:
+    """Length of run of equal colors and of run with constant per-channel step starting at every pixel"""
+    count = len(colors)
+    positions = np.arange(count)
+    same = np.append((colors[:-1] == colors[1:]).all(axis=1), False)
+    steps = np.diff(colors.astype(np.int16), axis=0)
+    constant = np.append((steps[:-1] == steps[1:]).all(axis=1), [False, False])[:count]
+    same_run = _breaks(same, positions) - positions + 1
+    step_run = np.append(_breaks(constant, positions)[:-1] - positions[:-1] + 2, 1)
+    return same_run.tolist(), step_run.tolist()
+
+
+def _breaks(continues: np.ndarray, positions: np.ndarray) -> np.ndarray:
+    """Position of the first pixel at or after every pixel where run does not continue"""
+    return np.minimum.accumulate(np.where(continues, len(positions), positions)[::-1])[::-1]
+
+
+def _changed(colors: np.ndarray, reference: np.ndarray, tolerance: int) -> list[bool]:
+    """Whether every pixel differs from reference pixel (or color) by more than tolerance in any channel"""
+    return (np.abs(colors.astype(np.int16) - reference).max(axis=1) > tolerance).tolist()
+
+
+def _cover(  # pylint: disable=too-many-locals
+        pixels: list[bytes],
+        colors: np.ndarray,
+        changed: list[bool],
+        packet_cost: int,
+        gradients: Optional[_ApproximatingGradients] = None,
+) -> tuple[int, list[Command]]:
+    """Cheapest commands setting every changed pixel, computed backwards from the end of strip"""
+    same_run, step_run = _runs(colors)
+    if gradients is not None:
+        gradients.search(changed)
+    cost = [0] * (len(pixels) + 1)
+    choice: list[Optional[_Choice]] = [None] * (len(pixels) + 1)
+    # Sliding window minimum of cost[end] + 3 * end for SET_LINE_IMAGE ends
+    image_ends: deque[int] = deque()
+    for i in range(len(pixels) - 1, -1, -1):
+        end = i + 1
+        while image_ends and cost[image_ends[-1]] + 3 * image_ends[-1] >= cost[end] + 3 * end:
+            image_ends.pop()
+        image_ends.append(end)
+        while image_ends[0] > i + MAX_LINE_IMAGE_PIXELS:
+            image_ends.popleft()
+        if not changed[i]:
+            cost[i] = cost[i + 1]
+            continue
+        # Options are compared in order of command id, so ties are broken the same way on every run
+        best, best_choice = 5 + packet_cost + cost[i + 1], (CommandID.SET_PIXEL, i + 1, False)
+        if same_run[i] > 1 and (option := 7 + packet_cost + cost[i + same_run[i]]) < best:
+            best, best_choice = option, (CommandID.SET_LINE, i + same_run[i], False)
+        if step_run[i] > 2 and (option := 10 + packet_cost + cost[i + step_run[i]]) < best:
+            best, best_choice = option, (CommandID.SET_GRADIENT, i + step_run[i], False)
+        if gradients is not None and (approximation := gradients.cheapest_end(i, cost)) is not None \
+                and (option := 10 + packet_cost + approximation[0]) < best:
+            best, best_choice = option, (CommandID.SET_GRADIENT, approximation[1], True)
+        image_end = image_ends[0]
+        if (option := 3 + 3 * (image_end - i) + packet_cost + cost[image_end]) < best:
+            best, best_choice = option, (CommandID.SET_LINE_IMAGE, image_end, False)
+        cost[i], choice[i] = best, best_choice
+    return cost[0], _commands(pixels, choice, gradients)
+
+
+def _commands(
+        pixels: list[bytes], choice: list[Optional[_Choice]], gradients: Optional[_ApproximatingGradients],
+) -> list[Command]:
+    """Commands of chosen steps from the start of strip"""
+    commands: list[Command] = []
+    i = 0
+    while i < len(pixels):
+        step = choice[i]
+        if step is None:
+            i += 1
+            continue
+        command_id, end, approximated = step
+        if approximated:
+            assert gradients is not None
+            data = _index(i) + _index(end) + pixels[i] + gradients.end_color(i, end)
+        elif command_id == CommandID.SET_PIXEL:
+            data = _index(i) + pixels[i]
+        elif command_id == CommandID.SET_LINE:
+            data = _index(i) + _index(end) + pixels[i]
+        elif command_id == CommandID.SET_GRADIENT:
+            data = _index(i) + _index(end) + pixels[i] + pixels[end - 1]
+        else:
+            data = _index(i) + (end - i).to_bytes(1, 'little') + b''.join(pixels[i:end])
+        commands.append((command_id, data))
+        i = end
+    return commands
+
+
+def plan_frame(
+        previous: Optional[bytes], frame: bytes, packet_cost: int = PACKET_COST, tolerance: int = 0,
+) -> list[Command]:
+    """Cheapest commands turning previous frame (None if unknown) into the new one
+
+    With tolerance every channel of resulting pixels may differ from the frame by that much, previous pixels
+    within tolerance are left as they are. Commands can be sent concurrently, except FILL which is always
+    the first one and must be applied before others
+    """
+    pixels = [frame[i:i + 3] for i in range(0, len(frame), 3)]
+    if not pixels:
+        return []
+    colors = np.frombuffer(frame, dtype=np.uint8).reshape(-1, 3)
+    candidates: list[tuple[int, list[Command]]] = []
+    changed = None
+    if previous is not None and len(previous) == len(frame):
+        changed = _changed(colors, np.frombuffer(previous, dtype=np.uint8).reshape(-1, 3), tolerance)
+        if not any(changed):
+            return []
+    gradients = _ApproximatingGradients(frame, tolerance) if tolerance > 0 else None
+    if changed is not None:
+        candidates.append(_cover(pixels, colors, changed, packet_cost, gradients))
+    fill_color = Counter(pixels).most_common(1)[0][0]
+    unfilled = _changed(colors, np.frombuffer(fill_color, dtype=np.uint8), tolerance)
+    # Every command costs at least as much as SET_PIXEL, so plan starting with FILL is not searched for
+    # if it can not be cheaper than the diff
+    if not candidates or candidates[0][0] > 3 + packet_cost + (5 + packet_cost if any(unfilled) else 0):
+        fill_cost, commands = _cover(pixels, colors, unfilled, packet_cost, gradients)
+        candidates.append((3 + packet_cost + fill_cost, [(CommandID.FILL, fill_color)] + commands))
+    if CONTROL_PACKET_OVERHEAD + len(frame) <= MAX_DATAGRAM_SIZE:
+        candidates.append((len(frame) + packet_cost, [(CommandID.SET_ALL_PIXELS, frame)]))
+    return min(candidates, key=lambda candidate: candidate[0])[1]
+
+
+def plan_approximation(
+        previous: Optional[bytes], frame: bytes, tolerance: int, packet_cost: int = PACKET_COST,
+) -> tuple[list[Command], bytes]:
+    """Commands of plan_frame() with tolerance and the frame strip shows after them"""
+    commands = plan_frame(previous, frame, packet_cost, tolerance)
+    # Commands cover every pixel which is out of tolerance, so unknown strip can start from anything
+    result = bytearray(previous or bytes(len(frame)))
+    for command_id, data in commands:
+        apply_command(result, command_id, data)
+    return commands, bytes(result)
@@ -0,0 +1,147 @@
+from bisect import bisect_left
+from typing import Callable, Iterable, Iterator, Optional, TypeVar, Union
+
+# Seconds, suitable both for LAN round-trip time and event loop lag
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+def _format_labels(labels: dict[str, str]) -> str:
+    if not labels:
+        return ''
+    escaped = (
+        f'{key}="' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for key, value in labels.items()
+    )
+    return '{' + ','.join(escaped) + '}'
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, inc() is a plain attribute update so it is cheap enough for every packet"""
+    kind = 'counter'
+
+    __slots__ = ('name', 'help', 'value')
+
+    def __init__(self, name: str, help_text: str) -> None:
+        self.name = name
+        self.help = help_text
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+    def samples(self) -> Iterator[tuple[str, dict[str, str], float]]:
+        yield self.name, {}, self.value
+
+
+class Gauge:
+    """Value which is read from the callback at collection time"""
+    kind = 'gauge'
+
+    __slots__ = ('name', 'help', 'value', '_callback')
+
+    def __init__(self, name: str, help_text: str, callback: Optional[Callable[[], float]] = None) -> None:
+        self.name = name
+        self.help = help_text
+        self.value = 0.0
+        self._callback = callback
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def samples(self) -> Iterator[tuple[str, dict[str, str], float]]:
+        yield self.name, {}, self._callback() if self._callback is not None else self.value
+
+
+class Histogram:
+    """Histogram with fixed buckets, cumulative counts are calculated at collection time"""
+    kind = 'histogram'
+
+    __slots__ = ('name', 'help', 'labels', 'buckets', 'counts', 'sum')
+
+    def __init__(
+            self,
+            name: str,
+            help_text: str,
+            buckets: Iterable[float] = DEFAULT_BUCKETS,
+            labels: Optional[dict[str, str]] = None,
+    ) -> None:
+        self.name = name
+        self.help = help_text
+        self.labels = labels or {}
+        self.buckets = tuple(sorted(buckets))
+        # The last one is +Inf bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+
+    @property
+    def count(self) -> int:
+        return sum(self.counts)
+
+    def samples(self) -> Iterator[tuple[str, dict[str, str], float]]:
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), self.counts):
+            cumulative += count
+            yield f'{self.name}_bucket', {**self.labels, 'le': _format_value(bound)}, cumulative
+        yield f'{self.name}_sum', self.labels, self.sum
+        yield f'{self.name}_count', self.labels, cumulative
+
+
+class HistogramFamily:
+    """Histograms with the same name split by one label, e.g. per device"""
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, label: str, buckets: Iterable[float] = DEFAULT_BUCKETS) -> None:
+        self.name = name
+        self.help = help_text
+        self.label = label
+        self.buckets = tuple(buckets)
+        self.children: dict[str, Histogram] = {}
+
+    def labels(self, value: str) -> Histogram:
+        histogram = self.children.get(value)
+        if histogram is None:
+            histogram = self.children[value] = Histogram(self.name, self.help, self.buckets, {self.label: value})
+        return histogram
+
+    def samples(self) -> Iterator[tuple[str, dict[str, str], float]]:
+        for histogram in self.children.values():
+            yield from histogram.samples()
+
+
+Metric = Union[Counter, Gauge, Histogram, HistogramFamily]
+MetricT = TypeVar('MetricT', Counter, Gauge, Histogram, HistogramFamily)
+
+
+class MetricsRegistry:
+    """Set of metrics rendered in Prometheus text exposition format"""
+
+    def __init__(self) -> None:
+        self._metrics: dict[str, Metric] = {}
+
+    def register(self, metric: MetricT) -> MetricT:
+        if metric.name in self._metrics:
+            raise ValueError(f'Metric {metric.name} is already registered')
+        self._metrics[metric.name] = metric
+        return metric
+
+    def __getitem__(self, name: str) -> Metric:
+        return self._metrics[name]
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
@@ -41,6 +41,8 @@ struct protocol_packet_control
     char protocol_header[3];
     char protocol_version;
     protocol_type_t protocol_type;
+    // Command counter, it is sent back in answer, so client matches answers of several commands sent at once
+    unsigned char sequence;
     unsigned long device_id;
     unsigned char command_id;
 };
@@ -84,6 +86,24 @@ void sendCommonAnswer(protocol_type_t packet_type, common_answer_code_t code)
     sendCommonAnswer(packet_type, code, 0, 0);
 }
 
+void sendControlAnswer(unsigned char sequence, common_answer_code_t code)
+{
+    unsigned long device_id = ESP.getChipId();
+    char crc = 0x39 ^ (char)protocol_type_t::CONTROL ^ sequence ^ 0x90 ^ (char)code;
+    for (size_t i = 0; i < sizeof(device_id); i++)
+        crc ^= ((char*)&device_id)[i];
+    Udp.beginPacket(IP_BROADCAST, localPort);
+    Udp.write("QLP");
+    Udp.write(PROTOCOL_VERSION);
+    Udp.write((char)protocol_type_t::CONTROL);
+    Udp.write(sequence);
+    Udp.write((uint8_t*)&device_id, sizeof(device_id));
+    Udp.write(0x90);
+    Udp.write((char)code);
+    Udp.write(crc);
+    Udp.endPacket();
+}
+
 void handle_udp()
 {
     // Check has data
@@ -155,13 +175,14 @@ void handle_udp()
         if (((protocol_packet_control*)packetBuffer)->device_id != ESP.getChipId())
             return;
 
+        unsigned char sequence = ((protocol_packet_control*)packetBuffer)->sequence;
         unsigned char command_id = ((protocol_packet_control*)packetBuffer)->command_id;
         unsigned char* data_ptr = (unsigned char*)packetBuffer + sizeof(protocol_packet_control);
         unsigned int data_len = n - sizeof(protocol_packet_control) - 1; // header and crc
 
         if (command_id == 0x74)
         {
-            sendCommonAnswer(protocol_type_t::CONTROL, common_answer_code_t::OK);
+            sendControlAnswer(sequence, common_answer_code_t::OK);
             strip.fill(0);
             strip.show();
             ESP.reset();
@@ -174,10 +195,10 @@ void handle_udp()
                 strip.updateLength(data_ptr[0]); // TODO: must be 2 bytes
                 strip.setPixelColor(data_ptr[0] - 1, 0x0000FF);
                 strip.show(); // HERE FOR TEST
-                sendCommonAnswer(protocol_type_t::CONTROL, common_answer_code_t::OK);
+                sendControlAnswer(sequence, common_answer_code_t::OK);
             }
             else
-                sendCommonAnswer(protocol_type_t::CONTROL, common_answer_code_t::LENGTH_ERROR);
+                sendControlAnswer(sequence, common_answer_code_t::LENGTH_ERROR);
         }
         if (command_id == 0x54)
         {
@@ -186,10 +207,10 @@ void handle_udp()
                 unsigned long color = (data_ptr[0] << 16) | (data_ptr[1] << 8) | data_ptr[2];
                 strip.fill(color);
                 strip.show(); // HERE FOR TEST
-                sendCommonAnswer(protocol_type_t::CONTROL, common_answer_code_t::OK);
+                sendControlAnswer(sequence, common_answer_code_t::OK);
             }
             else
-                sendCommonAnswer(protocol_type_t::CONTROL, common_answer_code_t::LENGTH_ERROR);
+                sendControlAnswer(sequence, common_answer_code_t::LENGTH_ERROR);
         }
         if (command_id == 0x51)
         {
@@ -199,10 +220,10 @@ void handle_udp()
                 unsigned long color = (data_ptr[2] << 16) | (data_ptr[3] << 8) | data_ptr[4];
                 strip.setPixelColor(index, color);
                 strip.show(); // HERE FOR TEST
-                sendCommonAnswer(protocol_type_t::CONTROL, common_answer_code_t::OK);
+                sendControlAnswer(sequence, common_answer_code_t::OK);
             }
             else
-                sendCommonAnswer(protocol_type_t::CONTROL, common_answer_code_t::LENGTH_ERROR);
+                sendControlAnswer(sequence, common_answer_code_t::LENGTH_ERROR);
         }
         if (command_id == 0x52)
         {
@@ -216,10 +237,10 @@ void handle_udp()
                     strip.setPixelColor(i, color);
                 }
                 strip.show(); // HERE FOR TEST
-                sendCommonAnswer(protocol_type_t::CONTROL, common_answer_code_t::OK);
+                sendControlAnswer(sequence, common_answer_code_t::OK);
             }
             else
-                sendCommonAnswer(protocol_type_t::CONTROL, common_answer_code_t::LENGTH_ERROR);
+                sendControlAnswer(sequence, common_answer_code_t::LENGTH_ERROR);
         }
     }
 }